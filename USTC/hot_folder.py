@@ -0,0 +1,324 @@
+"""
+监控文件夹自动生成报告
+用法：python hot_folder.py [--inbox 共享盘路径] [--workers 2] [--template 模板.xlsx] [--once]
+
+检验员在收件目录下为每批货新建一个子文件夹，放入照片和任务文件 job.json：
+{
+    "po_number": "4500123456", "sku": "P61718/M50XTCCSEN", "ship_quantity": 1800,
+    "inspector": "张三",
+    "inspection_date": "可选，默认当天", "defects": [{"description": "划痕", "major": 1}]
+}
+其余字段（customer、approver 等）与 GUI 填写的一致，可选
+子文件夹出现 READY 标记文件，或内容在 quiet_seconds 内不再变化，即视为放好并排队生成。
+照片按文件名分配步骤、识别缺陷图（与 GUI 扫描规则一致）。
+成功后报告写入 reports 目录、任务文件夹移到 done；失败的移到 failed 并附 error.txt。
+任务队列保存在收件目录下的 SQLite 文件中，程序重启后未完成的任务继续处理。
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import config
+from main import (STEP_NAMES, InspectionReportGenerator, PreflightError, create_output_cache,
+                  create_report_archive, create_staging_cache, model_prefix)
+from report_cache import TemplateCache, ImageCache
+
+
+class JobQueue:
+    """
+    持久化任务队列（SQLite，仅由调度线程访问）
+    status: queued -> running -> done / failed
+    """
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                name TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                signature TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                enqueued REAL,
+                finished REAL,
+                output TEXT,
+                error TEXT
+            )""")
+        self.conn.commit()
+
+    def recover(self):
+        """上次运行中断时处于 running 的任务重新排队"""
+        with self.conn:
+            return self.conn.execute("UPDATE jobs SET status='queued' WHERE status='running'").rowcount
+
+    def get(self, name):
+        row = self.conn.execute("SELECT status, signature FROM jobs WHERE name=?", (name,)).fetchone()
+        return row if row else (None, None)
+
+    def enqueue(self, name, signature):
+        """
+        加入队列；同名任务重新交来（内容变化或上次已结束）时重新计算尝试次数，
+        只有处理中途中断的次数计入 max_attempts
+        """
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO jobs (name, status, signature, attempts, enqueued) VALUES (?, 'queued', ?, 0, ?) "
+                "ON CONFLICT(name) DO UPDATE SET status='queued', signature=excluded.signature, "
+                "enqueued=excluded.enqueued, attempts=CASE "
+                "WHEN jobs.status IN ('done', 'failed') OR jobs.signature IS NOT excluded.signature THEN 0 "
+                "ELSE jobs.attempts END", (name, signature, time.time()))
+
+    def next_queued(self, limit, exclude):
+        rows = self.conn.execute(
+            "SELECT name, attempts FROM jobs WHERE status='queued' ORDER BY enqueued").fetchall()
+        return [r for r in rows if r[0] not in exclude][:limit]
+
+    def mark_running(self, name):
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET status='running', attempts=attempts+1 WHERE name=?", (name,))
+
+    def finish(self, name, ok, output=None, error=None, signature=None):
+        """signature 不为空时同时更新文件夹签名（未能移走的文件夹按结束时的内容记录）"""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status=?, finished=?, output=?, error=?, signature=COALESCE(?, signature) "
+                "WHERE name=?", ('done' if ok else 'failed', time.time(), output, error, signature, name))
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+def _folder_signature(folder):
+    """文件夹内容签名（文件名、大小、修改时间），用于判断是否仍在写入"""
+    entries = []
+    for entry in os.scandir(folder):
+        if entry.is_file():
+            st = entry.stat()
+            entries.append(f"{entry.name}:{st.st_size}:{st.st_mtime_ns}")
+    return "|".join(sorted(entries))
+
+
+def _unique_path(path):
+    """目标已存在时在名称后追加时间戳"""
+    if not os.path.exists(path):
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}_{datetime.now():%Y%m%d%H%M%S}{ext}"
+
+
+class HotFolderWatcher:
+    def __init__(self, base_dir, template_path=None, cfg=None):
+        self.cfg = dict(config.HOT_FOLDER_CONFIG, **(cfg or {}))
+        resolve = lambda p: p if os.path.isabs(p) else os.path.join(base_dir, p)
+        self.inbox = resolve(self.cfg["inbox"])
+        self.output_dir = resolve(self.cfg["output_dir"])
+        self.done_dir = resolve(self.cfg["done_dir"])
+        self.failed_dir = resolve(self.cfg["failed_dir"])
+        for d in (self.inbox, self.output_dir, self.done_dir, self.failed_dir):
+            os.makedirs(d, exist_ok=True)
+        self.template_path = template_path or os.path.join(base_dir, "模板.xlsx")
+
+        self.generator = InspectionReportGenerator(template_cache=TemplateCache(),
+                                                   image_cache=ImageCache(),
+                                                   output_cache=create_output_cache(base_dir),
+                                                   staging=create_staging_cache(base_dir),
+                                                   archive=create_report_archive(base_dir))
+        self.queue = JobQueue(os.path.join(self.inbox, ".hot_folder.db"))
+        self.executor = ThreadPoolExecutor(max_workers=self.cfg["workers"], thread_name_prefix="hot-folder")
+        self.in_flight = {}   # name -> Future
+        self._seen = {}       # name -> (签名, 首次看到该签名的时间)
+
+    # ---------------- 发现任务 ----------------
+
+    def _is_ready(self, name, folder):
+        """出现标记文件，或有任务文件且内容在静默时间内未变化"""
+        if os.path.exists(os.path.join(folder, self.cfg["marker"])):
+            return True
+        if not os.path.exists(os.path.join(folder, self.cfg["job_file"])):
+            return False
+        signature = _folder_signature(folder)
+        now = time.time()
+        last = self._seen.get(name)
+        if last is None or last[0] != signature:
+            self._seen[name] = (signature, now)
+            return False
+        return now - last[1] >= self.cfg["quiet_seconds"]
+
+    def scan_inbox(self):
+        """发现放好的任务文件夹并加入队列"""
+        present = set()
+        for entry in os.scandir(self.inbox):
+            if not entry.is_dir() or entry.name.startswith('.'):
+                continue
+            name = entry.name
+            present.add(name)
+            if name in self.in_flight:
+                continue
+            status, old_signature = self.queue.get(name)
+            if status in ('queued', 'running'):
+                continue
+            if status is not None and _folder_signature(entry.path) == old_signature:
+                self._seen.pop(name, None)
+                continue  # 已处理过但未能移走的文件夹，内容未变不再重复处理
+            if not self._is_ready(name, entry.path):
+                continue
+            self.queue.enqueue(name, _folder_signature(entry.path))
+            self._seen.pop(name, None)
+            print(f"✓ 新任务排队: {name}")
+        # 已被移走的文件夹不再跟踪
+        for name in set(self._seen) - present:
+            del self._seen[name]
+
+    # ---------------- 执行任务 ----------------
+
+    def _load_job(self, folder):
+        with open(os.path.join(folder, self.cfg["job_file"]), encoding='utf-8') as f:
+            job = json.load(f)
+        if not isinstance(job, dict):
+            raise ValueError("任务文件必须是JSON对象")
+        defects = job.pop('defects', None) or []
+        template = job.pop('template', None) or self.template_path
+        data = dict(job)
+        data['ship_quantity'] = int(data.get('ship_quantity') or 0)
+        today = datetime.now().strftime("%Y/%m/%d")
+        data.setdefault('inspection_date', today)
+        data.setdefault('ship_date', today)
+        if not data.get('report_no'):
+            data['report_no'] = self.generator.generate_report_no()
+        return template, data, defects
+
+    def _run_job(self, name):
+        """在工作线程中执行，返回 (成功, 报告路径, 错误描述)"""
+        folder = os.path.join(self.inbox, name)
+        try:
+            template, data, defects = self._load_job(folder)
+        except (OSError, ValueError, TypeError) as e:
+            return False, None, f"任务文件无效: {e}"
+
+        step_images = {step: [] for step in STEP_NAMES}
+        defect_images = []
+        for img in self.generator.scan_images_folder(folder, screen_quality=False):
+            if img['step'] in step_images:
+                step_images[img['step']].append(img['path'])
+            if img['defect']:
+                defect_images.append(img['path'])
+
+        po_number = str(data.get('po_number', '')).strip() or "PO"
+        output = _unique_path(os.path.join(
+            self.output_dir, f"{model_prefix(data.get('sku', ''))}_{po_number}.xlsx"))
+        try:
+            ok = self.generator.build_report(template, data, defects, step_images, defect_images, output)
+        except PreflightError as e:
+            return False, None, f"预检未通过:\n{e}"
+        if not ok:
+            return False, None, "报告生成失败，详见日志"
+        return True, output, None
+
+    def _finish(self, name, ok, output, error):
+        folder = os.path.join(self.inbox, name)
+        target_root = self.done_dir if ok else self.failed_dir
+        signature = None
+        try:
+            if not ok:
+                with open(os.path.join(folder, "error.txt"), 'w', encoding='utf-8') as f:
+                    f.write(error or "")
+            shutil.move(folder, _unique_path(os.path.join(target_root, name)))
+        except OSError as e:
+            print(f"⚠ 移动任务文件夹失败 {name}: {e}")
+            # 文件夹留在收件目录：按写入 error.txt 后的内容记录签名，内容不再变化就不会重新排队
+            try:
+                signature = _folder_signature(folder)
+            except OSError:
+                pass
+        self.queue.finish(name, ok, output, error, signature)
+        if ok:
+            print(f"✓ 任务完成: {name} -> {output}")
+        else:
+            print(f"✗ 任务失败: {name}: {error}")
+
+    def collect(self):
+        """收取已完成的任务"""
+        for name, future in list(self.in_flight.items()):
+            if not future.done():
+                continue
+            del self.in_flight[name]
+            try:
+                ok, output, error = future.result()
+            except Exception as e:
+                ok, output, error = False, None, str(e)
+            self._finish(name, ok, output, error)
+
+    def dispatch(self):
+        """有空闲工作线程时，从持久化队列取出最早的任务执行"""
+        free = self.cfg["workers"] - len(self.in_flight)
+        if free <= 0:
+            return
+        for name, attempts in self.queue.next_queued(free, self.in_flight):
+            if not os.path.isdir(os.path.join(self.inbox, name)):
+                self.queue.finish(name, False, error="任务文件夹已不存在")
+                continue
+            if attempts >= self.cfg["max_attempts"]:
+                # 多次在处理中途中断（如程序崩溃），不再重试
+                self._finish(name, False, None, "多次处理未完成，已放弃")
+                continue
+            self.queue.mark_running(name)
+            self.in_flight[name] = self.executor.submit(self._run_job, name)
+
+    def run_once(self):
+        self.collect()
+        self.scan_inbox()
+        self.dispatch()
+
+    def run(self, once=False):
+        recovered = self.queue.recover()
+        if recovered:
+            print(f"✓ 恢复 {recovered} 个上次未完成的任务")
+        print(f"✓ 开始监控: {self.inbox}")
+        try:
+            while True:
+                try:
+                    self.run_once()
+                except Exception as e:
+                    # 共享盘短暂断开、任务文件夹在扫描中途被移走等：记录后下一轮继续
+                    print(f"⚠ 监控出错，稍后重试: {e}")
+                # --once：没有处理中、排队中、等待静默的任务时退出
+                if once and not self.in_flight and not self._seen and not self.queue.next_queued(1, ()):
+                    break
+                time.sleep(1 if self.in_flight else self.cfg["poll_seconds"])
+        finally:
+            self.executor.shutdown(wait=True)
+            self.collect()
+        return self.queue.counts()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="监控文件夹自动生成报告")
+    parser.add_argument('--inbox', default=None, help="收件目录")
+    parser.add_argument('--workers', type=int, default=config.HOT_FOLDER_CONFIG["workers"])
+    parser.add_argument('--template', default=None, help="默认模板路径")
+    parser.add_argument('--once', action='store_true', help="处理完当前已放好的任务后退出")
+    args = parser.parse_args()
+
+    if getattr(sys, 'frozen', False):
+        base_dir = os.path.dirname(sys.executable)
+    else:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+
+    cfg = {'workers': args.workers}
+    if args.inbox:
+        cfg['inbox'] = args.inbox
+    watcher = HotFolderWatcher(base_dir, template_path=args.template, cfg=cfg)
+    try:
+        print(f"任务统计: {watcher.run(once=args.once)}")
+    except KeyboardInterrupt:
+        print("监控已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""
+图片大图查看窗口
+- 打开时先用 JPEG draft 模式解码屏幕尺寸的预览，立即显示
+- 放大后按需在后台线程解码对应缩放级别的分块，分块缓存在内存中（LRU）
+- 未加载完的分块先用预览图放大后的低清版本占位
+"""
+
+import queue
+import threading
+import tkinter as tk
+from collections import OrderedDict
+from io import BytesIO
+from tkinter import ttk
+
+from PIL import Image, ImageTk
+
+import config
+import zip_photos
+
+
+# 分块缩放级别：原图的 1/1、1/2、1/4、1/8（与 JPEG draft 支持的缩放比例一致）
+LEVELS = (1, 2, 4, 8)
+
+
+class TileSource:
+    """
+    按缩放级别和分块坐标提供图片分块（可在后台线程调用）
+    只保留最近使用的一个级别的解码结果，避免同时占用多份整图内存
+    """
+
+    def __init__(self, path, tile_size=512, cache_tiles=96):
+        self.path = path
+        self.tile_size = tile_size
+        self.cache_tiles = cache_tiles
+        # 压缩包内的图片只读取一次，之后各级别都从内存解码
+        self._data = zip_photos.read_bytes(path) if zip_photos.is_member(path) else None
+        with self._open() as img:
+            self.size = img.size
+        self._lock = threading.Lock()
+        self._tiles = OrderedDict()  # (level, tx, ty) -> PIL.Image
+        self._level_image = None     # (level, 该级别解码后的整图)
+
+    def _open(self):
+        return Image.open(BytesIO(self._data) if self._data is not None else self.path)
+
+    def preview(self, max_size):
+        """解码不超过 max_size 的预览图（JPEG 使用 draft 模式，只解码所需的分辨率）"""
+        with self._open() as img:
+            img.draft('RGB', max_size)
+            img = img.convert('RGB')
+            img.thumbnail(max_size, Image.Resampling.LANCZOS)
+            return img
+
+    def _decode_level(self, level):
+        with self._lock:
+            if self._level_image and self._level_image[0] == level:
+                return self._level_image[1]
+        width, height = self.size
+        target = (max(1, width // level), max(1, height // level))
+        with self._open() as img:
+            img.draft('RGB', target)
+            img = img.convert('RGB')
+            if img.size != target:
+                img = img.resize(target, Image.Resampling.LANCZOS)
+        with self._lock:
+            self._level_image = (level, img)
+        return img
+
+    def cached_tile(self, level, tx, ty):
+        with self._lock:
+            tile = self._tiles.get((level, tx, ty))
+            if tile is not None:
+                self._tiles.move_to_end((level, tx, ty))
+            return tile
+
+    def tile(self, level, tx, ty):
+        """返回指定级别下第 (tx, ty) 个分块"""
+        tile = self.cached_tile(level, tx, ty)
+        if tile is not None:
+            return tile
+        img = self._decode_level(level)
+        ts = self.tile_size
+        box = (tx * ts, ty * ts, min((tx + 1) * ts, img.width), min((ty + 1) * ts, img.height))
+        tile = img.crop(box)
+        tile.load()
+        with self._lock:
+            self._tiles[(level, tx, ty)] = tile
+            while len(self._tiles) > self.cache_tiles:
+                self._tiles.popitem(last=False)
+        return tile
+
+    def release(self):
+        with self._lock:
+            self._tiles.clear()
+            self._level_image = None
+
+
+class ImageViewer(tk.Toplevel):
+    """可缩放的大图查看窗口：滚轮缩放（以鼠标位置为中心），拖动平移"""
+
+    POLL_MS = 40
+
+    def __init__(self, master, image_path, title=None):
+        super().__init__(master)
+        cfg = config.VIEWER_CONFIG
+        self.title(title or image_path)
+        self.geometry("{}x{}".format(*cfg["window_size"]))
+        self.max_zoom = cfg["max_zoom"]
+        self.zoom_step = cfg["zoom_step"]
+
+        self.source = TileSource(image_path, cfg["tile_size"], cfg["tile_cache"])
+        self._preview = self.source.preview(self._screen_size())
+        self._preview_scale = self._preview.width / self.source.size[0]
+        self._photos = {}  # 当前显示的 PhotoImage，需保持引用
+
+        # 后台解码线程：请求后进先出，优先加载最新视野；已移出视野的分块不再解码
+        self._requests = queue.LifoQueue()
+        self._results = queue.Queue()
+        self._pending = set()
+        self._wanted = frozenset()
+        self._failed = set()
+        self._closed = False
+        threading.Thread(target=self._decode_worker, daemon=True).start()
+
+        self._build_ui()
+        self.zoom = None
+        self._auto_fit = True
+        self.after_idle(self.fit)
+        self.after(self.POLL_MS, self._poll_results)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+    def _screen_size(self):
+        return self.winfo_screenwidth(), self.winfo_screenheight()
+
+    def _build_ui(self):
+        bar = ttk.Frame(self)
+        bar.pack(fill=tk.X)
+        ttk.Button(bar, text="适应窗口", command=self.fit).pack(side=tk.LEFT, padx=2, pady=2)
+        ttk.Button(bar, text="原始大小", command=lambda: self.set_zoom(1.0)).pack(side=tk.LEFT, padx=2)
+        ttk.Button(bar, text="放大", command=lambda: self.set_zoom(self.zoom * self.zoom_step)).pack(
+            side=tk.LEFT, padx=2)
+        ttk.Button(bar, text="缩小", command=lambda: self.set_zoom(self.zoom / self.zoom_step)).pack(
+            side=tk.LEFT, padx=2)
+        self.status_var = tk.StringVar()
+        ttk.Label(bar, textvariable=self.status_var).pack(side=tk.RIGHT, padx=5)
+
+        frame = ttk.Frame(self)
+        frame.pack(fill=tk.BOTH, expand=True)
+        self.canvas = tk.Canvas(frame, bg='#303030', highlightthickness=0)
+        xbar = ttk.Scrollbar(frame, orient="horizontal", command=self._xview)
+        ybar = ttk.Scrollbar(frame, orient="vertical", command=self._yview)
+        self.canvas.configure(xscrollcommand=xbar.set, yscrollcommand=ybar.set)
+        self.canvas.grid(row=0, column=0, sticky=tk.NSEW)
+        ybar.grid(row=0, column=1, sticky=tk.NS)
+        xbar.grid(row=1, column=0, sticky=tk.EW)
+        frame.rowconfigure(0, weight=1)
+        frame.columnconfigure(0, weight=1)
+
+        self.canvas.bind("<Configure>", self._on_resize)
+        self.canvas.bind("<MouseWheel>", self._on_wheel)                          # Windows
+        self.canvas.bind("<Button-4>", lambda e: self._zoom_at(self.zoom_step, e.x, e.y))  # Linux
+        self.canvas.bind("<Button-5>", lambda e: self._zoom_at(1 / self.zoom_step, e.x, e.y))
+        self.canvas.bind("<ButtonPress-1>", lambda e: self.canvas.scan_mark(e.x, e.y))
+        self.canvas.bind("<B1-Motion>", self._on_drag)
+
+    # ---------- 缩放与平移 ----------
+
+    def _fit_zoom(self):
+        width, height = self.source.size
+        cw = max(self.canvas.winfo_width(), 1)
+        ch = max(self.canvas.winfo_height(), 1)
+        return min(cw / width, ch / height, 1.0)
+
+    def fit(self):
+        self.set_zoom(self._fit_zoom())
+        self._auto_fit = True  # 未手动缩放前，窗口大小变化时保持适应窗口
+
+    def _on_resize(self, event):
+        if self._auto_fit:
+            self.fit()
+        else:
+            self.render()
+
+    def set_zoom(self, zoom, anchor=None):
+        """设置缩放倍数；anchor 为画布上保持不动的点（默认窗口中心）"""
+        zoom = max(min(zoom, self.max_zoom), self._fit_zoom() / 2)
+        cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
+        ax, ay = anchor or (cw / 2, ch / 2)
+        if self.zoom:
+            # 锚点对应的原图坐标
+            src_x = (self.canvas.canvasx(ax)) / self.zoom
+            src_y = (self.canvas.canvasy(ay)) / self.zoom
+        else:
+            src_x, src_y = self.source.size[0] / 2, self.source.size[1] / 2
+        self.zoom = zoom
+        self._auto_fit = False
+        width, height = self._scaled_size()
+        self.canvas.configure(scrollregion=(0, 0, width, height))
+        if width > cw:
+            self.canvas.xview_moveto(max(src_x * zoom - ax, 0) / width)
+        if height > ch:
+            self.canvas.yview_moveto(max(src_y * zoom - ay, 0) / height)
+        self.render()
+
+    def _zoom_at(self, factor, x, y):
+        if self.zoom:
+            self.set_zoom(self.zoom * factor, (x, y))
+
+    def _on_wheel(self, event):
+        self._zoom_at(self.zoom_step if event.delta > 0 else 1 / self.zoom_step, event.x, event.y)
+
+    def _on_drag(self, event):
+        self.canvas.scan_dragto(event.x, event.y, gain=1)
+        self.render()
+
+    def _xview(self, *args):
+        self.canvas.xview(*args)
+        self.render()
+
+    def _yview(self, *args):
+        self.canvas.yview(*args)
+        self.render()
+
+    def _scaled_size(self):
+        width, height = self.source.size
+        return max(1, round(width * self.zoom)), max(1, round(height * self.zoom))
+
+    def _level(self):
+        """当前缩放下够用的最粗级别"""
+        level = 1
+        for candidate in LEVELS:
+            if 1 / candidate >= self.zoom:
+                level = candidate
+        return level
+
+    # ---------- 绘制 ----------
+
+    def render(self):
+        """绘制当前视野：预览图够清晰时直接用预览，否则按分块绘制"""
+        if not self.zoom or self._closed:
+            return
+        self.canvas.delete("img")
+        self._photos = {}
+        width, height = self._scaled_size()
+        self.status_var.set(f"{self.source.size[0]}×{self.source.size[1]}  {self.zoom:.0%}")
+
+        if self.zoom <= self._preview_scale:
+            photo = ImageTk.PhotoImage(self._preview.resize((width, height), Image.Resampling.BILINEAR))
+            self._photos['preview'] = photo
+            self.canvas.create_image(0, 0, image=photo, anchor=tk.NW, tags="img")
+            self._wanted = frozenset()
+            return
+
+        level = self._level()
+        ts = self.source.tile_size
+        shown = ts * level * self.zoom  # 一个分块在画布上的边长
+        x0, y0 = self.canvas.canvasx(0), self.canvas.canvasy(0)
+        x1 = min(x0 + self.canvas.winfo_width(), width)
+        y1 = min(y0 + self.canvas.winfo_height(), height)
+        visible = [(level, tx, ty)
+                   for ty in range(int(y0 // shown), int((y1 - 1) // shown) + 1)
+                   for tx in range(int(x0 // shown), int((x1 - 1) // shown) + 1)]
+        self._wanted = frozenset(visible)
+        for key in visible:
+            tile = self.source.cached_tile(*key)
+            if tile is None:
+                tile = self._placeholder(*key)
+                self._request(key)
+            self._draw_tile(*key, tile)
+
+    def _tile_box(self, level, tx, ty):
+        """分块在画布上的位置和大小"""
+        width, height = self.source.size
+        ts = self.source.tile_size * level
+        left, top = tx * ts, ty * ts
+        right, bottom = min(left + ts, width), min(top + ts, height)
+        z = self.zoom
+        return round(left * z), round(top * z), max(1, round(right * z) - round(left * z)), \
+            max(1, round(bottom * z) - round(top * z)), (left, top, right, bottom)
+
+    def _placeholder(self, level, tx, ty):
+        """分块加载完成前，用预览图的对应区域占位"""
+        *_, (left, top, right, bottom) = self._tile_box(level, tx, ty)
+        s = self._preview_scale
+        return self._preview.crop((int(left * s), int(top * s),
+                                   max(int(right * s), int(left * s) + 1),
+                                   max(int(bottom * s), int(top * s) + 1)))
+
+    def _draw_tile(self, level, tx, ty, tile):
+        x, y, w, h, _ = self._tile_box(level, tx, ty)
+        photo = ImageTk.PhotoImage(tile.resize((w, h), Image.Resampling.BILINEAR))
+        self._photos[(tx, ty)] = photo
+        self.canvas.delete(f"t{tx}_{ty}")
+        self.canvas.create_image(x, y, image=photo, anchor=tk.NW, tags=("img", f"t{tx}_{ty}"))
+
+    # ---------- 后台解码 ----------
+
+    def _request(self, key):
+        if key not in self._pending:
+            self._pending.add(key)
+            self._requests.put(key)
+
+    def _decode_worker(self):
+        while not self._closed:
+            key = self._requests.get()
+            if key is None:
+                return
+            if key in self._wanted:  # 已移出视野（平移或缩放）的分块跳过
+                try:
+                    self.source.tile(*key)
+                except Exception as e:
+                    self._failed.add(key)
+                    print(f"✗ 加载图片分块失败 {self.source.path}: {e}")
+            self._results.put(key)
+
+    def _poll_results(self):
+        """在界面线程中取回后台解码结果并绘制（tkinter 只能在主线程操作）"""
+        if self._closed:
+            return
+        try:
+            while True:
+                key = self._results.get_nowait()
+                self._pending.discard(key)
+                if key in self._wanted:
+                    tile = self.source.cached_tile(*key)
+                    if tile is not None:
+                        self._draw_tile(*key, tile)
+                    elif key not in self._failed:
+                        self._request(key)  # 跳过后又回到视野中的分块，重新排队
+        except queue.Empty:
+            pass
+        self.after(self.POLL_MS, self._poll_results)
+
+    def close(self):
+        self._closed = True
+        self._requests.put(None)
+        self.source.release()
+        self.destroy()
+
+
+def open_viewer(master, image_path, title=None):
+    """打开大图查看窗口，失败时返回None"""
+    try:
+        return ImageViewer(master, image_path, title)
+    except Exception as e:
+        print(f"✗ 打开大图失败 {image_path}: {e}")
+        return None
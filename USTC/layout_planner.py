@@ -0,0 +1,230 @@
+"""
+图片排版规划
+在写入任何内容之前，一次算出所有文字行、图片行的位置（行、列、换行、分页符、续页工作表），
+再由生成器按规划一次性写入。图片数量增加时，表格宽度和排版开销都保持有界
+"""
+
+import math
+
+import config
+
+
+DEFAULT_ROW_PT = 15  # Excel默认行高（磅）
+
+# 纸张尺寸（英寸，纵向 宽, 高），键为 Excel 的 paperSize 编号；未设置时按 A4
+PAPER_SIZES = {
+    1: (8.5, 11), 5: (8.5, 14), 8: (11.69, 16.54), 9: (8.27, 11.69), 11: (5.83, 8.27),
+    12: (9.84, 13.9), 13: (7.17, 10.12),
+}
+
+
+class TextRow:
+    """一行文字（写在起始列）"""
+
+    __slots__ = ('sheet', 'row', 'text')
+
+    def __init__(self, sheet, row, text):
+        self.sheet = sheet
+        self.row = row
+        self.text = text
+
+
+class ImageRow:
+    """一行图片：paths 横向排列，占用 start_col..end_col 列"""
+
+    __slots__ = ('sheet', 'row', 'paths', 'start_col', 'end_col', 'height_pt')
+
+    def __init__(self, sheet, row, paths, start_col, end_col, height_pt):
+        self.sheet = sheet
+        self.row = row
+        self.paths = paths
+        self.start_col = start_col
+        self.end_col = end_col
+        self.height_pt = height_pt
+
+
+class GridCell:
+    """网格中的一张图片（缺陷图），占用 row_span 行 x col_span 列"""
+
+    __slots__ = ('sheet', 'row', 'col', 'path')
+
+    def __init__(self, sheet, row, col, path):
+        self.sheet = sheet
+        self.row = row
+        self.col = col
+        self.path = path
+
+
+class LayoutPlan:
+    """
+    排版结果
+    sheet 为工作表序号：0 为原工作表，1、2... 为依次追加的续页工作表
+    """
+
+    def __init__(self):
+        self.sheet_count = 1
+        self.texts = []        # [TextRow]
+        self.image_rows = []   # [ImageRow]
+        self.grid = []         # [GridCell]
+        self.page_breaks = {}  # sheet -> [在其后分页的行号]
+        self.col_range = None  # (首列, 末列)：需要统一设置列宽的图片列范围
+
+    def add_break(self, sheet, row):
+        rows = self.page_breaks.setdefault(sheet, [])
+        if row > 0 and (not rows or rows[-1] != row):
+            rows.append(row)
+
+    def rows_for(self, sheet):
+        return ([t for t in self.texts if t.sheet == sheet],
+                [r for r in self.image_rows if r.sheet == sheet],
+                [g for g in self.grid if g.sheet == sheet])
+
+    @staticmethod
+    def sheet_title(base, index):
+        """续页工作表名（Excel工作表名最长31个字符）"""
+        if index == 0:
+            return base
+        suffix = f" ({index + 1})"
+        return base[:31 - len(suffix)] + suffix
+
+
+class _Pager:
+    """按行高累计页面高度，放不下时在前一行后插入分页符"""
+
+    def __init__(self, plan, page_height, used=0):
+        self.plan = plan
+        self.page_height = page_height
+        # 已有内容超过一页时 Excel 会自动分页，只计最后一页已占用的部分
+        self.used = used % page_height if page_height else used
+
+    def reset(self):
+        self.used = 0
+
+    def fits(self, height):
+        return not self.page_height or self.used == 0 or self.used + height <= self.page_height
+
+    def place(self, sheet, row, height, keep_with=0):
+        """放置一行；keep_with 为需要与本行保持在同一页的后续高度（标题与其第一行图片）"""
+        if not self.fits(height + keep_with):
+            self.plan.add_break(sheet, row - 1)
+            self.used = 0
+        self.used += height
+
+
+def printable_height(ws):
+    """
+    工作表每页可容纳的行高合计（磅）：纸张高度减去上下页边距，再按打印缩放比例换算
+    LAYOUT_CONFIG["page_height_pt"] 填了数字时直接使用该值；
+    工作表设置了"调整为一页"等按页缩放时由 Excel 自行缩放，返回 0（不插入分页符）
+    """
+    fixed = config.LAYOUT_CONFIG["page_height_pt"]
+    if fixed is not None:
+        return fixed
+    setup = ws.page_setup
+    if ws.sheet_properties.pageSetUpPr is not None and ws.sheet_properties.pageSetUpPr.fitToPage:
+        return 0
+    width, height = PAPER_SIZES.get(int(setup.paperSize or 9), PAPER_SIZES[9])
+    if setup.orientation == 'landscape':
+        height = width
+    margins = ws.page_margins
+    printable = (height - (margins.top or 0) - (margins.bottom or 0)) * 72
+    return max(printable * 100 / (setup.scale or 100), 0)
+
+
+def image_row_metrics(count):
+    """一行 count 张图片占用的列数与行高（磅）"""
+    cfg = config.IMAGE_CONFIG
+    if cfg.get("strip_mode"):
+        # 拼接模式：整行一张横条图片，列按实际列宽覆盖，这里只需行高
+        height_px = cfg["height"] + cfg["strip_caption_px"]
+        return 1, height_px * 0.75
+    cols_per_image = cfg["fixed_col_width"] // 6 + cfg["fixed_col_gap"]
+    return count * cols_per_image, cfg["row_height"]
+
+
+def per_row_limit(total):
+    cfg = config.IMAGE_CONFIG
+    if cfg.get("strip_mode"):
+        return cfg["strip_max_per_row"] if cfg["strip_wrap"] else max(total, 1)
+    return max(config.LAYOUT_CONFIG["max_per_row"], 1)
+
+
+def plan_sections(sections, start_row, start_col, first_sheet_rows=0, continued_start_row=2, page_height=0):
+    """
+    规划图片页
+    sections: [(文字, [图片路径, ...]), ...]，按顺序每段先写一行文字，随后若干行图片
+    start_row: 第一段文字所在行（其上为已写好的表头，共 first_sheet_rows 行，计入第一页高度）
+    page_height: 每页高度（磅，见 printable_height），0 表示不分页
+    """
+    layout = config.LAYOUT_CONFIG
+    plan = LayoutPlan()
+    pager = _Pager(plan, page_height, first_sheet_rows * DEFAULT_ROW_PT)
+    sheet_max = layout["sheet_max_images"]
+    sheet, row, sheet_images = 0, start_row, 0
+    widest = 0
+
+    for text, images in sections:
+        chunks = []
+        if images:
+            per_row = per_row_limit(len(images))
+            chunks = [images[i:i + per_row] for i in range(0, len(images), per_row)]
+        first_height = image_row_metrics(len(chunks[0]))[1] if chunks else 0
+
+        pager.place(sheet, row, DEFAULT_ROW_PT, keep_with=first_height)
+        plan.texts.append(TextRow(sheet, row, text))
+        row += 1
+
+        for chunk in chunks:
+            # 当前工作表图片数已达上限：转到续页工作表，并重复本段文字
+            if sheet_max and sheet_images and sheet_images + len(chunk) > sheet_max:
+                sheet += 1
+                plan.sheet_count = sheet + 1
+                sheet_images = 0
+                row = continued_start_row
+                pager.reset()
+                plan.texts.append(TextRow(sheet, row, f"{text}（续）"))
+                pager.place(sheet, row, DEFAULT_ROW_PT)
+                row += 1
+            cols, height = image_row_metrics(len(chunk))
+            pager.place(sheet, row, height)
+            plan.image_rows.append(ImageRow(sheet, row, chunk, start_col, start_col + cols - 1, height))
+            widest = max(widest, cols)
+            sheet_images += len(chunk)
+            row += 1
+        if chunks:
+            row += 1  # 图片后空一行
+
+    if widest and not config.IMAGE_CONFIG.get("strip_mode"):
+        plan.col_range = (start_col, start_col + widest - 1)
+    return plan
+
+
+def plan_defect_grid(images, start_row, start_col, continued_start_row=2, first_sheet_height=0, page_height=0):
+    """
+    规划首页缺陷图网格（每行 max_cols 张，每张占 row_span 行 x col_span 列）
+    超出 defect_max_grid_rows 行的部分放到缺陷图续页（sheet=1）
+    first_sheet_height: start_row 之上模板内容在当前页已占用的高度（磅），计入第一页
+    page_height: 每页高度（磅，见 printable_height），0 表示不分页
+    """
+    cfg = config.DEFECT_IMAGE_CONFIG
+    layout = config.LAYOUT_CONFIG
+    per_row = cfg["max_cols"]
+    max_grid_rows = layout["defect_max_grid_rows"]
+    block_pt = cfg["row_span"] * DEFAULT_ROW_PT
+
+    plan = LayoutPlan()
+    pager = _Pager(plan, page_height, first_sheet_height)
+    grid_rows = math.ceil(len(images) / per_row)
+    for grid_row in range(grid_rows):
+        if max_grid_rows and grid_row >= max_grid_rows:
+            sheet, local_row, base_row = 1, grid_row - max_grid_rows, continued_start_row
+            if local_row == 0:
+                plan.sheet_count = 2
+                pager.reset()
+        else:
+            sheet, local_row, base_row = 0, grid_row, start_row
+        row = base_row + local_row * cfg["row_span"]
+        pager.place(sheet, row, block_pt)
+        for i, path in enumerate(images[grid_row * per_row:(grid_row + 1) * per_row]):
+            plan.grid.append(GridCell(sheet, row, start_col + i * cfg["col_span"], path))
+    return plan
@@ -4,27 +4,100 @@ M50成品锁报告生成工具
 日期：2024年
 """
 
+import copy
 import os
 import re
 from datetime import datetime
 from pathlib import Path
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageTk
+from io import BytesIO
+from PIL import Image, ImageTk, ImageDraw, ImageFont
 import openpyxl
 from openpyxl.drawing.image import Image as ExcelImage
+from openpyxl.packaging.custom import StringProperty
 from openpyxl.styles import Font, Border, Side, Alignment
-from openpyxl.utils import get_column_letter
+from openpyxl.utils import get_column_letter, column_index_from_string
+from openpyxl.worksheet.pagebreak import Break
 import config  # 导入配置文件
+from xlsx_optimizer import optimize_package, format_stats
+from report_cache import OutputCache, StagingCache
+from report_archive import ReportArchive
+import report_patch
+from xlsx_package import save_workbook_parallel
+from image_viewer import open_viewer
+from layout_planner import DEFAULT_ROW_PT, LayoutPlan, plan_sections, plan_defect_grid, printable_height
+from photo_tags import TagStore
+import photo_quality
+import photo_tiers
+import zip_photos
+from template_schema import SamplingTable, get_schema
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 
-class InspectionReportGenerator:
-    def __init__(self):
-        self.wb = None
-        self.template_path = None
-        self.images_data = []
+class PreflightError(ValueError):
+    """生成前预检失败，problems 为发现的全部问题"""
+
+    def __init__(self, problems):
+        self.problems = list(problems)
+        super().__init__("\n".join(self.problems))
+
+
+class ReportUpdateError(ValueError):
+    """已生成的报告无法增量修改（如合并报告中没有要修改的PO）"""
+
+
+class ReportJob:
+    """
+    单份报告的生成上下文：工作簿、模板路径、填写的数据和缺陷图片
+    每份报告一个 ReportJob，生成器本身不保存任何报告状态，可在多线程间共享
+    多PO合并报告中每个PO一个 ReportJob，共用同一个工作簿：
+    main_sheet 为该PO的检查表名（为空时用模板结构中的主表），sheet_suffix 附加在缺陷图续页名后
+    """
+
+    def __init__(self, template_path, wb, main_sheet=None, sheet_suffix=""):
+        self.template_path = template_path
+        self.wb = wb
+        self.data = {}
         self.defect_images = []
+        self.main_sheet = main_sheet
+        self.sheet_suffix = sheet_suffix
+        self.originals = photo_tiers.OriginalLinks()  # 照片分级存放时需链接原图的图片
+
+    def sheet(self, schema):
+        """本任务填写的检查表"""
+        return self.wb[self.main_sheet or schema.sheet]
+
+
+def _sheet_title(title):
+    """Excel 工作表名最长31个字符"""
+    return title[:31]
+
+
+def _pics_sheet_title(po_number):
+    """PO 的图片页工作表名"""
+    return _sheet_title(f"Reference pictures {po_number}")
+
+
+TEMPLATE_PROPERTY = "ReportTemplate"  # 报告自定义属性：生成所用的模板文件名（更新报告时据此取模板结构）
+
+
+def _write_cells(ws, schema, cells):
+    """按模板结构中预先算好的行列号写入 {坐标: 值}"""
+    for ref, value in cells.items():
+        row, col = schema.coords[ref]
+        ws.cell(row=row, column=col, value=value)
+
+
+class InspectionReportGenerator:
+    def __init__(self, template_cache=None, image_cache=None, output_cache=None, staging=None, archive=None):
+        # 可选的共享缓存（多线程生成时共用，缓存本身线程安全）
+        self.template_cache = template_cache
+        self.image_cache = image_cache
+        self.output_cache = output_cache
+        self.staging = staging  # 网络共享盘图片的本地暂存
+        self.archive = archive  # 生成后自动归档（按部件内容寻址存储）
 
         # 抽样计划数据
         self.sampling_plan = {
@@ -35,19 +108,117 @@ class InspectionReportGenerator:
             'major': [0, 0, 0, 1, 2, 3, 5],
             'minor': [0, 1, 2, 3, 5, 7, 10]
         }
+        self.sampling_table = SamplingTable(self.sampling_plan)
+        self._template_checks = {}  # (模板路径, 修改时间, 大小) -> 预检问题列表
+
+    def _source(self, img_path):
+        """图片的实际读取路径：有本地暂存时读本地副本"""
+        if self.staging is not None:
+            return self.staging.get(img_path)
+        return img_path
+
+    def _check_image(self, img_path):
+        """检查单张图片：存在、文件头可读、尺寸有效（只读文件头，不解码像素）"""
+        name = Path(img_path).name
+        if not zip_photos.exists(img_path):
+            return f"图片不存在: {img_path}"
+        try:
+            with Image.open(zip_photos.open_file(self._source(img_path))) as img:
+                width, height = img.size
+                if width <= 0 or height <= 0:
+                    return f"图片尺寸无效: {name}"
+        except Exception as e:
+            return f"图片无法读取: {name}（{e}）"
+        return None
+
+    def _check_template(self, template_path):
+        """检查模板：主表存在，且覆盖模板结构中用到的全部单元格（同一模板文件只检查一次）"""
+        if not os.path.isfile(template_path):
+            return [f"模板不存在: {template_path}"]
+        st = os.stat(template_path)
+        key = (os.path.abspath(template_path), st.st_mtime_ns, st.st_size)
+        problems = self._template_checks.get(key)
+        if problems is None:
+            problems, opened = self._validate_template(template_path)
+            if opened:
+                self._template_checks[key] = problems
+        return list(problems)
+
+    def _validate_template(self, template_path):
+        """按模板结构检查模板，返回 (问题列表, 是否成功打开)"""
+        schema = get_schema(template_path)
+        try:
+            src = template_path
+            if self.template_cache is not None:
+                src = BytesIO(self.template_cache.get_bytes(template_path)[1])
+            wb = openpyxl.load_workbook(src, read_only=True)
+        except Exception as e:
+            return [f"模板无法打开: {e}"], False
+        try:
+            if schema.sheet not in wb.sheetnames:
+                return [f"模板缺少工作表: {schema.sheet}"], True
+            ws = wb[schema.sheet]
+            max_row, max_col = ws.max_row, ws.max_column
+            if not max_row or not max_col:
+                # 模板未记录尺寸时逐行统计
+                max_row = max_col = 0
+                for row in ws.iter_rows():
+                    max_row = max(max_row, row[0].row if row else 0)
+                    max_col = max(max_col, len(row))
+            if schema.max_row <= max_row and schema.max_col <= max_col:
+                return [], True
+            return [f"模板 {schema.sheet} 缺少单元格: {ref}"
+                    for ref, (row, col) in schema.coords.items() if row > max_row or col > max_col], True
+        finally:
+            wb.close()
+
+    def _check_quantity(self, quantity):
+        try:
+            quantity = int(quantity)
+        except (TypeError, ValueError):
+            return f"出货数量无效: {quantity}"
+        if self.sampling_table.index(quantity) is None:
+            low = self.sampling_plan['ranges'][0][0]
+            return f"出货数量 {quantity} 不在抽样计划范围内（最小 {low}）"
+        return None
+
+    def preflight_check(self, template_path, data, image_paths):
+        """
+        生成前并行预检：图片、模板、出货数量
+        发现问题时抛出 PreflightError（包含全部问题），全部通过返回 True
+        """
+        image_paths = list(dict.fromkeys(image_paths))
+        if self.staging is not None:
+            self.staging.prefetch(image_paths)
+        with ThreadPoolExecutor(max_workers=config.PREFLIGHT_CONFIG["workers"]) as pool:
+            template_future = pool.submit(self._check_template, template_path)
+            image_problems = list(pool.map(self._check_image, image_paths))
+
+        problems = template_future.result()
+        if 'ship_quantity' in data:
+            problems.append(self._check_quantity(data['ship_quantity']))
+        problems.extend(image_problems)
+        problems = [p for p in problems if p]
+        if problems:
+            print(f"✗ 预检发现 {len(problems)} 个问题")
+            raise PreflightError(problems)
+        print(f"✓ 预检通过: 模板 + {len(image_paths)} 张图片")
+        return True
 
     def load_template(self, template_path):
-        """加载Excel模板"""
+        """加载Excel模板，返回新的报告任务（失败返回None）"""
         try:
-            self.wb = openpyxl.load_workbook(template_path)
-            self.template_path = template_path
+            if self.template_cache is not None:
+                wb = self.template_cache.load(template_path)
+            else:
+                wb = openpyxl.load_workbook(template_path)
             print(f"✓ 模板加载成功: {Path(template_path).name}")
-            return True
+            return ReportJob(template_path, wb)
         except Exception as e:
             print(f"✗ 加载模板失败: {e}")
-            return False
+            return None
 
-    def fill_basic_info(self, data):
+    def fill_basic_info(self, job, data):
         """
         填充基本信息
         data格式: {
@@ -63,53 +234,18 @@ class InspectionReportGenerator:
             'approver': 'Gary Tu',
             'approval_date': '2024/03/15'
         }
+        写入位置由模板结构（config.TEMPLATE_SCHEMAS）决定
         """
         try:
-            ws = self.wb['出货检查表']
+            schema = get_schema(job.template_path)
+            ws = job.sheet(schema)
+            job.data = dict(data)
 
             # 填充基本信息
-            if 'inspector' in data:
-                ws['C4'] = data['inspector']  # 检验员
-            if 'inspection_date' in data:
-                ws['G4'] = data['inspection_date']  # 检验日期
-            if 'po_number' in data:
-                ws['G5'] = data['po_number']  # 客户订单号
-                ws['B53'] = f'See tab" Reference pictures {data["po_number"]}"'
-            if 'sku' in data:
-                ws['C6'] = data['sku']  # 料号
-                ws['C17'] = f"BOM {data['sku'] } Rev E  ECO-017206"
-            if 'ship_date' in data:
-                ws['B7'] = f"计划出货日期：{data['ship_date']}"# 计划出货日期
-            if 'ship_quantity' in data:
-                ws['G7'] = data['ship_quantity']  # 出货数量
-            if 'report_no' in data:
-                ws['B3'] = f'出货检查报告编号 {data["report_no"]}'  # 报告编号
-            if 'customer' in data:
-                ws['C5'] = data['customer']
-                # F5 填写客户图纸及版本号
-            if 'sku' in data:
-                sku = data['sku']
-                drawing_no = ""
-                for model, drawing in config.DRAWING_RULES.items():
-                    if model in sku:
-                        drawing_no = drawing
-                        break
-                if not drawing_no:
-                    drawing_no = data.get('drawing_no', '')
-                ws['F6'] = f"客户图纸及版本号：{drawing_no}"
-                ws['C16'] = f"Master Lock drawing: {drawing_no}"
-
-            if 'inspector' in data and 'inspection_date' in data:
-                ws['D49'] = f"{data['inspector']}/{data['inspection_date']}"
-                # C50 填写批准人信息
-            if 'approver' in data:
-                ws['C50'] = data['approver']
-                # D50 填写批准人签名/日期（格式：批准人签名/日期：批准人/批准日期）
-            if 'approver' in data and 'approval_date' in data:
-                ws['D50'] = f"批准人签名/日期：{data['approver']}/{data['approval_date']}"
+            _write_cells(ws, schema, self._basic_info_cells(data, schema))
             # 更新抽样计划
             if 'ship_quantity' in data:
-                self.update_sampling_plan(data['ship_quantity'])
+                self.update_sampling_plan(job, data['ship_quantity'])
 
             print("✓ 基本信息填充完成")
             return True
@@ -118,73 +254,82 @@ class InspectionReportGenerator:
             print(f"✗ 填充基本信息失败: {e}")
             return False
 
-    def update_sampling_plan(self, quantity):
+    @staticmethod
+    def _drawing_no(data):
+        """客户图纸及版本号：按料号匹配 DRAWING_RULES，未匹配时用填写的图纸号"""
+        sku = data['sku']
+        for model, drawing in config.DRAWING_RULES.items():
+            if model in sku:
+                return drawing
+        return data.get('drawing_no', '')
+
+    def _basic_info_cells(self, data, schema=None):
+        """基本信息要写入的单元格 {坐标: 值}（fill_basic_info 与 update_report 共用）"""
+        schema = schema or get_schema()
+        values = dict(data)
+        if 'sku' in data:
+            values['drawing'] = self._drawing_no(data)
+        return {field.ref: field.value(values) for field in schema.fields
+                if all(key in values for key in field.keys)}
+
+    def _sampling_plan_cells(self, quantity, schema=None):
+        """
+        抽样计划要写入的单元格
+        返回 (目标列, {坐标: 值}, 需标红的坐标列表)；数量不在预设区间时返回 (None, {}, [])
+        """
+        schema = schema or get_schema()
+        i = self.sampling_table.index(quantity)
+        if i is None:
+            return None, {}, []
+        values = self.sampling_table.values(i)
+        values['lot_quantity'] = quantity
+        cells = {schema.sampling_ref(i, item): values[item] for item in schema.sampling_rows}
+        red_cells = [schema.sampling_ref(i, item) for item in schema.sampling_highlight]
+        return schema.sampling_columns[i], cells, red_cells
+
+    def update_sampling_plan(self, job, quantity):
         try:
-            ws = self.wb['出货检查表']
-
-            range_col_mapping = {
-                (151, 280): 'C',
-                (281, 500): 'D',
-                (501, 1200): 'E',
-                (1201, 3200): 'F',
-                (3201, 10000): 'G',
-                (10001, 35000): 'H',
-                (35001, float('inf')): 'I'
-            }
+            schema = get_schema(job.template_path)
+            ws = job.sheet(schema)
 
-            # 2. 定义行索引（按你的表格结构）
-            row_mapping = {
-                'lot_quantity': 10,  # Lot quantity行
-                'sample_size': 11,  # Sample Size行
-                'critical': 12,  # Critical [0]行
-                'major': 13,  # Major [1.0]行
-                'minor': 14  # Minor [2.5]行
-            }
+            target_col, cells, red_cells = self._sampling_plan_cells(quantity, schema)
+            if target_col is None:
+                # 若数量不在预设区间（如≤150）
+                print(f"⚠ 出货数量 {quantity} 不在有效范围内")
+                return False
 
-            # 3. 遍历预设区间，匹配数量并处理
-            for i, (min_qty, max_qty) in enumerate(self.sampling_plan['ranges']):
-                if min_qty <= quantity <= max_qty:
-                    # 获取匹配的列
-                    target_col = range_col_mapping[(min_qty, max_qty)]
-
-                    # 4. 填写Lot quantity
-                    lot_quantity_cell = f"{target_col}{row_mapping['lot_quantity']}"
-                    ws[lot_quantity_cell] = quantity
-
-                    # 5. 填写抽样数据到对应行
-                    # Sample Size
-                    sample_size_cell = f"{target_col}{row_mapping['sample_size']}"
-                    ws[sample_size_cell] = self.sampling_plan['sample_sizes'][i]
-                    # Critical [0]
-                    critical_cell = f"{target_col}{row_mapping['critical']}"
-                    ws[critical_cell] = self.sampling_plan['critical'][i]
-                    # Major [1.0]
-                    major_cell = f"{target_col}{row_mapping['major']}"
-                    ws[major_cell] = self.sampling_plan['major'][i]
-                    # Minor [2.5]
-                    minor_cell = f"{target_col}{row_mapping['minor']}"
-                    ws[minor_cell] = self.sampling_plan['minor'][i]
-
-                    # 高亮标红
-                    from openpyxl.styles import Font, PatternFill
-                    red_font = Font(color="FF0000", size=8, bold=False)  # 红色字体
-                    # 批量设置样式
-                    for cell in [sample_size_cell, critical_cell, major_cell, minor_cell]:
-                        ws[cell].font = red_font
-
-                    print(
-                        f"✓ 抽样计划更新: 数量={quantity}, 写入列={target_col}, 样本数={self.sampling_plan['sample_sizes'][i]}")
-                    return True
-
-            # 若数量不在预设区间（如≤150）
-            print(f"⚠ 出货数量 {quantity} 不在有效范围内")
-            return False
+            _write_cells(ws, schema, cells)
+
+            # 高亮标红
+            red_font = Font(color="FF0000", size=8, bold=False)  # 红色字体
+            for ref in red_cells:
+                row, col = schema.coords[ref]
+                ws.cell(row=row, column=col).font = red_font
+
+            print(f"✓ 抽样计划更新: 数量={quantity}, 写入列={target_col}, 样本数={cells[red_cells[0]]}")
+            return True
 
         except Exception as e:
             print(f"✗ 更新抽样计划失败: {e}")
             return False
 
-    def add_defect_records(self, defects):
+    def _defect_record_cells(self, defects, clear_rest=False, schema=None):
+        """缺陷记录要写入的单元格 {坐标: 值}；clear_rest=True 时清空多余的旧记录"""
+        schema = schema or get_schema()
+        cells = {}
+        for i in range(schema.defect_max_rows):
+            if i < len(defects):
+                defect = defects[i]
+                cells[schema.defect_ref(i, 'index')] = i + 1  # 序号
+                cells[schema.defect_ref(i, 'description')] = defect.get('description', '')  # 缺陷品描述
+                for item in ('critical', 'major', 'minor'):  # 致命/严重/轻微缺陷数量
+                    cells[schema.defect_ref(i, item)] = defect.get(item, 0)
+            elif clear_rest:
+                for item in schema.defect_columns:  # 含序号列
+                    cells[schema.defect_ref(i, item)] = None
+        return cells
+
+    def add_defect_records(self, job, defects):
         """
         添加缺陷记录（先取消合并→写入数据→重新合并单元格）
         defects格式: [
@@ -193,11 +338,12 @@ class InspectionReportGenerator:
         ]
         """
         try:
-            ws = self.wb['出货检查表']
+            schema = get_schema(job.template_path)
+            ws = job.sheet(schema)
 
-            # 缺陷记录起始行/结束行（最多8条）
-            start_row = 21  # 第21行开始是缺陷记录
-            end_row = start_row + 7  # 8条记录：21-28行
+            # 缺陷记录起始行/结束行
+            start_row = schema.defect_start_row
+            end_row = start_row + schema.defect_max_rows - 1
 
             # 取消合并单元格
             merge_ranges_to_restore = []
@@ -214,33 +360,28 @@ class InspectionReportGenerator:
                     ws.unmerge_cells(str(merge_range))
 
             # 写入缺陷数据
-            for i, defect in enumerate(defects):
-                if i >= 8:  # 最多8条记录
-                    break
-
-                row = start_row + i
-                ws[f'B{row}'] = i + 1  # 序号
-                ws[f'C{row}'] = defect.get('description', '')  # 缺陷品描述
-                ws[f'G{row}'] = defect.get('critical', 0)  # 致命缺陷数量
-                ws[f'H{row}'] = defect.get('major', 0)  # 严重缺陷数量
-                ws[f'I{row}'] = defect.get('minor', 0)  # 轻微缺陷数量
+            _write_cells(ws, schema, self._defect_record_cells(defects, schema=schema))
 
             # 重新合并单元格
             for merge_info in merge_ranges_to_restore:
                 ws.merge_cells(merge_info['range'])
 
-            print(f"✓ 添加了 {min(len(defects), 8)} 条缺陷记录")
+            print(f"✓ 添加了 {min(len(defects), schema.defect_max_rows)} 条缺陷记录")
             return True
 
         except Exception as e:
             print(f"✗ 添加缺陷记录失败: {e}")
             return False
 
-    def scan_images_folder(self, folder_path):
-        """扫描图片文件夹，按步骤分类"""
+    def scan_images_folder(self, folder_path, screen_quality=True):
+        """
+        扫描图片文件夹（或 .zip 压缩包，压缩包内的图片路径为 "压缩包!/成员名"），按步骤分类（缺陷图片以 'defect' 标记）
+        优先使用文件夹内图片标记索引中的缺陷标记和步骤，没有记录的按文件名识别
+        screen_quality=True 时批量筛查照片质量，结果放在每项的 'quality'（QualityScore，未筛查为None）
+        """
         try:
-            self.images_data = []
-            self.defect_images = []
+            images_data = []
+            tags = TagStore(folder_path)
             image_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.gif']
 
             # 定义步骤关键词
@@ -257,97 +398,122 @@ class InspectionReportGenerator:
                 'Step 5（5）': ['step5_5', 'step5(5)', '步骤5(5)']
             }
 
-            for file_path in Path(folder_path).glob('*'):
-                if file_path.suffix.lower() in image_extensions:
-                    filename = file_path.name.lower()
-
-                    for defect_word in config.DEFECT_WORDS:
-                        if defect_word.lower() in filename:
-                            self.defect_images.append(str(file_path))
-                            break
-                    # 确定图片对应的步骤
-                    assigned_step = None
-                    for step, keywords in step_keywords.items():
-                        if any(keyword in filename for keyword in keywords):
-                            assigned_step = step
-                            break
-
-                    if not assigned_step:
-                        # 尝试从文件名中提取步骤信息
-                        step_match = re.search(r'step[_\s]*(\d+)', filename)
-                        if step_match:
-                            assigned_step = f"Step {step_match.group(1)}"
-                        else:
-                            assigned_step = "Step 1"  # 默认
-
-                    self.images_data.append({
-                        'path': str(file_path),
-                        'filename': file_path.name,
-                        'step': assigned_step
-                    })
+            if zip_photos.is_archive(folder_path):
+                # 压缩包：只读中央目录列出成员，图片在用到时才从压缩包读取
+                entries = [(zip_photos.member_ref(folder_path, name), name)
+                           for name in zip_photos.list_images(folder_path, image_extensions)]
+            else:
+                entries = [(str(p), p.name) for p in Path(folder_path).glob('*')
+                           if p.suffix.lower() in image_extensions]
+
+            for path, name in entries:
+                filename = os.path.basename(name).lower()
+
+                tag = tags.get(name)
+                if 'defect' in tag:
+                    is_defect = tag['defect']
+                else:
+                    is_defect = any(word.lower() in filename for word in config.DEFECT_WORDS)
+                # 确定图片对应的步骤
+                assigned_step = None
+                for step, keywords in step_keywords.items():
+                    if any(keyword in filename for keyword in keywords):
+                        assigned_step = step
+                        break
+
+                if tag.get('step'):
+                    assigned_step = tag['step']
+                elif not assigned_step:
+                    # 尝试从文件名中提取步骤信息
+                    step_match = re.search(r'step[_\s]*(\d+)', filename)
+                    if step_match:
+                        assigned_step = f"Step {step_match.group(1)}"
+                    else:
+                        assigned_step = "Step 1"  # 默认
+
+                images_data.append({
+                    'path': path,
+                    'filename': os.path.basename(name),
+                    'step': assigned_step,
+                    'defect': is_defect
+                })
 
             # 按步骤排序
-            self.images_data.sort(key=lambda x: (
+            images_data.sort(key=lambda x: (
                 x['step'].replace('Step ', ''),
                 x['step'].replace('（', '').replace('）', '')
             ))
 
-            print(f"✓ 扫描到 {len(self.images_data)} 张图片")
-            print(f"✓ 扫描到 {len(self.defect_images)} 张缺陷图片")
-            return self.images_data
+            print(f"✓ 扫描到 {len(images_data)} 张图片")
+            print(f"✓ 扫描到 {sum(1 for d in images_data if d['defect'])} 张缺陷图片")
+
+            scores = {}
+            if screen_quality and config.QUALITY_CONFIG.get("enabled") and images_data:
+                if photo_quality.available():
+                    scores = photo_quality.screen_images([d['path'] for d in images_data], source=self._source)
+                else:
+                    print("⚠ 未安装 NumPy，跳过照片质量筛查")
+            for d in images_data:
+                d['quality'] = scores.get(d['path'])
+            return images_data
 
         except Exception as e:
             print(f"✗ 扫描图片文件夹失败: {e}")
             return []
 
-    def _insert_defect_images(self):
+    def _insert_defect_images(self, job):
         """将所有标记为缺陷的图片以 2xN 网格形式插入，横向跨度为 B-E 和 F-I"""
-        # 1. 严格去重：使用 unique_defect_images 作为统一变量名
-        unique_defect_images = list(dict.fromkeys(self.defect_images))
+        # 1. 严格去重，并跳过不存在的文件（先筛选再排版，网格中不留空位）
+        unique_defect_images = [p for p in dict.fromkeys(job.defect_images) if zip_photos.exists(p)]
 
         if not unique_defect_images:
             return
 
         try:
-            ws = self.wb.active
+            ws = job.wb[job.main_sheet] if job.main_sheet else job.wb.active
             cfg = config.DEFECT_IMAGE_CONFIG
-            from openpyxl.utils import column_index_from_string
-            from openpyxl.utils import get_column_letter
-
-            # 获取起始位置
-            start_col = column_index_from_string("B")  # B列
-            start_row = 55
 
-            for i, img_path in enumerate(unique_defect_images):
-                if not os.path.exists(img_path):
-                    continue
-
-                # 计算网格位置 (i=0 是第一张, i=1 是第二张...)
-                row_idx = i // 2  # 每行2张
-                col_idx = i % 2  # 0代表左边，1代表右边
-
-                # 计算具体的行列坐标
-                # cfg["row_span"] 应该是 14 (54到67行)
-                # cfg["col_span"] 应该是 4 (B到E是4列)
-                current_row = start_row + (row_idx * cfg["row_span"])
-                current_col = start_col + (col_idx * cfg["col_span"])
-
-                # 插入图片
-                excel_img = ExcelImage(img_path)
+            # 2. 先规划全部网格位置（分页、超出行数时放到缺陷图续页），再一次性写入
+            # cfg["row_span"] 应该是 14 (每张图片占14行)，cfg["col_span"] 应该是 4 (B到E是4列)
+            plan = plan_defect_grid(unique_defect_images, start_row=55, start_col=column_index_from_string("B"),
+                                    first_sheet_height=self._height_above(ws, 55),
+                                    page_height=printable_height(ws))
+            sheets = [ws]
+            if plan.sheet_count > 1:
+                title = _sheet_title(config.LAYOUT_CONFIG["defect_sheet"] + job.sheet_suffix)
+                if title in job.wb.sheetnames:
+                    del job.wb[title]
+                ws_more = job.wb.create_sheet(title)
+                ws_more['B1'] = f"{title}（续）"
+                sheets.append(ws_more)
+
+            for cell in plan.grid:
+                target_ws = sheets[cell.sheet]
+                excel_img = self._make_excel_image(cell.path)
                 excel_img.width = cfg["width"]
                 excel_img.height = cfg["height"]
-
-                target_cell = f"{get_column_letter(current_col)}{current_row}"
-                ws.add_image(excel_img, target_cell)
+                self._place_picture(job, target_ws, excel_img, cell.path,
+                                    f"{get_column_letter(cell.col)}{cell.row}", "defects")
 
                 # 调用合并单元格和画边框的函数
-                self._apply_defect_border(ws, current_row, current_col, cfg["row_span"], cfg["col_span"])
+                self._apply_defect_border(target_ws, cell.row, cell.col, cfg["row_span"], cfg["col_span"])
+
+            for index, target_ws in enumerate(sheets):
+                for row in plan.page_breaks.get(index, []):
+                    target_ws.row_breaks.append(Break(id=row))
 
             print(f"✓ 成功在首页插入 {len(unique_defect_images)} 张缺陷图")
 
         except Exception as e:
             print(f"✗ 插入首页缺陷图片失败: {e}")
 
+    @staticmethod
+    def _height_above(ws, row):
+        """row 之上、模板已有分页符之后各行的总高度（磅），未设置行高的按默认行高"""
+        first = max((brk.id for brk in ws.row_breaks.brk if brk.id < row), default=0) + 1
+        heights = (ws.row_dimensions.get(r) for r in range(first, row))
+        return sum((dim.height if dim is not None and dim.height else DEFAULT_ROW_PT) for dim in heights)
+
     def _apply_defect_border(self, ws, row, col, r_span, c_span):
         """为缺陷图片区域添加边框并合并"""
         from openpyxl.styles import Border, Side
@@ -368,17 +534,47 @@ class InspectionReportGenerator:
             for c in range(col, col + c_span):
                 ws.cell(row=r, column=c).border = border
 
+    def _make_excel_image(self, img_path):
+        """创建待插入的图片对象（有图片缓存时从缓存读取；照片分级存放时为压缩后的预览图）"""
+        src = self._source(img_path)
+        tier = config.PHOTO_TIER_CONFIG
+        if tier.get("enabled"):
+            if self.image_cache is not None:
+                data = self.image_cache.preview(src, tier["preview_max_px"], tier["preview_quality"])
+            else:
+                data = photo_tiers.make_preview(src, tier["preview_max_px"], tier["preview_quality"])
+            return ExcelImage(BytesIO(data))
+        if self.image_cache is not None:
+            return ExcelImage(self.image_cache.open(src))
+        return ExcelImage(zip_photos.open_file(src))
+
+    @staticmethod
+    def _place_picture(job, ws, img, img_path, ref, kind):
+        """
+        把图片放到 ref 单元格；照片分级存放且该类图片（kind: defects/steps）需附原图时，
+        图片带上指向原图的超链接（原图在保存时复制）
+        """
+        tier = config.PHOTO_TIER_CONFIG
+        if tier.get("enabled") and tier["originals"] in ("all", kind):
+            rid = job.originals.add(img_path)
+            index = len(ws._charts) + len(ws._images) + 1
+            img.anchor = photo_tiers.linked_anchor(ref, img.width, img.height, index, rid,
+                                                   os.path.basename(img_path))
+            ws.add_image(img)
+        else:
+            ws.add_image(img, ref)
+
     def create_thumbnail(self, image_path, size=(200, 150)):
         """创建缩略图"""
         try:
-            img = Image.open(image_path)
+            img = Image.open(zip_photos.open_file(self._source(image_path)))
             img.thumbnail(size, Image.Resampling.LANCZOS)
             return img
         except Exception as e:
             print(f"✗ 创建缩略图失败 {image_path}: {e}")
             return None
 
-    def insert_images_to_excel(self, step_images_mapping,po_number):
+    def insert_images_to_excel(self, job, step_images_mapping, po_number):
         """
         将图片插入到Reference pictures工作表
         step_images_mapping格式: {
@@ -389,10 +585,11 @@ class InspectionReportGenerator:
         """
         try:
             # 1. 初始化图片工作表
-            if 'Reference pictures' not in self.wb.sheetnames:
-                ws_pics = self.wb.create_sheet(f"Reference pictures {po_number}")
+            pics_title = _pics_sheet_title(po_number)
+            if pics_title not in job.wb.sheetnames:
+                ws_pics = job.wb.create_sheet(pics_title)
             else:
-                ws_pics = self.wb[f"Reference pictures {po_number}"]
+                ws_pics = job.wb[pics_title]
 
             # 清空原有内容
             ws_pics.delete_rows(1, ws_pics.max_row + 1)
@@ -420,12 +617,11 @@ class InspectionReportGenerator:
             # 对齐方式（垂直居中）
             align = Alignment(vertical="center")
 
-            # 3. 获取基础数据（PO号/SKU/日期/检验员）
-            ws_main = self.wb['出货检查表']
-            po_number = ws_main['G5'].value or "PO-UNKNOWN"
-            sku = ws_main['C6'].value or ""
-            inspection_date = ws_main['G4'].value or ""
-            inspector = ws_main['C4'].value or ""
+            # 3. 获取基础数据（PO号/SKU/日期/检验员，来自本任务填写的数据）
+            po_number = job.data.get('po_number') or "PO-UNKNOWN"
+            sku = job.data.get('sku') or ""
+            inspection_date = job.data.get('inspection_date') or ""
+            inspector = job.data.get('inspector') or ""
 
             # 4. 填充标题行（B1）
             current_row = 1
@@ -450,159 +646,514 @@ class InspectionReportGenerator:
             ws_pics[f'F{current_row}'].font = base_font
             ws_pics[f'G{current_row}'].font = base_font
 
-            # 7. 填充Step1-Step4文本+图片
-            step_order = ["Step 1", "Step 2", "Step 3", "Step 4"]
-            for step in step_order:
-                current_row += 1
+            # 7. 汇总各段文字及对应图片：Step1-Step4、Step5标题、Step5子项（a-j）
+            sections = []
+            for step in ["Step 1", "Step 2", "Step 3", "Step 4"]:
                 # 统一键名：Step 1 → step1
                 step_key = step.lower().replace(" ", "")  # 转为step1/step2...
                 step_text = config.STEP_TEXT.get(step_key, f"{step}) 无描述")
-                ws_pics[f'B{current_row}'] = step_text
-                ws_pics[f'B{current_row}'].font = base_font
-
-                # 插入Step图片（横向排列，带边框）
-                images = step_images_mapping.get(step, [])
-                if images:
-                    current_row += 1
-                    self._insert_images_with_border(
-                        ws_pics=ws_pics,
-                        start_row=current_row,
-                        start_col=2,  # B列开始
-                        images=images,
-                        border=black_border,
-                        font=base_font,
-                        align=align
-                    )
-                    # 图片行高适配
-                    ws_pics.row_dimensions[current_row].height = config.IMAGE_CONFIG["row_height"]
-                    current_row += 1  # 图片后空一行
-
-            # 8. 填充Step5文本+子项+图片
-            current_row += 1
-            # Step5主标题
-            ws_pics[f'B{current_row}'] = config.STEP_TEXT["step5_title"]
-            ws_pics[f'B{current_row}'].font = base_font
+                sections.append((step_text, step_images_mapping.get(step, [])))
+            sections.append((config.STEP_TEXT["step5_title"], []))
 
-            # Step5子项文本（a-j）
             step5_sub_items = [
                 "step5_1", "step5_2", "step5_3", "step5_4", "step5_5",
                 "step5_6", "step5_7", "step5_8", "step5_9", "step5_10", "step5_11"
             ]
             for sub_item in step5_sub_items:
-                current_row += 1
-                # 写入子项文本
                 sub_text = config.STEP_TEXT.get(sub_item, f"{sub_item}: 无描述")
-                ws_pics[f'B{current_row}'] = sub_text
-                ws_pics[f'B{current_row}'].font = base_font
-
                 # 匹配Step5细分图片
                 target_step = config.STEP5_IMAGE_MAP.get(sub_item)
-                if target_step:
-                    print(f"匹配到Step5子项 {sub_item} → 图片步骤 {target_step}")
-                    # 插入Step5细分图片
-                    if step_images_mapping.get(target_step):
-                        current_row += 1
-                        self._insert_images_with_border(
-                            ws_pics=ws_pics,
-                            start_row=current_row,
-                            start_col=2,
-                            images=step_images_mapping[target_step],
-                            border=black_border,
-                            font=base_font,
-                            align=align
-                        )
-                        ws_pics.row_dimensions[current_row].height = config.IMAGE_CONFIG["row_height"]
-                        current_row += 1  # 图片后空一行
-                    else:
-                        print(f"Step5子项 {sub_item} 对应步骤 {target_step} 无图片")
-                else:
+                images = step_images_mapping.get(target_step, []) if target_step else []
+                if not target_step:
                     print(f" Step5子项 {sub_item} 无对应的图片步骤映射")
+                elif not images:
+                    print(f"Step5子项 {sub_item} 对应步骤 {target_step} 无图片")
+                sections.append((sub_text, images))
+
+            # 8. 先规划全部位置（换行、分页、续页），再一次性写入
+            plan = plan_sections(sections, start_row=current_row + 1, start_col=2,
+                                 first_sheet_rows=current_row, page_height=printable_height(ws_pics))
+            self._apply_picture_layout(job, ws_pics, plan, title_text, base_font, black_border, align)
             return True
         except Exception as e:
             print(f"✗ 插入图片到Excel失败: {e}")
             return False
 
-    def _insert_images_with_border(self, ws_pics, start_row, start_col, images, border, font, align):
-        if not images:
-            return
-
-        fixed_col_gap = config.IMAGE_CONFIG["fixed_col_gap"]
-        fixed_col_width = config.IMAGE_CONFIG["fixed_col_width"]
+    def _apply_picture_layout(self, job, ws_pics, plan, title_text, font, border, align):
+        """按排版规划写入图片页及续页工作表"""
+        wb = job.wb
+        sheets = [ws_pics]
+        for index in range(1, plan.sheet_count):
+            title = LayoutPlan.sheet_title(ws_pics.title, index)
+            if title in wb.sheetnames:
+                del wb[title]
+            ws = wb.create_sheet(title)
+            ws.sheet_view.showGridLines = False
+            ws['B1'] = f"{title_text}（续）"
+            ws['B1'].font = font
+            sheets.append(ws)
+
+        for index, ws in enumerate(sheets):
+            # 图片列宽按最宽一行统一设置一次
+            if plan.col_range:
+                for col in range(plan.col_range[0], plan.col_range[1] + 1):
+                    ws.column_dimensions[get_column_letter(col)].width = config.IMAGE_CONFIG["fixed_col_width"]
+            texts, image_rows, _ = plan.rows_for(index)
+            for text_row in texts:
+                cell = ws.cell(row=text_row.row, column=2, value=text_row.text)
+                cell.font = font
+            for image_row in image_rows:
+                self._write_image_row(job, ws, image_row, border, font, align)
+            for row in plan.page_breaks.get(index, []):
+                ws.row_breaks.append(Break(id=row))
+
+    def _write_image_row(self, job, ws_pics, image_row, border, font, align):
+        """写入一行图片：插入图片，合并整行图片区域并加边框"""
+        row, start_col, end_col = image_row.row, image_row.start_col, image_row.end_col
+        if config.IMAGE_CONFIG.get("strip_mode"):
+            # 拼接模式：整行拼成一张横条图片
+            strips = self._compose_image_strips(image_row.paths)
+            if not strips:
+                return
+            data, width, height = strips[0]
+            img = ExcelImage(BytesIO(data))
+            img.width, img.height = width, height
+            ws_pics.add_image(img, f"{get_column_letter(start_col)}{row}")
+            end_col = self._covered_end_col(ws_pics, start_col, width)
+        else:
+            cfg = config.IMAGE_CONFIG
+            cols_per_image = cfg["fixed_col_width"] // 6 + cfg["fixed_col_gap"]
+            inserted = 0
+            for i, img_path in enumerate(image_row.paths):
+                try:
+                    img = self._make_excel_image(img_path)
+                    img.width = cfg["width"]
+                    img.height = cfg["height"]
+                    self._place_picture(job, ws_pics, img, img_path,
+                                        f"{get_column_letter(start_col + i * cols_per_image)}{row}", "steps")
+                    inserted += 1
+                except Exception as e:
+                    # 跳过失败图片，位置保留（避免后续图片列错位）
+                    print(f"无法插入图片 {img_path}: {e}")
+            if not inserted:
+                return
 
-        current_col = start_col
-        img_col_list = []
-        # 记录所有涉及的列（包括间隔列），确保边框覆盖完整
-        all_involved_cols = []
+        # 合并图片区域，并逐个单元格设置边框（openpyxl合并后必须逐个单元格设边框才有完整框线）
+        ws_pics.merge_cells(f"{get_column_letter(start_col)}{row}:{get_column_letter(end_col)}{row}")
+        for col in range(start_col, end_col + 1):
+            cell = ws_pics.cell(row=row, column=col)
+            cell.border = border
+            cell.font = font
+            cell.alignment = align
+        ws_pics.row_dimensions[row].height = image_row.height_pt
+
+    @staticmethod
+    def _covered_end_col(ws, start_col, width_px):
+        """按现有列宽计算宽度为 width_px 的图片覆盖到的最后一列（不逐列强制列宽）"""
+        end_col, covered = start_col, 0
+        while True:
+            letter = get_column_letter(end_col)
+            # 未设置过的列按Excel默认列宽计算（避免访问时生成新的列设置）
+            col_width = ws.column_dimensions[letter].width if letter in ws.column_dimensions else 8.43
+            covered += int(col_width * 7 + 5)
+            if covered >= width_px:
+                return end_col
+            end_col += 1
+
+    @staticmethod
+    def _caption_font(size):
+        """标题字体：优先使用支持中文的系统字体"""
+        for name in ("msyh.ttc", "simhei.ttf", "arial.ttf", "DejaVuSans.ttf"):
+            try:
+                return ImageFont.truetype(name, size)
+            except OSError:
+                continue
+        return ImageFont.load_default()
 
+    def _compose_image_strips(self, images):
+        """
+        将一个步骤的图片（含文件名标题）拼接成横条图片
+        返回 [(JPEG字节, 显示宽px, 显示高px), ...]，每个元素对应表格中的一行
+        """
+        cfg = config.IMAGE_CONFIG
+        scale = cfg["strip_scale"]
+        img_w, img_h = cfg["width"] * scale, cfg["height"] * scale
+        gap = cfg["strip_gap_px"] * scale
+        caption_h = cfg["strip_caption_px"] * scale
+        per_row = cfg["strip_max_per_row"] if cfg["strip_wrap"] else max(len(images), 1)
+        caption_font = self._caption_font(int(caption_h * 0.7))
+
+        # 先解码所有图片，失败的跳过（与逐张插入时的行为一致）
+        tiles = []
         for img_path in images:
             try:
-                img = ExcelImage(img_path)
-                img.width = config.IMAGE_CONFIG["width"]
-                img.height = config.IMAGE_CONFIG["height"]
-                img_cell = f"{get_column_letter(current_col)}{start_row}"
-                ws_pics.add_image(img, img_cell)
-
-                # 记录图片所在列+后续间隔列（解决列覆盖不全）
-                img_col_list.append(current_col)
-                # 标记当前列到下一张图片前的所有列
-                next_col = current_col + fixed_col_width // 6 + fixed_col_gap
-                all_involved_cols.extend(range(current_col, next_col))
-
-                # 强制设置当前列宽
-                ws_pics.column_dimensions[get_column_letter(current_col)].width = fixed_col_width
-
-                # 修正列偏移计算
-                current_col = next_col
+                src = self._source(img_path)
+                src = self.image_cache.open(src) if self.image_cache is not None else zip_photos.open_file(src)
+                with Image.open(src) as img:
+                    img.draft('RGB', (img_w, img_h))  # JPEG按需降采样解码
+                    tiles.append((img.convert('RGB').resize((img_w, img_h), Image.Resampling.LANCZOS),
+                                  Path(img_path).stem))
             except Exception as e:
                 print(f"无法插入图片 {img_path}: {e}")
-                # 跳过失败图片，列偏移继续（避免后续图片列错位）
-                current_col += config.IMAGE_CONFIG["col_offset_step"] + fixed_col_gap
-                continue
 
-        if img_col_list:
-            # 方案1：用实际涉及的所有列确定合并范围（推荐）
-            start_col_border = min(img_col_list)
-            # 取最后一张图片的结束列（而非列索引），确保覆盖所有图片
-            end_col_border = max(all_involved_cols) if all_involved_cols else img_col_list[-1]
-
-            # 合并范围：覆盖所有图片+间隔列
-            merge_range = f"{get_column_letter(start_col_border)}{start_row}:{get_column_letter(end_col_border)}{start_row}"
-            ws_pics.merge_cells(merge_range)
-
-            # 方案2：强制设置合并单元格的所有边框（解决样式渲染不全）
-            border_cell = f"{get_column_letter(start_col_border)}{start_row}"
-            # 1. 基础样式应用
-            ws_pics[border_cell].border = border
-            ws_pics[border_cell].font = font
-            ws_pics[border_cell].alignment = align
-
-            # 2. 遍历合并范围的所有单元格，强制应用边框（关键修复）
-            for col in range(start_col_border, end_col_border + 1):
-                cell = f"{get_column_letter(col)}{start_row}"
-                ws_pics[cell].border = border
-                ws_pics[cell].font = font
-                ws_pics[cell].alignment = align
-
-            # 3. 强制刷新行高/列宽（避免Excel渲染异常）
-            ws_pics.row_dimensions[start_row].height = config.IMAGE_CONFIG["row_height"]
-            for col in range(start_col_border, end_col_border + 1):
-                ws_pics.column_dimensions[get_column_letter(col)].width = fixed_col_width
+        strips = []
+        for i in range(0, len(tiles), per_row):
+            group = tiles[i:i + per_row]
+            width = len(group) * img_w + (len(group) - 1) * gap
+            height = img_h + caption_h
+            strip = Image.new('RGB', (width, height), 'white')
+            draw = ImageDraw.Draw(strip)
+            for j, (tile, caption) in enumerate(group):
+                x = j * (img_w + gap)
+                strip.paste(tile, (x, 0))
+                draw.rectangle([x, 0, x + img_w - 1, img_h - 1], outline='black', width=scale)
+                # 标题过长时截断
+                while caption and draw.textlength(caption, font=caption_font) > img_w:
+                    caption = caption[:-1]
+                draw.text((x + 2 * scale, img_h + caption_h * 0.1), caption, fill='black', font=caption_font)
+            buf = BytesIO()
+            strip.save(buf, format='JPEG', quality=cfg["strip_quality"])
+            strips.append((buf.getvalue(), width // scale, height // scale))
+        return strips
 
     def generate_report_no(self):
         """自动生成报告编号"""
         now = datetime.now()
         return f"OI{now.year % 100:02d}{now.month:02d}{now.day:02d}-{now.hour:02d}{now.minute:02d}"
 
-    def save_report(self, output_path):
+    def save_report(self, job, output_path):
         """保存报告"""
         try:
-            self.wb.save(output_path)
+            props = job.wb.custom_doc_props
+            props.props = [p for p in props.props if p.name != TEMPLATE_PROPERTY]
+            props.append(StringProperty(name=TEMPLATE_PROPERTY, value=os.path.basename(job.template_path)))
+
+            cfg = config.SAVE_CONFIG
+            if cfg.get("parallel"):
+                try:
+                    save_workbook_parallel(job.wb, output_path, cfg["deflate_level"], cfg["workers"])
+                except ValueError as e:
+                    # 超过 4GB 等情况退回 openpyxl 自带的保存
+                    print(f"⚠ 并行压缩保存失败，改用普通保存: {e}")
+                    job.wb.save(output_path)
+            else:
+                job.wb.save(output_path)
             print(f"✓ 报告保存成功: {output_path}")
-            return True
         except Exception as e:
             print(f"✗ 保存报告失败: {e}")
             return False
 
+        # 照片分级存放：原图并行复制到报告旁的原图文件夹，并写入图片指向原图的链接
+        if job.originals.links:
+            tier = config.PHOTO_TIER_CONFIG
+            failed = photo_tiers.copy_originals(output_path, job.originals, self._source, tier["workers"])
+            try:
+                photo_tiers.add_picture_links(output_path, photo_tiers.link_targets(output_path, job.originals),
+                                              config.SAVE_CONFIG["deflate_level"])
+            except Exception as e:
+                print(f"✗ 写入原图链接失败: {e}")
+                return False
+            print(f"✓ 原图已存放到 {photo_tiers.sidecar_dir(output_path)}"
+                  + (f"（{len(failed)} 张复制失败）" if failed else ""))
+
+        # 可选：保存后优化（失败不影响已保存的报告）
+        if config.OPTIMIZER_CONFIG.get("enabled"):
+            try:
+                stats = optimize_package(output_path, level=config.OPTIMIZER_CONFIG["deflate_level"])
+                print(f"✓ 报告优化完成: {format_stats(stats)}")
+            except Exception as e:
+                print(f"⚠ 报告优化失败（已保留未优化的报告）: {e}")
+        return True
+
+    def build_report(self, template_path, data, defects, step_images, defect_images, output_path):
+        """
+        无界面生成完整报告（本地服务等调用），流程与 GUI 的 generate_report 一致
+        step_images格式同 insert_images_to_excel，defect_images为缺陷图片路径列表
+        预检不通过时抛出 PreflightError
+        """
+        all_images = [p for paths in step_images.values() for p in paths] + list(defect_images)
+        self.preflight_check(template_path, data, all_images)
+
+        # 输入未变化时直接复用缓存的报告
+        cache_key = None
+        if self.output_cache is not None and not photo_tiers.sidecar_enabled():
+            cache_key = self.output_cache.compute_key(template_path, data, defects, step_images, defect_images,
+                                                      source=self._source)
+            if self.output_cache.fetch(cache_key, output_path):
+                self.archive_report(output_path, data)
+                return True
+
+        job = self.load_template(template_path)
+        if job is None:
+            return False
+        if not self.fill_basic_info(job, data):
+            return False
+        if defects and not self.add_defect_records(job, defects):
+            return False
+        if defect_images:
+            job.defect_images = list(defect_images)
+            self._insert_defect_images(job)
+        if any(step_images.values()):
+            po_number = str(data.get('po_number', '')).strip() or "PO"
+            if not self.insert_images_to_excel(job, step_images, po_number):
+                return False
+        if not self.save_report(job, output_path):
+            return False
+        if cache_key:
+            self.output_cache.store(cache_key, output_path)
+        self.archive_report(output_path, data)
+        return True
+
+    def archive_report(self, report_path, data):
+        """已启用归档时归档生成的报告；归档失败不影响报告本身"""
+        if self.archive is None:
+            return None
+        report_id = self.archive.add(report_path, data)
+        if report_id is not None:
+            print(f"✓ 报告已归档: 编号 {report_id}")
+        return report_id
+
+    def build_reports(self, specs, max_workers=4):
+        """
+        多线程并行生成多份报告，所有任务共享本生成器的模板缓存和图片缓存
+        specs: [{'template_path', 'data', 'defects', 'step_images', 'defect_images', 'output_path'}, ...]
+        返回与 specs 顺序一致的结果列表（True/False）
+        """
+        def run(spec):
+            try:
+                return self.build_report(
+                    spec['template_path'], spec['data'], spec.get('defects') or [],
+                    spec.get('step_images') or {}, spec.get('defect_images') or [],
+                    spec['output_path'])
+            except Exception as e:
+                print(f"✗ 生成报告失败 {spec.get('output_path')}: {e}")
+                return False
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(run, specs))
+
+    @staticmethod
+    def _copy_main_sheet(wb, base):
+        """
+        复制检查表：openpyxl 的 copy_worksheet 只复制单元格、行列尺寸、合并区域和页面设置，
+        图片、打印区域、打印标题、页眉页脚、视图、分页符、数据验证和条件格式另行复制
+        """
+        ws = wb.copy_worksheet(base)
+        for img in base._images:
+            clone = ExcelImage(BytesIO(img._data()))
+            clone.width, clone.height = img.width, img.height
+            ws.add_image(clone, copy.deepcopy(img.anchor))
+
+        for attr in ('_print_area', '_print_rows', '_print_cols', 'HeaderFooter', 'views',
+                     'row_breaks', 'col_breaks', 'data_validations', 'auto_filter', 'protection'):
+            setattr(ws, attr, copy.deepcopy(getattr(base, attr)))
+        for view in ws.views.sheetView:
+            view.tabSelected = False  # 只保留原检查表为选中的工作表
+        for cf in base.conditional_formatting:
+            for rule in cf.rules:
+                ws.conditional_formatting.add(str(cf.sqref), copy.deepcopy(rule))
+        return ws
+
+    def build_multi_po_report(self, template_path, orders, output_path):
+        """
+        同一批货的多个PO合并为一个工作簿：每个PO一张检查表和一张 Reference pictures 页，
+        检查表全部由同一次加载的模板复制；多个PO共用的照片在包中只保存一份，最后一次保存
+        orders: [{'data', 'defects', 'step_images', 'defect_images'}, ...]，每项与 build_report 的参数相同
+        预检不通过时抛出 PreflightError
+        """
+        if not orders:
+            return False
+        po_numbers = [str(o['data'].get('po_number', '')).strip() or "PO" for o in orders]
+        problems = [f"PO号重复: {po}" for po in sorted({p for p in po_numbers if po_numbers.count(p) > 1})]
+        schema = get_schema(template_path)
+        for make_title in (lambda po: _sheet_title(f"{schema.sheet} {po}"), _pics_sheet_title):
+            titles = [make_title(po) for po in dict.fromkeys(po_numbers)]
+            problems += [f"PO号过长，截断为工作表名后重复: {t}" for t in sorted({t for t in titles if titles.count(t) > 1})]
+        problems += [self._check_quantity(o['data']['ship_quantity']) for o in orders if 'ship_quantity' in o['data']]
+        all_images = [p for o in orders for paths in (o.get('step_images') or {}).values() for p in paths]
+        all_images += [p for o in orders for p in o.get('defect_images') or []]
+        try:
+            self.preflight_check(template_path, {}, all_images)
+        except PreflightError as e:
+            problems += e.problems
+        problems = [p for p in problems if p]
+        if problems:
+            raise PreflightError(problems)
+
+        job = self.load_template(template_path)
+        if job is None:
+            return False
+        wb = job.wb
+        base = wb[schema.sheet]
+        template_sheets = [ws for ws in wb.worksheets if ws is not base]
+
+        # 先从未填写的模板复制出各PO的检查表，再逐个填写
+        main_sheets = [base] + [self._copy_main_sheet(wb, base) for _ in orders[1:]]
+        for ws, po in zip(main_sheets, po_numbers):
+            ws.title = _sheet_title(f"{schema.sheet} {po}")
+
+        groups = []
+        for ws, po, order in zip(main_sheets, po_numbers, orders):
+            before = set(wb.sheetnames)
+            po_job = ReportJob(template_path, wb, main_sheet=ws.title, sheet_suffix=f" {po}")
+            po_job.originals = job.originals  # 原图链接全工作簿统一编号
+            data = order['data']
+            step_images = order.get('step_images') or {}
+            if not self.fill_basic_info(po_job, data):
+                return False
+            if order.get('defects') and not self.add_defect_records(po_job, order['defects']):
+                return False
+            if order.get('defect_images'):
+                po_job.defect_images = list(order['defect_images'])
+                self._insert_defect_images(po_job)
+            if any(step_images.values()):
+                if not self.insert_images_to_excel(po_job, step_images, po):
+                    return False
+            groups.append([ws] + [wb[name] for name in wb.sheetnames if name not in before])
+
+        # 工作表顺序：每个PO的检查表后紧跟其图片页，模板中的其他工作表放在最后
+        order_sheets = [ws for group in groups for ws in group] + template_sheets
+        for index, ws in enumerate(order_sheets):
+            wb.move_sheet(ws, offset=index - wb.index(ws))
+        wb.active = 0
+
+        if not self.save_report(job, output_path):
+            return False
+        print(f"✓ 合并报告包含 {len(orders)} 个PO: {', '.join(po_numbers)}")
+        self.archive_report(output_path, dict(orders[0]['data'], po_number=",".join(po_numbers)))
+        return True
+
+    @staticmethod
+    def _update_targets(schema, sheet_names, data):
+        """
+        增量修改的目标 (检查表, 图片页或None, 是否合并报告)
+        合并报告的检查表和图片页名带PO号，按 data 中的PO号查找
+        """
+        if schema.sheet in sheet_names:
+            pics_sheet = next((n for n in sheet_names if n.startswith('Reference pictures')), None)
+            return schema.sheet, pics_sheet, False
+        prefix = f"{schema.sheet} "
+        po_sheets = [n for n in sheet_names if n.startswith(prefix)]
+        if not po_sheets:
+            raise ReportUpdateError(f"报告中没有工作表: {schema.sheet}")
+        po = str(data.get('po_number', '')).strip() or "PO"
+        sheet = _sheet_title(f"{prefix}{po}")
+        if sheet not in po_sheets:
+            pos = "、".join(n[len(prefix):] for n in po_sheets)
+            raise ReportUpdateError(f"这是多PO合并报告（{pos}），请在PO号中填写要修改的PO（合并报告不能修改PO号）")
+        pics_sheet = _pics_sheet_title(po)
+        return sheet, (pics_sheet if pics_sheet in sheet_names else None), True
+
+    def update_report(self, report_path, data, defects, output_path=None, template_path=None):
+        """
+        增量修改已生成的报告：只重写基本信息、抽样计划、缺陷记录及图片页表头的单元格，
+        图片等其余内容按原始数据保留，不重新嵌入图片
+        output_path 为空时原地修改
+        模板结构按报告中记录的模板文件名选取；早期未记录模板的报告按 template_path（为空时用默认结构）
+        多PO合并报告按 data 中的PO号修改该PO的检查表和图片页，找不到时抛出 ReportUpdateError
+        """
+        try:
+            template_name = report_patch.read_custom_property(report_path, TEMPLATE_PROPERTY) or template_path
+            schema = get_schema(template_name)
+            sheet_names = report_patch.read_sheet_names(report_path)
+            sheet, pics_sheet, combined = self._update_targets(schema, sheet_names, data)
+            cells = self._basic_info_cells(data, schema)
+            swap_styles = []
+
+            rows = schema.sampling_rows
+            lot_refs = [f"{col}{rows['lot_quantity']}" for col in schema.sampling_columns]
+            current = report_patch.read_cell_values(report_path, sheet, lot_refs)
+
+            if 'ship_quantity' in data:
+                quantity = int(data['ship_quantity'])
+                target_col, sampling_cells, _ = self._sampling_plan_cells(quantity, schema)
+                if target_col is None:
+                    print(f"⚠ 出货数量 {quantity} 不在有效范围内")
+                    return False
+                cells.update(sampling_cells)
+                # 数量区间变化时：清空旧列，并把标红样式从旧列移到新列
+                for old_col, ref in zip(schema.sampling_columns, lot_refs):
+                    if current[ref] not in (None, '') and old_col != target_col:
+                        for row in rows.values():
+                            cells[f"{old_col}{row}"] = None
+                        for key in schema.sampling_highlight:
+                            swap_styles.append((f"{old_col}{rows[key]}", f"{target_col}{rows[key]}"))
+
+            cells.update(self._defect_record_cells(defects, clear_rest=True, schema=schema))
+            updates = {sheet: {'cells': cells, 'swap_styles': swap_styles}}
+
+            # 图片页表头（单PO报告的PO号变化时同时重命名工作表）
+            renames = {}
+            if pics_sheet is not None:
+                po_number = data.get('po_number') or "PO-UNKNOWN"
+                updates[pics_sheet] = {'cells': {
+                    'B1': config.STEP_TEXT["title"].format(po_number=po_number),
+                    'B2': f"{config.STEP_TEXT['sku_label']}{data.get('sku') or ''}",
+                    'G2': data.get('inspection_date') or "",
+                    'G3': data.get('inspector') or "",
+                }}
+                new_name = _pics_sheet_title(str(data.get('po_number', '')).strip() or 'PO')
+                if new_name != pics_sheet and not combined:
+                    renames[pics_sheet] = new_name
+
+            report_patch.patch_report(report_path, updates, output_path, renames)
+            print(f"✓ 报告已更新: {output_path or report_path}")
+            return True
+
+        except ReportUpdateError:
+            raise
+
+        except Exception as e:
+            print(f"✗ 更新报告失败: {e}")
+            return False
+
+
+# 报告中的图片步骤（GUI、报告服务、监控文件夹共用）
+STEP_NAMES = [
+    'Step 1', 'Step 2', 'Step 3', 'Step 4',
+    'Step 5（1）', 'Step 5（2）', 'Step 5（3）', 'Step 5（4）', 'Step 5（5）'
+]
+
+
+def model_prefix(sku):
+    """根据 SKU 判断型号，用于报告文件名"""
+    if "M40" in sku:
+        return "M40"
+    if "M50" in sku:
+        return "M50"
+    return "MODEL"
+
+
+def create_output_cache(base_dir):
+    """按配置创建报告输出缓存（未启用时返回None）"""
+    cfg = config.OUTPUT_CACHE_CONFIG
+    if not cfg.get("enabled"):
+        return None
+    return OutputCache(os.path.join(base_dir, cfg["dir"]),
+                       max_bytes=cfg["max_mb"] * 1024 * 1024,
+                       max_entries=cfg["max_entries"],
+                       hardlink=cfg["hardlink"])
+
+
+def create_staging_cache(base_dir):
+    """按配置创建网络图片本地暂存（未启用时返回None）"""
+    cfg = config.STAGING_CONFIG
+    if not cfg.get("enabled"):
+        return None
+    return StagingCache(os.path.join(base_dir, cfg["dir"]),
+                        max_bytes=cfg["max_mb"] * 1024 * 1024,
+                        max_age_seconds=cfg["max_age_days"] * 86400,
+                        workers=cfg["workers"],
+                        remote_only=cfg["remote_only"])
+
+
+def create_report_archive(base_dir):
+    """按配置创建报告归档（未启用时返回None）"""
+    cfg = config.ARCHIVE_CONFIG
+    if not cfg.get("enabled"):
+        return None
+    return ReportArchive(os.path.join(base_dir, cfg["dir"]))
+
 
 class InspectionReportGUI:
     def __init__(self, root):
@@ -611,9 +1162,10 @@ class InspectionReportGUI:
         self.root.geometry("1100x700")
         self.root.minsize(800, 600)
 
-        self.generator = InspectionReportGenerator()
         self.selected_images = {}
         self.image_checkbuttons = {}
+        self.pending_orders = []  # 待合并生成的多个PO（每项为一个PO的填写数据和所选图片）
+        self._auto_report_no = (None, None)  # (输入内容的缓存键, 为这组输入自动生成的报告编号)
 
         # --- 修复点：路径逻辑只保留一份 ---
         if getattr(sys, 'frozen', False):
@@ -622,6 +1174,10 @@ class InspectionReportGUI:
         else:
             # 如果是直接运行 .py 脚本
             self.base_dir = os.path.dirname(os.path.abspath(__file__))
+
+        self.generator = InspectionReportGenerator(output_cache=create_output_cache(self.base_dir),
+                                                   staging=create_staging_cache(self.base_dir),
+                                                   archive=create_report_archive(self.base_dir))
         default_template_name = "模板.xlsx"
         self.default_template_path = os.path.join(self.base_dir, default_template_name)
 
@@ -832,7 +1388,9 @@ class InspectionReportGUI:
         self.image_folder_var = tk.StringVar()
         ttk.Entry(folder_frame, textvariable=self.image_folder_var, width=30).pack(side=tk.LEFT, padx=5)
         ttk.Button(folder_frame, text="浏览...", command=self.browse_image_folder).pack(side=tk.LEFT)
+        ttk.Button(folder_frame, text="压缩包...", command=self.browse_image_zip).pack(side=tk.LEFT, padx=(5, 0))
         ttk.Button(folder_frame, text="扫描", command=self.scan_images).pack(side=tk.LEFT, padx=5)
+        ttk.Button(folder_frame, text="取消问题照片", command=self.deselect_flagged_images).pack(side=tk.LEFT)
 
         # 内部图片预览区域（嵌套 Canvas 保持原有逻辑）
         preview_container = ttk.Frame(parent)
@@ -859,8 +1417,7 @@ class InspectionReportGUI:
         ttk.Label(stats_frame, text="各步骤图片统计:", font=('微软雅黑', 10, 'bold')).pack(anchor=tk.W)
 
         self.step_counts = {}
-        steps = ['Step 1', 'Step 2', 'Step 3', 'Step 4', 'Step 5（1）', 'Step 5（2）', 'Step 5（3）', 'Step 5（4）',
-                 'Step 5（5）',]
+        steps = STEP_NAMES
 
         # 使用流式布局防止统计块在横向消失
         flow_frame = ttk.Frame(stats_frame)
@@ -879,6 +1436,11 @@ class InspectionReportGUI:
         button_frame.pack(fill=tk.X, pady=(10, 0))
         ttk.Button(button_frame, text="生成报告", command=self.generate_report, style='Accent.TButton').pack(
             side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="更新已有报告", command=self.update_existing_report).pack(
+            side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="加入合并报告", command=self.add_to_multi_po).pack(side=tk.LEFT, padx=5)
+        self.multi_po_button = ttk.Button(button_frame, text="生成合并报告(0)", command=self.generate_multi_po_report)
+        self.multi_po_button.pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="清除数据", command=self.clear_data).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="退出", command=self.root.quit).pack(side=tk.RIGHT, padx=5)
 
@@ -890,7 +1452,7 @@ class InspectionReportGUI:
         )
         if filename:
             self.template_var.set(filename)
-            if self.generator.load_template(filename):
+            if self.generator.load_template(filename) is not None:
                 messagebox.showinfo("成功", f"模板加载成功: {Path(filename).name}")
 
     def browse_image_folder(self):
@@ -899,6 +1461,15 @@ class InspectionReportGUI:
         if folder:
             self.image_folder_var.set(folder)
 
+    def browse_image_zip(self):
+        """浏览选择图片压缩包（不解压，扫描和生成时直接读取压缩包内的图片）"""
+        filename = filedialog.askopenfilename(
+            title="选择图片压缩包",
+            filetypes=[("ZIP压缩包", "*.zip"), ("所有文件", "*.*")]
+        )
+        if filename:
+            self.image_folder_var.set(filename)
+
     def scan_images(self):
         """扫描图片文件夹（最优自适应布局：确保右侧操作项始终可见）"""
         folder = self.image_folder_var.get()
@@ -911,6 +1482,9 @@ class InspectionReportGUI:
         if not images:
             messagebox.showinfo("提示", "未找到图片文件")
             return
+        # 网络共享盘上的图片在后台并行复制到本地，缩略图和生成报告都读本地副本
+        if self.generator.staging is not None:
+            self.generator.staging.prefetch([d['path'] for d in images])
 
         # 清空预览区
         for widget in self.scrollable_frame.winfo_children():
@@ -920,10 +1494,7 @@ class InspectionReportGUI:
         self.image_checkbuttons.clear()
 
         # 初始化步骤计数
-        step_image_counts = {k: 0 for k in [
-            'Step 1', 'Step 2', 'Step 3', 'Step 4',
-            'Step 5（1）', 'Step 5（2）', 'Step 5（3）', 'Step 5（4）', 'Step 5（5）'
-        ]}
+        step_image_counts = {k: 0 for k in STEP_NAMES}
 
         # 配置滚动容器的列权重，使其横向铺满
         self.scrollable_frame.columnconfigure(0, weight=1)
@@ -947,6 +1518,10 @@ class InspectionReportGUI:
                 img_label = ttk.Label(frame, image=photo)
                 img_label.image = photo
                 img_label.grid(row=0, column=0, rowspan=2, padx=(0, 10), sticky=tk.NW)
+                # 双击缩略图查看大图
+                img_label.configure(cursor='hand2')
+                img_label.bind("<Double-Button-1>",
+                               lambda e, d=img_data: self.open_image_viewer(d['path']))
 
                 # 3. 中间信息区域
                 info_frame = ttk.Frame(frame)
@@ -962,15 +1537,23 @@ class InspectionReportGUI:
                 ttk.Label(info_frame, text=f"原始分类: {img_data['step']}",
                           font=('微软雅黑', 9)).pack(anchor=tk.W)
 
+                # 质量筛查结果
+                quality = img_data.get('quality')
+                if quality is not None:
+                    ttk.Label(info_frame, text=quality.summary(), font=('微软雅黑', 8)).pack(anchor=tk.W)
+                    if quality.issues:
+                        issues = "、".join(quality.issues)
+                        if quality.duplicate_of:
+                            issues += f"（与 {os.path.basename(quality.duplicate_of)} 相似）"
+                        ttk.Label(info_frame, text=f"⚠ {issues}", foreground='red', wraplength=180,
+                                  font=('微软雅黑', 8, 'bold')).pack(anchor=tk.W)
+
                 # 4. 步骤分配
                 step_frame = ttk.Frame(frame)
                 step_frame.grid(row=1, column=1, sticky=tk.W, pady=(5, 0))
                 ttk.Label(step_frame, text="重新分配到:", font=('微软雅黑', 9)).pack(side=tk.LEFT)
 
-                step_options = [
-                    'Step 1', 'Step 2', 'Step 3', 'Step 4',
-                    'Step 5（1）', 'Step 5（2）', 'Step 5（3）', 'Step 5（4）', 'Step 5（5）'
-                ]
+                step_options = STEP_NAMES
                 step_var = tk.StringVar(value=img_data['step'])
                 step_combo = ttk.Combobox(step_frame, textvariable=step_var, values=step_options, width=12,
                                           state='readonly')
@@ -984,13 +1567,15 @@ class InspectionReportGUI:
                 check_btn = ttk.Checkbutton(action_frame, text="使用", variable=check_var)
                 check_btn.pack(anchor=tk.E)  # 靠右对齐
 
-                defect_var = tk.BooleanVar(value=False)
-                if any(word.lower() in img_data['filename'].lower() for word in config.DEFECT_WORDS):
-                    defect_var.set(True)
+                defect_var = tk.BooleanVar(value=img_data['defect'])
 
                 defect_btn = ttk.Checkbutton(action_frame, text="设为缺陷图", variable=defect_var)
                 defect_btn.pack(anchor=tk.E, pady=(5, 0))
 
+                ttk.Button(action_frame, text="查看大图", width=8,
+                           command=lambda d=img_data: self.open_image_viewer(d['path'])).pack(
+                    anchor=tk.E, pady=(5, 0))
+
                 # 保存数据引用
                 self.image_checkbuttons[img_data['path']] = {
                     'checkbox': check_var,
@@ -1008,6 +1593,20 @@ class InspectionReportGUI:
         for step, count_var in self.step_counts.items():
             count_var.set(f"{step_image_counts.get(step, 0)}张")
 
+    def deselect_flagged_images(self):
+        """取消选中质量筛查发现问题（模糊、曝光不当、重复）的照片"""
+        count = 0
+        for img_info in self.image_checkbuttons.values():
+            quality = img_info['data'].get('quality')
+            if quality is not None and quality.issues and img_info['checkbox'].get():
+                img_info['checkbox'].set(False)
+                count += 1
+        messagebox.showinfo("质量筛查", f"已取消选中 {count} 张有问题的照片" if count else "没有需要取消的问题照片")
+
+    def open_image_viewer(self, image_path):
+        """打开可缩放的大图查看窗口"""
+        open_viewer(self.root, self.generator._source(image_path), os.path.basename(image_path))
+
     def generate_report_no(self):
         """生成报告编号"""
         report_no = self.generator.generate_report_no()
@@ -1037,10 +1636,7 @@ class InspectionReportGUI:
 
     def get_selected_images(self):
         """获取选择的图片并按步骤分组（适配Step5细分）"""
-        step_images = {
-            'Step 1': [], 'Step 2': [], 'Step 3': [], 'Step 4': [],
-            'Step 5（1）': [], 'Step 5（2）': [], 'Step 5（3）': [], 'Step 5（4）': [], 'Step 5（5）': []
-        }
+        step_images = {step: [] for step in STEP_NAMES}
 
         for img_info in self.image_checkbuttons.values():
             if img_info['checkbox'].get():
@@ -1051,50 +1647,179 @@ class InspectionReportGUI:
         return step_images
 
     def generate_report(self):
-        """生成报告主逻辑（含缺陷图重命名与首页自动插入）"""
+        """生成报告主逻辑（含缺陷标记保存与首页自动插入）"""
         # 1. 基础验证
         template_path = self.template_var.get()
         if not template_path:
             messagebox.showerror("错误", "请选择Excel模板")
             return
 
-        # 每次生成报告都重新加载模板（重置 Workbook）
-        if not self.generator.load_template(template_path):
+        # 校验出货数量
+        ship_quantity = self._read_ship_quantity()
+        if ship_quantity is None:
+            return
+
+        # 预检：在保存标记、填写和插入图片之前，并行检查所有选用的图片、模板和出货数量
+        selected_paths = [path for path, info in self.image_checkbuttons.items() if info['checkbox'].get()]
+        try:
+            self.generator.preflight_check(template_path, {'ship_quantity': ship_quantity}, selected_paths)
+        except PreflightError as e:
+            messagebox.showerror("预检未通过", f"发现以下问题，请处理后再生成：\n\n{e}")
+            return
+
+        # --- 缺陷标记和步骤分配记入图片文件夹的标记索引（不再重命名图片），并收集缺陷图路径 ---
+        collected_defect_paths = self._save_tags_and_collect_defects()
+
+        # 2. 收集填写数据（报告编号留空时，在计算缓存键之后再自动编号）
+        data = self._collect_form_data(ship_quantity, assign_report_no=False)
+        defects = self.get_defects_data()
+        step_images = self.get_selected_images()
+
+        # --- 根据 SKU 判断型号，用于文件名 ---
+        po_number = self.po_var.get().strip() or "PO"
+        default_name = f"{model_prefix(self.sku_var.get())}_{po_number}.xlsx"
+
+        # 3. 输入与上次生成完全相同时，直接复用缓存中的报告
+        output_cache = self.generator.output_cache
+        cache_key = None
+        if output_cache is not None and not photo_tiers.sidecar_enabled():
+            try:
+                key_args = (template_path, data, defects, step_images, collected_defect_paths)
+                if 'report_no' not in data:
+                    # 编号留空：输入与上次自动编号时相同才沿用那个编号（以便复用上次的报告），否则重新编号
+                    inputs_key = output_cache.compute_key(*key_args, source=self.generator._source)
+                    if self._auto_report_no[0] == inputs_key:
+                        data['report_no'] = self._auto_report_no[1]
+                    else:
+                        data['report_no'] = self.generator.generate_report_no()
+                        self._auto_report_no = (inputs_key, data['report_no'])
+                cache_key = output_cache.compute_key(*key_args, source=self.generator._source)
+            except Exception as e:
+                print(f"⚠ 计算缓存键失败，按正常流程生成: {e}")
+        if 'report_no' not in data:
+            data['report_no'] = self.generator.generate_report_no()
+        if cache_key and output_cache.lookup(cache_key):
+            output_file = self._ask_output_file(default_name)
+            if output_file and output_cache.fetch(cache_key, output_file):
+                self.generator.archive_report(output_file, data)
+                messagebox.showinfo("成功", "输入未变化，已直接复用上次生成的报告。")
+                self._offer_open(output_file)
+            return
+
+        # 每次生成报告都重新加载模板（新的报告任务）
+        job = self.generator.load_template(template_path)
+        if job is None:
             messagebox.showerror("错误", "加载模板失败")
             return
-        # 校验出货数量
+
+        # 4. 填充基本信息和抽样计划
+        self.generator.fill_basic_info(job, data)
+
+        # 5. 填充文字缺陷记录
+        if defects:
+            self.generator.add_defect_records(job, defects)
+
+        # --- 核心新增：将收集到的缺陷图插入到 Excel 首页 ---
+        if collected_defect_paths:
+            job.defect_images = collected_defect_paths
+            self.generator._insert_defect_images(job)
+
+        # 6. 插入常规图片页（Step 1-5）
+        if any(step_images.values()):
+            self.generator.insert_images_to_excel(job, step_images, po_number)
+
+        # 7. 保存文件
+        output_file = self._ask_output_file(default_name)
+        if output_file:
+            if self.generator.save_report(job, output_file):
+                if cache_key:
+                    output_cache.store(cache_key, output_file)
+                self.generator.archive_report(output_file, data)
+                messagebox.showinfo("成功", "报告已生成！\n缺陷图已同步至首页。")
+                self._offer_open(output_file)
+
+    def _save_tags_and_collect_defects(self):
+        """缺陷标记和步骤分配记入图片文件夹的标记索引，返回勾选使用的缺陷图路径"""
+        collected_defect_paths = []
+        stores = {}
+        for path, info in self.image_checkbuttons.items():
+            folder, name = zip_photos.location(path)
+            if folder not in stores:
+                stores[folder] = TagStore(folder)
+            stores[folder].set(name, defect=info['defect_var'].get(), step=info['step'].get())
+            # 勾选了“使用”和“设为缺陷图”的加入缺陷列表
+            if info['checkbox'].get() and info['defect_var'].get():
+                collected_defect_paths.append(path)
+        for store in stores.values():
+            store.save()  # 每个文件夹只写一次；写入失败不影响本次生成
+        return collected_defect_paths
+
+    def add_to_multi_po(self):
+        """把当前填写的PO（基本信息、缺陷记录、所选图片）加入待合并列表"""
+        ship_quantity = self._read_ship_quantity()
+        if ship_quantity is None:
+            return
+        po_number = self.po_var.get().strip()
+        if not po_number:
+            messagebox.showerror("错误", "请填写PO号")
+            return
+        order = {
+            'data': self._collect_form_data(ship_quantity),
+            'defects': self.get_defects_data(),
+            'step_images': self.get_selected_images(),
+            'defect_images': self._save_tags_and_collect_defects(),
+        }
+        # 同一PO重复加入时以最后一次为准
+        self.pending_orders = [o for o in self.pending_orders
+                               if str(o['data'].get('po_number', '')).strip() != po_number]
+        self.pending_orders.append(order)
+        self.multi_po_button.configure(text=f"生成合并报告({len(self.pending_orders)})")
+        messagebox.showinfo("合并报告", f"已加入 PO {po_number}，共 {len(self.pending_orders)} 个PO待合并。\n"
+                                        "填写下一个PO后继续加入，或点击“生成合并报告”。")
+
+    def generate_multi_po_report(self):
+        """把待合并的多个PO生成为一个工作簿"""
+        template_path = self.template_var.get()
+        if not template_path:
+            messagebox.showerror("错误", "请选择Excel模板")
+            return
+        if not self.pending_orders:
+            messagebox.showwarning("提示", "请先用“加入合并报告”添加PO")
+            return
+        po_numbers = [str(o['data'].get('po_number', '')).strip() for o in self.pending_orders]
+        prefix = model_prefix(self.pending_orders[0]['data'].get('sku', ''))
+        output_file = self._ask_output_file(f"{prefix}_{po_numbers[0]}-{po_numbers[-1]}.xlsx")
+        if not output_file:
+            return
+        try:
+            ok = self.generator.build_multi_po_report(template_path, self.pending_orders, output_file)
+        except PreflightError as e:
+            messagebox.showerror("预检未通过", f"发现以下问题，请处理后再生成：\n\n{e}")
+            return
+        if ok:
+            self.pending_orders = []
+            self.multi_po_button.configure(text="生成合并报告(0)")
+            messagebox.showinfo("成功", f"合并报告已生成，包含 {len(po_numbers)} 个PO。")
+            self._offer_open(output_file)
+        else:
+            messagebox.showerror("错误", "生成合并报告失败，详见日志")
+
+    def _read_ship_quantity(self):
+        """读取并校验出货数量，无效时提示并返回None"""
         try:
             ship_quantity = int(self.quantity_var.get() or 0)
             if ship_quantity <= 0:
                 raise ValueError
         except ValueError:
             messagebox.showerror("错误", "请输入有效的出货数量")
-            return
+            return None
+        return ship_quantity
 
-        # --- 核心新增：处理缺陷图物理重命名并收集路径 ---
-        collected_defect_paths = []
-        for original_path, info in self.image_checkbuttons.items():
-            if info['checkbox'].get():  # 如果勾选了“使用”
-                current_path = original_path
-
-                # 如果勾选了“设为缺陷图”
-                if info['defect_var'].get():
-                    p = Path(original_path)
-                    # 执行物理重命名逻辑
-                    if not p.name.startswith("(缺陷)"):
-                        new_name = f"(缺陷){p.name}"
-                        new_path = p.with_name(new_name)
-                        try:
-                            os.rename(original_path, new_path)
-                            current_path = str(new_path)  # 更新路径为重命名后的
-                            info['data']['path'] = current_path  # 同步更新内存数据
-                        except Exception as e:
-                            print(f"重命名失败: {e}")
-
-                    # 将该路径加入缺陷列表（无论是新命名的还是原本就带缺陷字样的）
-                    collected_defect_paths.append(current_path)
-
-        # 2. 填充基本信息和抽样计划
+    def _collect_form_data(self, ship_quantity, assign_report_no=True):
+        """
+        收集界面填写的基本信息；报告编号留空时自动生成新编号（不写入编号输入框）
+        assign_report_no=False 时不生成新报告编号：编号留空则不包含 report_no（更新报告时保留原编号）
+        """
         data = {
             'inspector': self.inspector_var.get(),
             'inspection_date': self.date_var.get(),
@@ -1102,53 +1827,65 @@ class InspectionReportGUI:
             'sku': self.sku_var.get(),
             'ship_date': self.ship_date_var.get(),
             'ship_quantity': ship_quantity,
-            'report_no': self.report_no_var.get() or self.generator.generate_report_no(),
+            'report_no': self.report_no_var.get(),
             'customer': self.customer_var.get(),
             'drawing_no': self.drawing_var.get(),
             'approver': self.approver_var.get(),
             'approval_date': self.approval_date_var.get()
         }
-        self.generator.fill_basic_info(data)
-
-        # 3. 填充文字缺陷记录
-        defects = self.get_defects_data()
-        if defects:
-            self.generator.add_defect_records(defects)
-
-        # --- 核心新增：将收集到的缺陷图插入到 Excel 首页 ---
-        if collected_defect_paths:
-            self.generator.defect_images = collected_defect_paths
-            self.generator._insert_defect_images()
+        if not data['report_no']:
+            if assign_report_no:
+                data['report_no'] = self.generator.generate_report_no()
+            else:
+                del data['report_no']
+        return data
 
-        # 4. 插入常规图片页（Step 1-5）
-        step_images = self.get_selected_images()
-        if any(step_images.values()):
-            po_number = self.po_var.get().strip() or "PO"
-            self.generator.insert_images_to_excel(step_images, po_number)
-        # --- 根据 SKU 判断型号，用于文件名 ---
-        sku = self.sku_var.get()
-        po_number = self.po_var.get().strip() or "PO"
+    def update_existing_report(self):
+        """用当前填写的文字信息修改已生成的报告（图片保持不变，无需重新生成）"""
+        report_file = filedialog.askopenfilename(
+            title="选择要更新的报告",
+            filetypes=[("Excel文件", "*.xlsx")]
+        )
+        if not report_file:
+            return
+        ship_quantity = self._read_ship_quantity()
+        if ship_quantity is None:
+            return
 
-        if "M40" in sku:
-            model_prefix = "M40"
-        elif "M50" in sku:
-            model_prefix = "M50"
-        else:
-            model_prefix = "MODEL"
-        # 5. 保存文件
-        default_name = f"{model_prefix}_{po_number}.xlsx"
+        data = self._collect_form_data(ship_quantity, assign_report_no=False)
+        defects = self.get_defects_data()
         output_file = filedialog.asksaveasfilename(
+            title="保存更新后的报告（选择原文件即覆盖）",
+            defaultextension=".xlsx",
+            initialdir=os.path.dirname(report_file),
+            initialfile=os.path.basename(report_file),
+            filetypes=[("Excel文件", "*.xlsx")]
+        )
+        if not output_file:
+            return
+        try:
+            ok = self.generator.update_report(report_file, data, defects, output_file,
+                                              template_path=self.template_var.get() or None)
+        except ReportUpdateError as e:
+            messagebox.showerror("无法更新", str(e))
+            return
+        if ok:
+            messagebox.showinfo("成功", "报告文字信息已更新，图片保持不变。")
+            self._offer_open(output_file)
+        else:
+            messagebox.showerror("错误", "更新报告失败，原报告未改动。")
+
+    def _ask_output_file(self, default_name):
+        return filedialog.asksaveasfilename(
             title="保存报告",
             defaultextension=".xlsx",
             initialfile=default_name,
             filetypes=[("Excel文件", "*.xlsx")]
         )
 
-        if output_file:
-            if self.generator.save_report(output_file):
-                messagebox.showinfo("成功", f"报告已生成！\n缺陷图已重命名并同步至首页。")
-                if messagebox.askyesno("打开", "是否打开生成的报告？"):
-                    os.startfile(output_file)
+    def _offer_open(self, output_file):
+        if messagebox.askyesno("打开", "是否打开生成的报告？"):
+            os.startfile(output_file)
 
     def clear_data(self):
         """清除所有数据"""
@@ -1180,6 +1917,10 @@ class InspectionReportGUI:
         # 清空图片选择
         self.image_checkbuttons.clear()
 
+        # 清空待合并的PO
+        self.pending_orders = []
+        self.multi_po_button.configure(text="生成合并报告(0)")
+
         messagebox.showinfo("清除", "所有数据已清除")
 
 
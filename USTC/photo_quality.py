@@ -0,0 +1,137 @@
+"""
+照片质量筛查
+扫描图片文件夹时，按缩小解码（JPEG draft）后的灰度小图批量计算：
+- 清晰度：拉普拉斯算子响应的方差，越小越模糊
+- 曝光：过暗 / 过亮像素所占比例（直方图两端截断）
+- 近似重复：差值哈希（dHash）的汉明距离，整批一次两两比较
+需要 NumPy；未安装时跳过筛查，不影响扫描和生成
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import config
+import zip_photos
+
+try:
+    import numpy as np
+except ImportError:  # 可选依赖
+    np = None
+
+
+def available():
+    return np is not None
+
+
+class QualityScore:
+    """单张照片的筛查结果；issues 为问题描述列表（空表示未发现问题）"""
+
+    __slots__ = ('sharpness', 'dark_ratio', 'bright_ratio', 'dhash', 'duplicate_of', 'issues')
+
+    def __init__(self, sharpness, dark_ratio, bright_ratio, dhash):
+        self.sharpness = sharpness
+        self.dark_ratio = dark_ratio
+        self.bright_ratio = bright_ratio
+        self.dhash = dhash
+        self.duplicate_of = None
+        self.issues = []
+
+    def summary(self):
+        return f"清晰度 {self.sharpness:.0f} | 过暗 {self.dark_ratio:.0%} | 过亮 {self.bright_ratio:.0%}"
+
+
+def _analyze(path, size, dark_level, bright_level):
+    """缩小解码为灰度小图并计算清晰度、曝光和 dHash（在工作线程中执行）"""
+    with Image.open(zip_photos.open_file(path)) as img:
+        img.draft('L', (size, size))  # JPEG 直接按 1/2~1/8 比例解码
+        gray = img.convert('L')
+    gray.thumbnail((size, size))
+    a = np.asarray(gray, dtype=np.float32)
+
+    # 4 邻域拉普拉斯
+    lap = a[1:-1, :-2] + a[1:-1, 2:] + a[:-2, 1:-1] + a[2:, 1:-1] - 4 * a[1:-1, 1:-1]
+    sharpness = float(lap.var()) if lap.size else 0.0
+
+    hist = np.bincount(np.asarray(gray, dtype=np.uint8).ravel(), minlength=256)
+    total = max(int(hist.sum()), 1)
+    dark_ratio = float(hist[:dark_level + 1].sum()) / total
+    bright_ratio = float(hist[bright_level:].sum()) / total
+
+    # dHash：9x8 灰度图相邻像素比较得到 64 位
+    small = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    dhash = int(np.packbits(bits).view('>u8')[0])
+    return QualityScore(sharpness, dark_ratio, bright_ratio, dhash)
+
+
+def _hamming(value, hashes):
+    """value 与 hashes 中每个哈希的汉明距离"""
+    x = hashes ^ value
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def _mark_duplicates(paths, scores, max_distance):
+    """
+    近似重复：按清晰度从高到低，每张只与已保留（未标为重复）的照片比较，
+    距离不超过 max_distance 的标为与其中最清晰的一张重复（一组相似照片中保留最清晰的一张；
+    A~B~C 而 C 与 A 不相似时，B 标为重复，C 仍保留）
+    """
+    valid = [i for i, s in enumerate(scores) if s is not None]
+    if len(valid) < 2:
+        return
+    hashes = np.array([scores[i].dhash for i in valid], dtype=np.uint64)
+    order = sorted(range(len(valid)), key=lambda k: -scores[valid[k]].sharpness)
+    kept = np.empty(len(valid), dtype=np.uint64)  # 已保留照片的哈希，按清晰度从高到低
+    kept_index = []
+    for k in order:
+        if kept_index:
+            match = np.flatnonzero(_hamming(hashes[k], kept[:len(kept_index)]) <= max_distance)
+            if match.size:
+                scores[valid[k]].duplicate_of = paths[valid[kept_index[match[0]]]]
+                continue
+        kept[len(kept_index)] = hashes[k]
+        kept_index.append(k)
+
+
+def screen_images(paths, source=None, cfg=None):
+    """
+    批量筛查照片质量，返回 {路径: QualityScore}（无法解码的图片不在结果中）
+    source(path) 返回实际读取的路径（如网络图片的本地暂存副本）
+    未安装 NumPy 时返回空字典
+    """
+    if np is None or not paths:
+        return {}
+    cfg = dict(config.QUALITY_CONFIG, **(cfg or {}))
+    started = time.perf_counter()
+
+    def analyze(path):
+        try:
+            return _analyze(source(path) if source else path, cfg["analysis_size"],
+                            cfg["dark_level"], cfg["bright_level"])
+        except Exception as e:
+            print(f"⚠ 质量筛查跳过 {path}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=cfg["workers"]) as pool:
+        scores = list(pool.map(analyze, paths))
+    _mark_duplicates(paths, scores, cfg["duplicate_distance"])
+
+    results = {}
+    for path, score in zip(paths, scores):
+        if score is None:
+            continue
+        if score.sharpness < cfg["blur_threshold"]:
+            score.issues.append("模糊")
+        if score.dark_ratio > cfg["clip_ratio"]:
+            score.issues.append("过暗")
+        if score.bright_ratio > cfg["clip_ratio"]:
+            score.issues.append("过曝")
+        if score.duplicate_of:
+            score.issues.append("重复")
+        results[path] = score
+
+    flagged = sum(1 for s in results.values() if s.issues)
+    print(f"✓ 质量筛查: {len(results)} 张，{flagged} 张有问题（{time.perf_counter() - started:.1f}s）")
+    return results
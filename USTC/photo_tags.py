@@ -0,0 +1,72 @@
+"""
+图片标记索引
+每个图片文件夹一个 JSON 索引文件，记录缺陷标记和步骤重新分配：
+{"version": 1, "images": {"文件名": {"defect": true, "step": "Step 2"}, ...}}
+扫描时一次读入整个索引，保存时整体写回（写临时文件后替换），不再逐个重命名图片
+图片来源为压缩包时索引放在压缩包旁（<压缩包名>.report_tags.json），按成员名记录，压缩包本身不改动
+"""
+
+import json
+import os
+import tempfile
+
+import config
+import zip_photos
+
+
+class TagStore:
+    VERSION = 1
+
+    def __init__(self, folder):
+        self.folder = folder
+        if zip_photos.is_archive(folder):
+            self.path = os.path.splitext(folder)[0] + config.TAG_CONFIG["file_name"]
+        else:
+            self.path = os.path.join(folder, config.TAG_CONFIG["file_name"])
+        self.images = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                content = json.load(f)
+            images = content.get('images') if isinstance(content, dict) else None
+            if isinstance(images, dict):
+                self.images = images
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"⚠ 读取图片标记失败，按文件名识别: {e}")
+
+    def get(self, filename):
+        """返回该图片的标记 {'defect': bool, 'step': str}（可能只含其中一项），没有记录返回空字典"""
+        return self.images.get(filename) or {}
+
+    def set(self, filename, defect=None, step=None):
+        entry = dict(self.images.get(filename) or {})
+        if defect is not None:
+            entry['defect'] = bool(defect)
+        if step is not None:
+            entry['step'] = step
+        if entry != self.images.get(filename):
+            self.images[filename] = entry
+            self._dirty = True
+
+    def save(self):
+        """有改动时整体写回索引，成功（或无需写入）返回 True"""
+        if not self._dirty:
+            return True
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(self.path)))
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.VERSION, 'images': self.images}, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.path)
+            self._dirty = False
+            return True
+        except OSError as e:
+            print(f"⚠ 保存图片标记失败: {e}")
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+            return False
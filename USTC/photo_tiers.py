@@ -0,0 +1,168 @@
+"""
+照片分级存放
+报告内只嵌入压缩后的预览图，原图并行复制到报告旁的原图文件夹（<报告名>_originals），
+报告中的图片点击即打开对应原图：报告体积小、打开快，完整证据仍然一点即得
+"""
+
+import os
+import re
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import quote
+
+from PIL import Image
+from openpyxl.drawing.fill import Blip
+from openpyxl.drawing.geometry import PresetGeometry2D
+from openpyxl.drawing.picture import PictureFrame
+from openpyxl.drawing.spreadsheet_drawing import AnchorMarker, OneCellAnchor
+from openpyxl.drawing.text import Hyperlink
+from openpyxl.drawing.xdr import XDRPositiveSize2D
+from openpyxl.utils.cell import coordinate_to_tuple
+from openpyxl.utils.units import pixels_to_EMU
+
+import config
+import zip_photos
+from xlsx_package import PackagePart, read_parts, write_parts
+
+
+LINK_PREFIX = "rIdOrig"
+_HYPERLINK_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/hyperlink"
+_LINK_RE = re.compile(rb'r:id="(' + LINK_PREFIX.encode() + rb'\d+)"')
+
+
+def make_preview(path, max_px, quality):
+    """缩小为最长边不超过 max_px 的 JPEG 预览图字节（JPEG 按需降采样解码）"""
+    with Image.open(zip_photos.open_file(path)) as img:
+        img.draft('RGB', (max_px, max_px))
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        img.thumbnail((max_px, max_px), Image.Resampling.LANCZOS)
+        out = BytesIO()
+        img.save(out, format='JPEG', quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def linked_anchor(ref, width, height, index, rid, descr):
+    """
+    图片锚点（单元格 ref 左上角，宽高为像素），图片本身带超链接 rid
+    openpyxl 写入已带 pic 的锚点时只补上图片引用，超链接关系由 add_picture_links 在保存后写入
+    """
+    row, col = coordinate_to_tuple(ref)
+    anchor = OneCellAnchor(_from=AnchorMarker(col=col - 1, row=row - 1),
+                           ext=XDRPositiveSize2D(pixels_to_EMU(width), pixels_to_EMU(height)))
+    pic = PictureFrame()
+    pic.nvPicPr.cNvPr.id = index
+    pic.nvPicPr.cNvPr.name = f"Image {index}"
+    pic.nvPicPr.cNvPr.descr = descr
+    pic.nvPicPr.cNvPr.hlinkClick = Hyperlink(id=rid)
+    pic.blipFill.blip = Blip()
+    pic.blipFill.blip.cstate = "print"
+    pic.spPr.prstGeom = PresetGeometry2D(prst="rect")
+    pic.spPr.ln = None
+    anchor.pic = pic
+    return anchor
+
+
+class OriginalLinks:
+    """
+    一份报告中需要链接原图的图片：rid -> 原图路径，同一原图只复制一份
+    多PO合并报告的各PO共用一个实例
+    """
+
+    def __init__(self):
+        self.links = {}   # rid -> 原图路径
+        self.names = {}   # 原图路径 -> 原图文件夹中的文件名
+
+    def add(self, path):
+        rid = f"{LINK_PREFIX}{len(self.links) + 1}"
+        self.links[rid] = path
+        if path not in self.names:
+            stem, ext = os.path.splitext(os.path.basename(path))
+            name, n = f"{stem}{ext}", 1
+            taken = set(self.names.values())
+            while name in taken:
+                n += 1
+                name = f"{stem}_{n}{ext}"
+            self.names[path] = name
+        return rid
+
+
+def sidecar_enabled():
+    """是否把原图放到报告旁的原图文件夹（此时报告依赖原图文件夹，不能直接复用缓存的报告）"""
+    cfg = config.PHOTO_TIER_CONFIG
+    return bool(cfg.get("enabled")) and cfg["originals"] != "none"
+
+
+def sidecar_dir(report_path):
+    root, _ = os.path.splitext(report_path)
+    return root + config.PHOTO_TIER_CONFIG["folder_suffix"]
+
+
+def link_targets(report_path, links):
+    """{rid: 相对于报告的原图链接}"""
+    base = os.path.basename(sidecar_dir(report_path))
+    return {rid: quote(f"{base}/{links.names[path]}") for rid, path in links.links.items()}
+
+
+def copy_originals(report_path, links, source=None, workers=4):
+    """原图并行复制到报告旁的原图文件夹（压缩包内的原图只取出用到的成员），返回复制失败的原图列表"""
+    folder = sidecar_dir(report_path)
+    os.makedirs(folder, exist_ok=True)
+    source = source or (lambda path: path)
+
+    def copy(item):
+        path, name = item
+        target = os.path.join(folder, name)
+        try:
+            src = source(path)
+            size, mtime = zip_photos.size_mtime(src)
+            if os.path.exists(target):
+                tst = os.stat(target)
+                if tst.st_size == size and int(tst.st_mtime) == int(mtime):
+                    return None  # 重新生成同一份报告时未变化的原图不再复制
+            zip_photos.copy(src, target)
+            return None
+        except (OSError, zipfile.BadZipFile) as e:
+            print(f"⚠ 复制原图失败 {path}: {e}")
+            return path
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return [p for p in pool.map(copy, links.names.items()) if p]
+
+
+def add_picture_links(report_path, targets, level=6):
+    """在已保存的报告中写入图片超链接关系（只重写含链接的绘图关系部件，其余部件原样保留）"""
+    parts = read_parts(report_path)
+    by_name = {part.name: i for i, part in enumerate(parts)}
+    changed = False
+    for part in list(parts):
+        if not (part.name.startswith('xl/drawings/drawing') and part.name.endswith('.xml')):
+            continue
+        rids = [m.decode() for m in _LINK_RE.findall(part.data()) if m.decode() in targets]
+        if not rids:
+            continue
+        folder, base = part.name.rsplit('/', 1)
+        rels_name = f"{folder}/_rels/{base}.rels"
+        if rels_name not in by_name:
+            continue
+        rels = parts[by_name[rels_name]]
+        entries = "".join(f'<Relationship Id="{rid}" Type="{_HYPERLINK_TYPE}" Target="{targets[rid]}" '
+                          f'TargetMode="External"/>' for rid in rids)
+        data = rels.data().replace(b'</Relationships>', entries.encode('utf-8') + b'</Relationships>')
+        parts[by_name[rels_name]] = PackagePart.from_data(rels_name, data, level, date_time=rels.date_time)
+        changed = True
+    if not changed:
+        return False
+
+    fd, tmp = tempfile.mkstemp(suffix='.xlsx', dir=os.path.dirname(os.path.abspath(report_path)))
+    os.close(fd)
+    try:
+        write_parts(tmp, parts)
+        os.replace(tmp, report_path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return True
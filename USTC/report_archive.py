@@ -0,0 +1,318 @@
+"""
+报告归档（按部件内容寻址存储）
+用法：python report_archive.py add 报告.xlsx ... | list [--po 订单号] [--sku 料号] | rebuild 编号 输出.xlsx
+                           | remove 编号 | stats
+
+生成的报告按 zip 包内的部件拆开保存：每个部件的压缩数据按 SHA-256 存一份，
+相同的模板 XML、重复使用的参考图片在所有报告之间只保存一次；
+包的其余字节（文件头、中央目录）压缩后与部件顺序一起记在索引库中，可随时逐字节还原原报告
+索引（SQLite）记录订单号、料号、报告编号等，列出和查找报告不需要打开任何文件
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from io import BytesIO
+
+import config
+
+
+_LOCAL_HEADER_SIZE = 30
+
+
+def _part_ranges(payload):
+    """包内各部件压缩数据所在的 [(名称, 起始偏移, 长度)]，按偏移排序"""
+    ranges = []
+    with zipfile.ZipFile(BytesIO(payload)) as zf:
+        for info in zf.infolist():
+            header = info.header_offset
+            name_len, extra_len = struct.unpack('<HH', payload[header + 26:header + 30])
+            start = header + _LOCAL_HEADER_SIZE + name_len + extra_len
+            ranges.append((info.filename, start, info.compress_size))
+    ranges.sort(key=lambda r: r[1])
+    end = 0
+    for name, start, length in ranges:
+        if start < end or start + length > len(payload):
+            raise ValueError(f"包结构异常，无法拆分: {name}")
+        end = start + length
+    return ranges
+
+
+class ReportArchive:
+    """
+    归档库：objects/ 下按 SHA-256 保存部件数据，index.db 保存报告索引
+    多线程共用一个实例（生成器并行生成时各自归档），数据库访问加锁
+    对象文件的写入/删除与索引更新在同一个写事务（BEGIN IMMEDIATE）中完成，
+    多个进程（GUI、监控文件夹、命令行）共用一个归档库时也不会删掉刚被引用的部件
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, "index.db"), timeout=60, check_same_thread=False)
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS reports (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    po_number TEXT,
+                    sku TEXT,
+                    report_no TEXT,
+                    archived REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    skeleton BLOB NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS reports_po ON reports (po_number);
+                CREATE INDEX IF NOT EXISTS reports_sku ON reports (sku);
+                CREATE INDEX IF NOT EXISTS reports_sha ON reports (sha256);
+                CREATE TABLE IF NOT EXISTS parts (
+                    report_id INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    blob TEXT NOT NULL,
+                    PRIMARY KEY (report_id, offset)
+                );
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    refs INTEGER NOT NULL
+                );
+            """)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    # ---------------- 部件数据 ----------------
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+    def _put_object(self, digest, data):
+        """保存一个部件数据（已存在则跳过）；须在写事务中调用"""
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _get_object(self, digest):
+        with open(self._object_path(digest), 'rb') as f:
+            return f.read()
+
+    # ---------------- 归档 / 还原 ----------------
+
+    def add(self, path, data=None):
+        """
+        归档一份报告，返回归档编号（失败返回None）
+        data 为填写数据（取订单号、料号、报告编号作索引）；内容完全相同的报告只归档一次
+        """
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+            digest = hashlib.sha256(payload).hexdigest()
+
+            # 拆分和计算哈希不占锁；查重、写入对象文件和登记索引在同一个写事务中完成
+            view = memoryview(payload)
+            skeleton = []
+            parts = []
+            pos = 0
+            for name, start, length in _part_ranges(payload):
+                skeleton.append(payload[pos:start])
+                raw = view[start:start + length]
+                parts.append((start, name, hashlib.sha256(raw).hexdigest(), raw))
+                pos = start + length
+            skeleton.append(payload[pos:])
+
+            data = data or {}
+            with self._lock, self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                row = self.conn.execute("SELECT id FROM reports WHERE sha256=?", (digest,)).fetchone()
+                if row:
+                    return row[0]
+                for _, _, blob, raw in parts:
+                    self._put_object(blob, raw)
+                cur = self.conn.execute(
+                    "INSERT INTO reports (name, po_number, sku, report_no, archived, size, sha256, skeleton) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (os.path.basename(path), str(data.get('po_number', '')), str(data.get('sku', '')),
+                     str(data.get('report_no', '')), time.time(), len(payload), digest,
+                     zlib.compress(b''.join(skeleton), 9)))
+                report_id = cur.lastrowid
+                for offset, name, blob, raw in parts:
+                    self.conn.execute("INSERT INTO parts (report_id, offset, name, blob) VALUES (?, ?, ?, ?)",
+                                      (report_id, offset, name, blob))
+                    self.conn.execute(
+                        "INSERT INTO blobs (hash, size, refs) VALUES (?, ?, 1) "
+                        "ON CONFLICT(hash) DO UPDATE SET refs=refs+1", (blob, len(raw)))
+            return report_id
+        except Exception as e:
+            print(f"✗ 归档报告失败 {path}: {e}")
+            return None
+
+    def rebuild(self, report_id, output_path):
+        """逐字节还原归档的报告（校验 SHA-256），成功返回True"""
+        try:
+            with self._lock:
+                row = self.conn.execute("SELECT sha256, skeleton FROM reports WHERE id=?",
+                                        (report_id,)).fetchone()
+                parts = self.conn.execute("SELECT offset, blob FROM parts WHERE report_id=? ORDER BY offset",
+                                          (report_id,)).fetchall()
+            if row is None:
+                print(f"✗ 归档中没有编号 {report_id}")
+                return False
+            digest, skeleton = row[0], zlib.decompress(row[1])
+
+            chunks = []
+            pos = skel = 0
+            for offset, blob in parts:
+                gap = offset - pos
+                chunks.append(skeleton[skel:skel + gap])
+                skel += gap
+                raw = self._get_object(blob)
+                chunks.append(raw)
+                pos = offset + len(raw)
+            chunks.append(skeleton[skel:])
+            payload = b''.join(chunks)
+            if hashlib.sha256(payload).hexdigest() != digest:
+                print(f"✗ 还原结果校验失败: 编号 {report_id}")
+                return False
+
+            fd, tmp = tempfile.mkstemp(suffix='.xlsx', dir=os.path.dirname(os.path.abspath(output_path)))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(payload)
+                os.replace(tmp, output_path)
+            except Exception:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+            return True
+        except Exception as e:
+            print(f"✗ 还原报告失败: {e}")
+            return False
+
+    def remove(self, report_id):
+        """删除一份归档；不再被任何报告引用的部件数据一并删除"""
+        with self._lock:
+            with self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                blobs = [r[0] for r in self.conn.execute("SELECT blob FROM parts WHERE report_id=?", (report_id,))]
+                if not self.conn.execute("DELETE FROM reports WHERE id=?", (report_id,)).rowcount:
+                    return False
+                self.conn.execute("DELETE FROM parts WHERE report_id=?", (report_id,))
+                for blob in blobs:
+                    self.conn.execute("UPDATE blobs SET refs=refs-1 WHERE hash=?", (blob,))
+                unused = [r[0] for r in self.conn.execute("SELECT hash FROM blobs WHERE refs<=0")]
+                self.conn.execute("DELETE FROM blobs WHERE refs<=0")
+            # 索引提交后再删文件：在写事务中重新确认没有被新归档的报告引用（先删文件再提交失败会留下缺失的部件）
+            with self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                for blob in unused:
+                    if self.conn.execute("SELECT 1 FROM blobs WHERE hash=?", (blob,)).fetchone():
+                        continue
+                    try:
+                        os.remove(self._object_path(blob))
+                    except OSError:
+                        pass
+        return True
+
+    # ---------------- 索引 ----------------
+
+    def list_reports(self, po_number=None, sku=None, limit=None):
+        """按归档时间倒序列出 [(编号, 文件名, 订单号, 料号, 报告编号, 归档时间, 大小)]"""
+        sql = "SELECT id, name, po_number, sku, report_no, archived, size FROM reports"
+        where, args = [], []
+        if po_number:
+            where.append("po_number=?")
+            args.append(po_number)
+        if sku:
+            where.append("sku LIKE ?")
+            args.append(f"%{sku}%")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY archived DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            return self.conn.execute(sql, args).fetchall()
+
+    def stats(self):
+        """{'reports': 份数, 'logical_bytes': 原报告总大小, 'stored_bytes': 实际占用（部件+文件头）, 'objects': 部件数}"""
+        with self._lock:
+            reports, logical, skeletons = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(skeleton)), 0) FROM reports").fetchone()
+            objects, stored = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {'reports': reports, 'logical_bytes': logical,
+                'stored_bytes': stored + skeletons, 'objects': objects}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="报告归档（按部件内容寻址存储）")
+    parser.add_argument('--dir', default=None, help="归档目录")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_add = sub.add_parser('add', help="归档报告")
+    p_add.add_argument('files', nargs='+')
+    p_list = sub.add_parser('list', help="列出归档")
+    p_list.add_argument('--po', default=None)
+    p_list.add_argument('--sku', default=None)
+    p_list.add_argument('--limit', type=int, default=None)
+    p_rebuild = sub.add_parser('rebuild', help="还原报告")
+    p_rebuild.add_argument('id', type=int)
+    p_rebuild.add_argument('output')
+    p_remove = sub.add_parser('remove', help="删除归档")
+    p_remove.add_argument('id', type=int)
+    sub.add_parser('stats', help="归档统计")
+    args = parser.parse_args()
+
+    if getattr(sys, 'frozen', False):
+        base_dir = os.path.dirname(sys.executable)
+    else:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    root = args.dir or os.path.join(base_dir, config.ARCHIVE_CONFIG["dir"])
+    archive = ReportArchive(root)
+
+    if args.command == 'add':
+        for path in args.files:
+            report_id = archive.add(path)
+            if report_id is not None:
+                print(f"✓ 已归档 {path} -> {report_id}")
+    elif args.command == 'list':
+        for report_id, name, po, sku, report_no, archived, size in archive.list_reports(args.po, args.sku, args.limit):
+            stamp = time.strftime('%Y-%m-%d %H:%M', time.localtime(archived))
+            print(f"{report_id:>6}  {stamp}  {po:<12} {sku:<24} {report_no:<14} {size / 1024:>8.0f}KB  {name}")
+    elif args.command == 'rebuild':
+        if archive.rebuild(args.id, args.output):
+            print(f"✓ 已还原: {args.output}")
+    elif args.command == 'remove':
+        print("✓ 已删除" if archive.remove(args.id) else f"⚠ 归档中没有编号 {args.id}")
+    elif args.command == 'stats':
+        s = archive.stats()
+        ratio = s['stored_bytes'] / s['logical_bytes'] if s['logical_bytes'] else 0
+        print(f"报告 {s['reports']} 份，原始 {s['logical_bytes'] / 1048576:.1f}MB，"
+              f"实际占用 {s['stored_bytes'] / 1048576:.1f}MB（{ratio:.0%}），部件 {s['objects']} 个")
+    archive.close()
+
+
+if __name__ == "__main__":
+    main()
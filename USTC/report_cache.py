@@ -0,0 +1,394 @@
+"""
+报告生成缓存：模板缓存 / 图片缓存 / 报告输出缓存 / 网络图片本地暂存
+多个生成任务（GUI、本地服务的工作线程）共享同一份缓存，避免重复读盘和重复解析
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import openpyxl
+from PIL import Image
+
+import config
+import zip_photos
+from photo_tiers import make_preview
+
+
+def _file_key(path):
+    """用 (绝对路径, 修改时间, 大小) 标识文件版本，文件被改动后缓存自动失效（压缩包内的图片附加成员名）"""
+    return zip_photos.file_key(path)
+
+
+class TemplateCache:
+    """
+    模板缓存（线程安全）
+    - 缓存模板文件字节，避免每次生成都重新读盘
+    - 预先解析好若干份备用工作簿（warm），取用后由 warm() 在空闲时补齐
+    工作簿在填写过程中会被修改，所以每份解析结果只交给一个任务使用
+    """
+
+    def __init__(self, spares=1):
+        self.spares = spares
+        self._lock = threading.Lock()
+        self._data = {}      # file_key -> 模板字节
+        self._parsed = {}    # file_key -> [预解析的工作簿, ...]
+
+    def get_bytes(self, template_path):
+        key = _file_key(template_path)
+        with self._lock:
+            data = self._data.get(key)
+        if data is None:
+            with open(template_path, 'rb') as f:
+                data = f.read()
+            with self._lock:
+                # 同一路径只保留最新版本
+                for old in [k for k in self._data if k[0] == key[0] and k != key]:
+                    self._data.pop(old, None)
+                    self._parsed.pop(old, None)
+                self._data[key] = data
+        return key, data
+
+    def load(self, template_path):
+        """取出一份可修改的模板工作簿：优先使用预解析的备用份"""
+        key, data = self.get_bytes(template_path)
+        with self._lock:
+            spares = self._parsed.get(key)
+            if spares:
+                return spares.pop()
+        return openpyxl.load_workbook(BytesIO(data))
+
+    def warm(self, template_path):
+        """补齐备用工作簿（在工作线程空闲时调用）"""
+        key, data = self.get_bytes(template_path)
+        while True:
+            with self._lock:
+                if len(self._parsed.setdefault(key, [])) >= self.spares:
+                    return
+            wb = openpyxl.load_workbook(BytesIO(data))
+            with self._lock:
+                self._parsed.setdefault(key, []).append(wb)
+
+
+class ImageCache:
+    """
+    已处理图片缓存（线程安全，按字节数 LRU 淘汰）
+    缓存可直接嵌入 Excel 的图片字节：jpeg/png/gif 保持原始字节，其余格式统一转为 png
+    （与 openpyxl 写入时的处理一致，只是转换只做一次）
+    """
+
+    EMBED_FORMATS = ('JPEG', 'PNG', 'GIF')
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # file_key -> bytes
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _prepare(self, path):
+        data = zip_photos.read_bytes(path)
+        with Image.open(BytesIO(data)) as img:
+            if img.format in self.EMBED_FORMATS:
+                return data
+            out = BytesIO()
+            img.save(out, format='PNG')
+            return out.getvalue()
+
+    def get(self, path):
+        """返回可嵌入的图片字节"""
+        return self._cached(_file_key(path), lambda: self._prepare(path))
+
+    def preview(self, path, max_px, quality):
+        """返回缩小后的 JPEG 预览图字节（照片分级存放时嵌入报告）"""
+        return self._cached(_file_key(path) + (max_px, quality), lambda: make_preview(path, max_px, quality))
+
+    def _cached(self, key, produce):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+        data = produce()
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = data
+                self._size += len(data)
+                while self._size > self.max_bytes and len(self._entries) > 1:
+                    _, old = self._entries.popitem(last=False)
+                    self._size -= len(old)
+        return data
+
+    def open(self, path):
+        """返回新的文件对象，供 ExcelImage 使用（每张图片需独立的文件对象）"""
+        return BytesIO(self.get(path))
+
+
+class OutputCache:
+    """
+    按输入内容寻址的报告缓存
+    键由模板内容、填写数据、缺陷记录、所选图片内容及其步骤分配、相关配置共同计算，
+    输入完全相同时直接复制（或硬链接）已生成的报告，不再重新生成
+    超出容量或数量上限时按最近使用时间淘汰
+    """
+
+    # 生成逻辑变化导致同样输入产出不同报告时，递增此版本号使旧缓存失效
+    VERSION = 2
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3, max_entries=50, hardlink=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hardlink = hardlink
+        self._lock = threading.Lock()
+        self._hashes = {}  # file_key -> sha256，同一文件只计算一次
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _file_hash(self, path):
+        key = _file_key(path)
+        with self._lock:
+            digest = self._hashes.get(key)
+        if digest is None:
+            h = hashlib.sha256()
+            if zip_photos.is_member(path):
+                h.update(zip_photos.read_bytes(path))
+            else:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        h.update(chunk)
+            digest = h.hexdigest()
+            with self._lock:
+                self._hashes[key] = digest
+        return digest
+
+    def compute_key(self, template_path, data, defects, step_images, defect_images, source=None):
+        """计算输入内容的缓存键（source: 图片路径 -> 实际读取路径，如本地暂存副本）"""
+        source = source or (lambda path: path)
+        h = hashlib.sha256()
+        settings = {name: getattr(config, name, None) for name in (
+            'STEP_TEXT', 'STEP5_IMAGE_MAP', 'IMAGE_CONFIG', 'DEFECT_IMAGE_CONFIG',
+            'FONT_CONFIG', 'BORDER_CONFIG', 'DRAWING_RULES', 'OPTIMIZER_CONFIG', 'LAYOUT_CONFIG',
+            'TEMPLATE_SCHEMAS', 'PHOTO_TIER_CONFIG')}
+        header = {
+            'version': self.VERSION,
+            'template': self._file_hash(template_path),
+            'data': data,
+            'defects': defects,
+            'settings': settings,
+        }
+        h.update(json.dumps(header, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+        # 图片按步骤顺序记录（文件名也会写入报告，一并计入）
+        for step in sorted(step_images):
+            for path in step_images[step]:
+                h.update(f"\n{step}|{os.path.basename(path)}|{self._file_hash(source(path))}".encode('utf-8'))
+        for path in defect_images:
+            h.update(f"\ndefect|{os.path.basename(path)}|{self._file_hash(source(path))}".encode('utf-8'))
+        return h.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.xlsx")
+
+    def lookup(self, key):
+        path = self._entry_path(key)
+        return path if os.path.exists(path) else None
+
+    def fetch(self, key, output_path):
+        """把缓存的报告放到输出位置，成功返回 True"""
+        path = self.lookup(key)
+        if path is None:
+            return False
+        try:
+            if os.path.abspath(path) == os.path.abspath(output_path):
+                return True
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            if self.hardlink:
+                try:
+                    os.link(path, output_path)
+                except OSError:
+                    shutil.copyfile(path, output_path)  # 跨盘或文件系统不支持时退回复制
+            else:
+                shutil.copyfile(path, output_path)
+            os.utime(path)  # 记录最近使用时间，供淘汰参考
+            print(f"✓ 输入未变化，复用缓存报告: {output_path}")
+            return True
+        except OSError as e:
+            print(f"⚠ 复用缓存报告失败: {e}")
+            return False
+
+    def store(self, key, report_path):
+        """把新生成的报告存入缓存（写临时文件后替换，避免半成品）"""
+        try:
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+            os.close(fd)
+            shutil.copyfile(report_path, tmp)
+            os.replace(tmp, self._entry_path(key))
+            self._evict()
+        except OSError as e:
+            print(f"⚠ 报告写入缓存失败: {e}")
+
+    def _evict(self):
+        """超出容量或数量上限时，按最近使用时间从旧到新淘汰"""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.xlsx'):
+                    path = os.path.join(self.cache_dir, name)
+                    st = os.stat(path)
+                    entries.append((st.st_mtime, st.st_size, path))
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            while entries and (total > self.max_bytes or len(entries) > self.max_entries):
+                _, size, path = entries.pop(0)
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+
+def is_remote_path(path):
+    """是否位于网络共享盘（UNC 路径，或 Windows 上映射的网络驱动器）"""
+    path = os.path.abspath(path)
+    if path.startswith(('\\\\', '//')):
+        return True
+    if os.name == 'nt':
+        import ctypes
+        drive = os.path.splitdrive(path)[0]
+        if drive:
+            return ctypes.windll.kernel32.GetDriveTypeW(drive + '\\') == 4  # DRIVE_REMOTE
+    return False
+
+
+class StagingCache:
+    """
+    网络共享盘图片的本地暂存（线程安全）
+    选中的图片用有限个线程并行复制到本地一次，之后缩略图、预检、插入报告都读本地副本
+    - 本地副本的修改时间设为源文件的修改时间，按 (大小, 修改时间) 校验，源文件变化后重新复制
+    - 本地副本的访问时间记录最近使用时间，按存放时长和总容量淘汰
+    """
+
+    PROTECT_SECONDS = 600
+
+    def __init__(self, cache_dir, max_bytes=4 * 1024 ** 3, max_age_seconds=7 * 86400, workers=8,
+                 remote_only=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.remote_only = remote_only
+        self._lock = threading.Lock()
+        self._pending = {}  # 源文件绝对路径 -> Future
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="staging")
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.evict()
+
+    def wants(self, path):
+        # 压缩包内的图片按成员直接读取，不暂存整个压缩包
+        if zip_photos.is_member(path):
+            return False
+        return not self.remote_only or is_remote_path(path)
+
+    def _local_path(self, src):
+        digest = hashlib.sha1(src.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + os.path.splitext(src)[1].lower())
+
+    def _stage(self, src):
+        """复制到本地（已有且校验一致时直接使用），返回本地路径"""
+        st = os.stat(src)
+        local = self._local_path(src)
+        now = time.time_ns()
+        try:
+            lst = os.stat(local)
+            if lst.st_size == st.st_size and lst.st_mtime_ns == st.st_mtime_ns:
+                os.utime(local, ns=(now, lst.st_mtime_ns))  # 记录最近使用时间
+                with self._lock:
+                    self.hits += 1
+                return local
+        except FileNotFoundError:
+            pass
+
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        os.close(fd)
+        try:
+            shutil.copyfile(src, tmp)
+            if os.path.getsize(tmp) != st.st_size:
+                raise OSError(f"复制不完整: {src}")
+            os.utime(tmp, ns=(now, st.st_mtime_ns))
+            os.replace(tmp, local)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        with self._lock:
+            self.misses += 1
+            self._size += st.st_size
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+        return local
+
+    def prefetch(self, paths):
+        """后台并行复制（不等待完成）"""
+        with self._lock:
+            for src in paths:
+                if not self.wants(src):
+                    continue
+                src = os.path.abspath(src)
+                future = self._pending.get(src)
+                if future is None or future.done():
+                    self._pending[src] = self._pool.submit(self._stage, src)
+
+    def get(self, path):
+        """返回可读取的路径：本地副本，无需暂存或暂存失败时返回原路径"""
+        if not self.wants(path):
+            return path
+        src = os.path.abspath(path)
+        with self._lock:
+            future = self._pending.pop(src, None)
+        try:
+            return future.result() if future is not None else self._stage(src)
+        except OSError as e:
+            print(f"⚠ 图片暂存失败，直接读取原文件 {path}: {e}")
+            return path
+
+    def evict(self):
+        """删除超过存放时长的副本，总容量仍超限时按最近使用时间从旧到新删除"""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, name)
+                if name.endswith('.tmp'):
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_atime, st.st_size, path))
+            entries.sort()
+            now = time.time()
+            cutoff = now - self.max_age_seconds
+            total = sum(size for _, size, _ in entries)
+            for used, size, path in entries:
+                if used >= cutoff and total <= self.max_bytes:
+                    break
+                if used > now - self.PROTECT_SECONDS:
+                    break  # 最近刚用过的副本可能正被读取，超出容量也暂不删除
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self._size = total
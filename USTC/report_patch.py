@@ -0,0 +1,239 @@
+"""
+已生成报告的增量修改
+只重写指定工作表中的指定单元格，drawings / media 等其余部件按原始压缩数据原样保留，
+修正审批人、日期、缺陷数量等文字内容时无需重新嵌入图片
+"""
+
+import os
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ET
+
+from openpyxl.utils import column_index_from_string
+from openpyxl.utils.cell import coordinate_from_string
+
+from xlsx_package import XML_NAMESPACES, PackagePart, read_parts, write_parts, xml_bytes
+
+
+NS_MAIN = XML_NAMESPACES['']
+NS_REL = XML_NAMESPACES['r']
+NS_PKG_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
+NS_CUSTOM = 'http://schemas.openxmlformats.org/officeDocument/2006/custom-properties'
+
+
+def _q(tag):
+    return f'{{{NS_MAIN}}}{tag}'
+
+
+def _sheet_part_names(read):
+    """工作表名 -> 包内部件名（read(部件名) 返回部件数据，不存在时返回 None）"""
+    workbook = ET.fromstring(read('xl/workbook.xml'))
+    rels = ET.fromstring(read('xl/_rels/workbook.xml.rels'))
+    targets = {}
+    for rel in rels.iter(f'{{{NS_PKG_REL}}}Relationship'):
+        target = rel.get('Target')
+        targets[rel.get('Id')] = target.lstrip('/') if target.startswith('/') else f"xl/{target}"
+    result = {}
+    for sheet in workbook.iter(_q('sheet')):
+        result[sheet.get('name')] = targets.get(sheet.get(f'{{{NS_REL}}}id'))
+    return result
+
+
+def _shared_strings(read):
+    data = read('xl/sharedStrings.xml')
+    if data is None:
+        return []
+    root = ET.fromstring(data)
+    return [''.join(t.text or '' for t in si.iter(_q('t'))) for si in root.iter(_q('si'))]
+
+
+def _cell_value(cell, shared):
+    t = cell.get('t')
+    if t == 'inlineStr':
+        return ''.join(x.text or '' for x in cell.iter(_q('t')))
+    v = cell.find(_q('v'))
+    if v is None or v.text is None:
+        return None
+    if t == 's':
+        return shared[int(v.text)]
+    return v.text
+
+
+def _zip_reader(zf):
+    def read(name):
+        try:
+            return zf.read(name)
+        except KeyError:
+            return None
+    return read
+
+
+def _parts_reader(parts):
+    return lambda name: parts[name].data() if name in parts else None
+
+
+def read_sheet_names(report_path):
+    """读取报告中的工作表名（按工作簿顺序；只读 workbook.xml 及其关系，不读图片等部件）"""
+    with zipfile.ZipFile(report_path) as zf:
+        return list(_sheet_part_names(_zip_reader(zf)))
+
+
+def read_custom_property(report_path, name):
+    """读取报告的自定义文档属性（docProps/custom.xml），没有该属性时返回 None"""
+    with zipfile.ZipFile(report_path) as zf:
+        data = _zip_reader(zf)('docProps/custom.xml')
+    if data is None:
+        return None
+    for prop in ET.fromstring(data).iter(f'{{{NS_CUSTOM}}}property'):
+        if prop.get('name') == name and len(prop):
+            return prop[0].text
+    return None
+
+
+def read_cell_values(report_path, sheet_name, refs):
+    """读取报告中指定单元格的当前值（只解析该工作表和共享字符串）"""
+    with zipfile.ZipFile(report_path) as zf:
+        read = _zip_reader(zf)
+        part_name = _sheet_part_names(read).get(sheet_name)
+        if part_name is None:
+            raise KeyError(f"报告中没有工作表: {sheet_name}")
+        root = ET.fromstring(read(part_name))
+        shared = _shared_strings(read)
+    wanted = set(refs)
+    values = {ref: None for ref in refs}
+    for cell in root.iter(_q('c')):
+        if cell.get('r') in wanted:
+            values[cell.get('r')] = _cell_value(cell, shared)
+    return values
+
+
+def _find_cell(sheet_data, ref, create):
+    """查找单元格元素，create=True 时按行列顺序插入缺失的行/单元格"""
+    col_letter, row = coordinate_from_string(ref)
+    col = column_index_from_string(col_letter)
+
+    row_elem, row_pos = None, len(sheet_data)
+    for i, r in enumerate(sheet_data):
+        r_idx = int(r.get('r'))
+        if r_idx == row:
+            row_elem = r
+            break
+        if r_idx > row:
+            row_pos = i
+            break
+    if row_elem is None:
+        if not create:
+            return None
+        row_elem = ET.Element(_q('row'), {'r': str(row)})
+        sheet_data.insert(row_pos, row_elem)
+
+    cell_pos = len(row_elem)
+    for i, c in enumerate(row_elem):
+        c_col = column_index_from_string(coordinate_from_string(c.get('r'))[0])
+        if c_col == col:
+            return c
+        if c_col > col:
+            cell_pos = i
+            break
+    if not create:
+        return None
+    cell = ET.Element(_q('c'), {'r': ref})
+    row_elem.insert(cell_pos, cell)
+    # 行上记录的 spans 只是提示，插入新列后删除以免不一致
+    row_elem.attrib.pop('spans', None)
+    return cell
+
+
+def _set_value(cell, value):
+    """写入单元格值（保留样式 s），字符串使用内联字符串，无需改动 sharedStrings"""
+    for child in list(cell):
+        cell.remove(child)
+    cell.attrib.pop('t', None)
+    if value is None or value == '':
+        return
+    if isinstance(value, bool):
+        cell.set('t', 'b')
+        ET.SubElement(cell, _q('v')).text = '1' if value else '0'
+    elif isinstance(value, (int, float)):
+        ET.SubElement(cell, _q('v')).text = repr(value) if isinstance(value, float) else str(value)
+    else:
+        cell.set('t', 'inlineStr')
+        t = ET.SubElement(ET.SubElement(cell, _q('is')), _q('t'))
+        t.text = str(value)
+        if t.text != t.text.strip():
+            t.set('{http://www.w3.org/XML/1998/namespace}space', 'preserve')
+
+
+def _patch_sheet(xml, cells, swap_styles):
+    root = ET.fromstring(xml)
+    sheet_data = root.find(_q('sheetData'))
+    for ref, value in cells.items():
+        cell = _find_cell(sheet_data, ref, create=value not in (None, ''))
+        if cell is not None:
+            _set_value(cell, value)
+    for ref_a, ref_b in swap_styles:
+        a = _find_cell(sheet_data, ref_a, create=True)
+        b = _find_cell(sheet_data, ref_b, create=True)
+        style_a, style_b = a.get('s'), b.get('s')
+        for cell, style in ((a, style_b), (b, style_a)):
+            if style is None:
+                cell.attrib.pop('s', None)
+            else:
+                cell.set('s', style)
+    return xml_bytes(root)
+
+
+def _rename_sheets(parts, renames, level):
+    """重命名工作表：workbook.xml、定义名称中的引用、docProps/app.xml 的标题列表"""
+    def replace(part_name, old, new):
+        part = parts.get(part_name)
+        if part is None:
+            return
+        data = part.data()
+        for src, dst in ((f'name="{old}"', f'name="{new}"'),
+                         (f"'{old}'!", f"'{new}'!"),
+                         (f'<vt:lpstr>{old}</vt:lpstr>', f'<vt:lpstr>{new}</vt:lpstr>')):
+            data = data.replace(_xml_escape(src).encode('utf-8'), _xml_escape(dst).encode('utf-8'))
+        parts[part_name] = PackagePart.from_data(part_name, data, level, date_time=part.date_time)
+
+    for old, new in renames.items():
+        replace('xl/workbook.xml', old, new)
+        replace('docProps/app.xml', old, new)
+
+
+def _xml_escape(text):
+    return text.replace('&', '&amp;')
+
+
+def patch_report(report_path, sheet_updates, output_path=None, renames=None, level=6):
+    """
+    修改报告中的单元格
+    sheet_updates: {工作表名: {'cells': {坐标: 值}, 'swap_styles': [(坐标A, 坐标B), ...]}}
+    renames: {旧工作表名: 新工作表名}
+    output_path 为空时原地覆盖；先写临时文件再替换，失败不会损坏原报告
+    """
+    output_path = output_path or report_path
+    ordered = read_parts(report_path)
+    parts = {p.name: p for p in ordered}
+    sheet_parts = _sheet_part_names(_parts_reader(parts))
+
+    for sheet_name, update in sheet_updates.items():
+        part_name = sheet_parts.get(sheet_name)
+        if part_name is None:
+            raise KeyError(f"报告中没有工作表: {sheet_name}")
+        old = parts[part_name]
+        xml = _patch_sheet(old.data(), update.get('cells', {}), update.get('swap_styles', []))
+        parts[part_name] = PackagePart.from_data(part_name, xml, level, date_time=old.date_time)
+    if renames:
+        _rename_sheets(parts, {o: n for o, n in renames.items() if o != n}, level)
+
+    fd, tmp_path = tempfile.mkstemp(suffix='.xlsx', dir=os.path.dirname(os.path.abspath(output_path)))
+    os.close(fd)
+    try:
+        write_parts(tmp_path, [parts[p.name] for p in ordered])
+        os.replace(tmp_path, output_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
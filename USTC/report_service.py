@@ -0,0 +1,359 @@
+"""
+本地报告生成服务（供 MES、发货站等系统调用，无需操作 GUI）
+用法：python report_service.py [--port 8765] [--workers 2] [--template 模板.xlsx]
+
+接口（只监听本机地址）：
+POST /reports            提交任务，返回 job_id（队列已满时返回 503）
+GET  /reports/<id>       查询任务状态（已结束的任务记录保留 job_ttl_seconds）
+GET  /reports/<id>/file  下载生成的报告
+GET  /metrics            队列深度、处理中任务数、耗时分位数、缓存命中
+GET  /health             存活检查
+
+POST /reports 请求体（JSON），字段与 GUI 中 generate_report 收集的一致：
+{
+    "data": {"inspector": "张三", "po_number": "4500123456", "sku": "P61718/M50XTCCSEN",
+             "ship_quantity": 1800, ...},
+    "defects": [{"description": "划痕", "critical": 0, "major": 1, "minor": 0}],
+    "step_images": {"Step 1": ["D:/photos/a.jpg", {"filename": "b.jpg", "content": "<base64>"}]},
+    "defect_images": ["D:/photos/(缺陷)c.jpg"],
+    "template": "可选，默认使用程序目录下的 模板.xlsx",
+    "output_name": "可选，报告文件名（只能是 .xlsx 文件名，不含目录），存放到 SERVICE_CONFIG['output_dir']"
+}
+图片既可以是本机路径，也可以是 {"filename", "content"(base64)} 形式的上传内容
+请求须为 Content-Type: application/json，且不能带 Origin 头：浏览器中打开的网页不能调用本服务
+"""
+
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import math
+import os
+import shutil
+import sys
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import config
+from main import STEP_NAMES, InspectionReportGenerator, create_output_cache, create_report_archive, model_prefix
+from report_cache import TemplateCache, ImageCache
+
+
+def _percentile(sorted_values, pct):
+    """最近秩法计算分位数"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _valid_output_name(name):
+    """报告文件名只能是 output_dir 下的 .xlsx 文件名，不能带目录或指向上级目录"""
+    return (isinstance(name, str) and name.lower().endswith('.xlsx')
+            and not name.startswith('.') and not any(c in name for c in '/\\:\0'))
+
+
+class ReportService:
+    def __init__(self, base_dir, template_path=None, cfg=None):
+        self.cfg = dict(config.SERVICE_CONFIG, **(cfg or {}))
+        self.base_dir = base_dir
+        self.template_path = template_path or os.path.join(base_dir, "模板.xlsx")
+        self.output_dir = os.path.join(base_dir, self.cfg["output_dir"])
+        self.upload_dir = os.path.join(self.output_dir, "uploads")
+        os.makedirs(self.upload_dir, exist_ok=True)
+
+        # 所有工作线程共享的缓存
+        self.template_cache = TemplateCache(spares=self.cfg["template_spares"])
+        self.image_cache = ImageCache(max_bytes=self.cfg["image_cache_mb"] * 1024 * 1024)
+        # 生成器不保存报告状态，所有工作线程共用一个实例
+        self.generator = InspectionReportGenerator(template_cache=self.template_cache,
+                                                   image_cache=self.image_cache,
+                                                   output_cache=create_output_cache(base_dir),
+                                                   archive=create_report_archive(base_dir))
+
+        self.executor = ThreadPoolExecutor(max_workers=self.cfg["workers"],
+                                           thread_name_prefix="report-worker")
+        self.queue = None
+        self.jobs = {}
+        self.finished_jobs = deque()  # (完成时间, job_id)，按完成先后，用于清理过期任务记录
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=self.cfg["latency_window"])     # 提交到完成
+        self.build_times = deque(maxlen=self.cfg["latency_window"])   # 实际生成耗时
+
+    # ---------------- 任务处理 ----------------
+
+    def _validate(self, payload):
+        """校验请求内容，返回错误描述（无错误返回空字符串）"""
+        if not isinstance(payload, dict):
+            return "请求体必须是JSON对象"
+        data = payload.get('data')
+        if not isinstance(data, dict):
+            return "缺少 data 字段"
+        try:
+            qty = int(data.get('ship_quantity') or 0)
+        except (TypeError, ValueError):
+            qty = 0
+        if qty <= 0:
+            return "请输入有效的出货数量(ship_quantity)"
+        step_images = payload.get('step_images') or {}
+        if not isinstance(step_images, dict):
+            return "step_images 必须是 {步骤: [图片]} 形式"
+        for step in step_images:
+            if step not in STEP_NAMES:
+                return f"未知步骤: {step}"
+        if not isinstance(payload.get('defect_images') or [], list):
+            return "defect_images 必须是列表"
+        output_name = payload.get('output_name')
+        if output_name is not None and not _valid_output_name(output_name):
+            return "output_name 只能是 .xlsx 文件名，不能包含目录"
+        template = payload.get('template') or self.template_path
+        if not os.path.exists(template):
+            return f"模板不存在: {template}"
+        return ""
+
+    def _resolve_image(self, job_id, item, index):
+        """
+        本机路径原样返回；上传内容写入该任务上传目录下按序号区分的子目录后返回路径
+        （同一任务中同名的上传互不覆盖，报告中仍显示原文件名）
+        """
+        if isinstance(item, str):
+            return item
+        name = os.path.basename(item.get('filename') or f"{uuid.uuid4().hex}.jpg")
+        upload_dir = os.path.join(self.upload_dir, job_id, str(index))
+        os.makedirs(upload_dir, exist_ok=True)
+        path = os.path.join(upload_dir, name)
+        with open(path, 'wb') as f:
+            f.write(base64.b64decode(item['content']))
+        return path
+
+    def _run_job(self, job):
+        """在工作线程中执行"""
+        payload = job['payload']
+        data = dict(payload['data'])
+        data['ship_quantity'] = int(data['ship_quantity'])
+        if not data.get('report_no'):
+            data['report_no'] = self.generator.generate_report_no()
+
+        seq = itertools.count(1)
+        step_images = {step: [] for step in STEP_NAMES}
+        for step, items in (payload.get('step_images') or {}).items():
+            step_images[step] = [self._resolve_image(job['id'], it, next(seq)) for it in items]
+        defect_images = [self._resolve_image(job['id'], it, next(seq)) for it in payload.get('defect_images') or []]
+
+        output_name = payload.get('output_name')
+        if not output_name:
+            po_number = str(data.get('po_number', '')).strip() or "PO"
+            output_name = f"{model_prefix(data.get('sku', ''))}_{po_number}_{job['id'][:8]}.xlsx"
+        output = os.path.join(self.output_dir, output_name)
+        job['output'] = output
+
+        template = payload.get('template') or self.template_path
+        start = time.perf_counter()
+        ok = self.generator.build_report(template, data, payload.get('defects') or [],
+                                         step_images, defect_images, output)
+        self.build_times.append(time.perf_counter() - start)
+
+        # 空闲时补齐备用模板，下一个任务可直接取用
+        self.template_cache.warm(template)
+        return ok
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            job['status'] = 'running'
+            job['started'] = time.time()
+            self.running += 1
+            try:
+                ok = await loop.run_in_executor(self.executor, self._run_job, job)
+                if ok:
+                    job['status'] = 'done'
+                    self.completed += 1
+                else:
+                    job['status'] = 'failed'
+                    job['error'] = "报告生成失败，详见服务日志"
+                    self.failed += 1
+            except Exception as e:
+                job['status'] = 'failed'
+                job['error'] = str(e)
+                self.failed += 1
+            finally:
+                self.running -= 1
+                job['finished'] = time.time()
+                self.latencies.append(job['finished'] - job['submitted'])
+                job.pop('payload', None)
+                # 上传的图片已嵌入报告，不再保留
+                shutil.rmtree(os.path.join(self.upload_dir, job['id']), ignore_errors=True)
+                self.finished_jobs.append((job['finished'], job['id']))
+                self._prune_jobs()
+                self.queue.task_done()
+
+    def _prune_jobs(self):
+        """已结束的任务记录超过保留时间或条数上限时删除（只删记录，不删报告文件）"""
+        expire = time.time() - self.cfg["job_ttl_seconds"]
+        while self.finished_jobs and (len(self.finished_jobs) > self.cfg["job_history"]
+                                      or self.finished_jobs[0][0] < expire):
+            _, job_id = self.finished_jobs.popleft()
+            self.jobs.pop(job_id, None)
+
+    def submit(self, payload):
+        """提交任务，返回 (HTTP状态, 响应内容)"""
+        error = self._validate(payload)
+        if error:
+            return HTTPStatus.BAD_REQUEST, {'error': error}
+        self._prune_jobs()
+        job_id = uuid.uuid4().hex
+        job = {'id': job_id, 'status': 'queued', 'submitted': time.time(),
+               'started': None, 'finished': None, 'output': None, 'error': None,
+               'payload': payload}
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {'error': "队列已满，请稍后重试"}
+        self.jobs[job_id] = job
+        return HTTPStatus.ACCEPTED, {'job_id': job_id, 'status': 'queued'}
+
+    def metrics(self):
+        latencies = sorted(self.latencies)
+        build_times = sorted(self.build_times)
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_capacity': self.cfg["queue_size"],
+            'running': self.running,
+            'workers': self.cfg["workers"],
+            'completed': self.completed,
+            'failed': self.failed,
+            'latency_seconds': {f"p{p}": _percentile(latencies, p) for p in (50, 90, 99)},
+            'build_seconds': {f"p{p}": _percentile(build_times, p) for p in (50, 90, 99)},
+            'image_cache': {'hits': self.image_cache.hits, 'misses': self.image_cache.misses},
+        }
+
+    @staticmethod
+    def _job_view(job):
+        return {k: job[k] for k in ('id', 'status', 'submitted', 'started', 'finished', 'output', 'error')}
+
+    # ---------------- HTTP ----------------
+
+    async def _route(self, method, target, body):
+        path = target.split('?', 1)[0].rstrip('/')
+        parts = [p for p in path.split('/') if p]
+
+        if method == 'GET' and parts == ['health']:
+            return HTTPStatus.OK, {'status': 'ok'}
+        if method == 'GET' and parts == ['metrics']:
+            return HTTPStatus.OK, self.metrics()
+        if method == 'POST' and parts == ['reports']:
+            try:
+                payload = json.loads(body.decode('utf-8'))
+            except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                return HTTPStatus.BAD_REQUEST, {'error': f"JSON格式错误: {e}"}
+            return self.submit(payload)
+        if method == 'GET' and len(parts) in (2, 3) and parts[0] == 'reports':
+            job = self.jobs.get(parts[1])
+            if job is None:
+                return HTTPStatus.NOT_FOUND, {'error': "任务不存在"}
+            if len(parts) == 2:
+                return HTTPStatus.OK, self._job_view(job)
+            if parts[2] == 'file':
+                if job['status'] != 'done':
+                    return HTTPStatus.CONFLICT, {'error': f"任务状态为 {job['status']}"}
+                loop = asyncio.get_running_loop()
+                with open(job['output'], 'rb') as f:
+                    content = await loop.run_in_executor(None, f.read)
+                return HTTPStatus.OK, content
+        return HTTPStatus.NOT_FOUND, {'error': "接口不存在"}
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                request_line = await reader.readline()
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get('content-length') or 0)
+                content_type = headers.get('content-type', '').split(';', 1)[0].strip().lower()
+                if 'origin' in headers:
+                    # 浏览器中网页发起的请求都带 Origin；本服务只供本机程序调用
+                    status, payload = HTTPStatus.FORBIDDEN, {'error': "不接受浏览器跨站请求"}
+                elif method.upper() == 'POST' and content_type != 'application/json':
+                    status, payload = HTTPStatus.UNSUPPORTED_MEDIA_TYPE, {'error': "请求须为 application/json"}
+                elif length > self.cfg["max_body_mb"] * 1024 * 1024:
+                    status, payload = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': "请求体过大"}
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status, payload = await self._route(method.upper(), target, body)
+            except (ValueError, asyncio.IncompleteReadError) as e:
+                status, payload = HTTPStatus.BAD_REQUEST, {'error': f"请求格式错误: {e}"}
+            except Exception as e:
+                status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)}
+
+            if isinstance(payload, bytes):
+                content = payload
+                ctype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            else:
+                content = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                ctype = 'application/json; charset=utf-8'
+            head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Type: {ctype}\r\n"
+                    f"Content-Length: {len(content)}\r\n"
+                    f"Connection: close\r\n\r\n")
+            writer.write(head.encode('latin-1') + content)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, ready=None):
+        """启动服务；ready 为可选的 asyncio.Event，监听开始后置位（便于本机测试）"""
+        self.queue = asyncio.Queue(maxsize=self.cfg["queue_size"])
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.cfg["workers"])]
+        # 提前解析模板，第一个请求不必等待
+        loop = asyncio.get_running_loop()
+        if os.path.exists(self.template_path):
+            await loop.run_in_executor(self.executor, self.template_cache.warm, self.template_path)
+
+        server = await asyncio.start_server(self._handle, self.cfg["host"], self.cfg["port"])
+        print(f"✓ 报告服务已启动: http://{self.cfg['host']}:{self.cfg['port']}")
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for w in workers:
+                w.cancel()
+            self.executor.shutdown(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地报告生成服务")
+    parser.add_argument('--port', type=int, default=config.SERVICE_CONFIG["port"])
+    parser.add_argument('--workers', type=int, default=config.SERVICE_CONFIG["workers"])
+    parser.add_argument('--template', default=None, help="默认模板路径")
+    args = parser.parse_args()
+
+    if getattr(sys, 'frozen', False):
+        base_dir = os.path.dirname(sys.executable)
+    else:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+
+    service = ReportService(base_dir, template_path=args.template,
+                            cfg={'port': args.port, 'workers': args.workers})
+    try:
+        asyncio.run(service.serve())
+    except KeyboardInterrupt:
+        print("服务已停止")
+
+
+if __name__ == "__main__":
+    main()
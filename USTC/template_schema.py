@@ -0,0 +1,110 @@
+"""
+模板结构的编译
+config.TEMPLATE_SCHEMAS 用逻辑字段描述各单元格，加载时一次编译为行列号和格式，
+填写时直接按行列号写入，不再逐格拼接坐标字符串；抽样计划按数量区间下限做 bisect 查找
+"""
+
+import bisect
+import os
+import string
+import threading
+
+from openpyxl.utils import column_index_from_string
+from openpyxl.utils.cell import coordinate_from_string
+
+import config
+
+
+def _coords(ref):
+    col, row = coordinate_from_string(ref)
+    return row, column_index_from_string(col)
+
+
+class SchemaField:
+    """一个单元格：所需字段齐全时按格式写入（格式恰为 "{字段}" 时写入原值）"""
+
+    __slots__ = ('ref', 'row', 'col', 'fmt', 'keys', 'raw_key')
+
+    def __init__(self, ref, fmt):
+        self.ref = ref
+        self.row, self.col = _coords(ref)
+        self.fmt = fmt
+        self.keys = tuple(name for _, name, _, _ in string.Formatter().parse(fmt) if name)
+        self.raw_key = self.keys[0] if len(self.keys) == 1 and fmt == f"{{{self.keys[0]}}}" else None
+
+    def value(self, values):
+        if self.raw_key:
+            return values[self.raw_key]
+        return self.fmt.format_map(values)
+
+
+class SamplingTable:
+    """抽样计划查找表：数量 -> 区间序号（按区间下限 bisect）"""
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.lows = [low for low, _ in plan['ranges']]
+        self.highs = [high for _, high in plan['ranges']]
+
+    def index(self, quantity):
+        i = bisect.bisect_right(self.lows, quantity) - 1
+        if i < 0 or quantity > self.highs[i]:
+            return None
+        return i
+
+    def values(self, i):
+        return {
+            'sample_size': self.plan['sample_sizes'][i],
+            'critical': self.plan['critical'][i],
+            'major': self.plan['major'][i],
+            'minor': self.plan['minor'][i],
+        }
+
+
+class TemplateSchema:
+    """编译后的模板结构"""
+
+    def __init__(self, spec):
+        self.sheet = spec["sheet"]
+        self.fields = [SchemaField(ref, fmt) for ref, fmt in spec["fields"].items()]
+
+        sampling = spec["sampling"]
+        self.sampling_columns = list(sampling["columns"])
+        self.sampling_rows = dict(sampling["rows"])
+        self.sampling_highlight = list(sampling["highlight"])
+
+        defects = spec["defects"]
+        self.defect_start_row = defects["start_row"]
+        self.defect_max_rows = defects["max_rows"]
+        self.defect_columns = dict(defects["columns"])
+
+        # 所有用到的单元格 坐标 -> (行, 列)，写入时直接查表
+        refs = [f.ref for f in self.fields]
+        refs += [f"{col}{row}" for col in self.sampling_columns for row in self.sampling_rows.values()]
+        refs += [f"{col}{self.defect_start_row + i}" for i in range(self.defect_max_rows)
+                 for col in self.defect_columns.values()]
+        self.coords = {ref: _coords(ref) for ref in refs}
+        self.max_row = max(row for row, _ in self.coords.values())
+        self.max_col = max(col for _, col in self.coords.values())
+
+    def sampling_ref(self, col_index, item):
+        return f"{self.sampling_columns[col_index]}{self.sampling_rows[item]}"
+
+    def defect_ref(self, index, item):
+        return f"{self.defect_columns[item]}{self.defect_start_row + index}"
+
+
+_compiled = {}
+_lock = threading.Lock()
+
+
+def get_schema(template_path=None):
+    """按模板文件名取编译好的模板结构（每种只编译一次）"""
+    schemas = config.TEMPLATE_SCHEMAS
+    name = os.path.basename(template_path) if template_path else None
+    key = name if name in schemas else "default"
+    with _lock:
+        schema = _compiled.get(key)
+        if schema is None:
+            schema = _compiled[key] = TemplateSchema(schemas[key])
+        return schema
@@ -0,0 +1,19 @@
+"""
+测试从 USTC 目录导入各模块
+配置文件 config 没有扩展名，按 Python 源文件加载为 config 模块
+"""
+
+import os
+import sys
+from importlib.machinery import SourceFileLoader
+from importlib.util import module_from_spec, spec_from_loader
+
+USTC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if USTC_DIR not in sys.path:
+    sys.path.insert(0, USTC_DIR)
+
+if 'config' not in sys.modules:
+    _loader = SourceFileLoader('config', os.path.join(USTC_DIR, 'config'))
+    _config = module_from_spec(spec_from_loader('config', _loader))
+    _loader.exec_module(_config)
+    sys.modules['config'] = _config
@@ -0,0 +1,51 @@
+from hot_folder import JobQueue
+
+
+def _queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"))
+
+
+def _attempts(queue, name):
+    return queue.conn.execute("SELECT attempts FROM jobs WHERE name=?", (name,)).fetchone()[0]
+
+
+def _run(queue, name, ok=True):
+    queue.mark_running(name)
+    queue.finish(name, ok)
+
+
+def test_redelivered_job_starts_with_fresh_attempts(tmp_path):
+    queue = _queue(tmp_path)
+    for _ in range(3):
+        queue.enqueue("PO1", "sig")
+        assert queue.next_queued(5, ()) == [("PO1", 0)]
+        _run(queue, "PO1")
+
+
+def test_failed_job_resubmitted_gets_full_retries(tmp_path):
+    queue = _queue(tmp_path)
+    queue.enqueue("PO1", "sig-1")
+    _run(queue, "PO1", ok=False)
+    queue.enqueue("PO1", "sig-2")
+    assert _attempts(queue, "PO1") == 0
+
+
+def test_interrupted_runs_count_toward_max_attempts(tmp_path):
+    queue = _queue(tmp_path)
+    queue.enqueue("PO1", "sig")
+    queue.mark_running("PO1")
+    assert queue.recover() == 1
+    assert queue.next_queued(5, ()) == [("PO1", 1)]
+    # 仍在队列中、内容未变时重新登记不清零
+    queue.enqueue("PO1", "sig")
+    assert _attempts(queue, "PO1") == 1
+    # 内容变化视为新交来的任务
+    queue.enqueue("PO1", "sig-2")
+    assert _attempts(queue, "PO1") == 0
+
+
+def test_next_queued_skips_in_flight(tmp_path):
+    queue = _queue(tmp_path)
+    queue.enqueue("PO1", "a")
+    queue.enqueue("PO2", "b")
+    assert [name for name, _ in queue.next_queued(5, {"PO1"})] == ["PO2"]
@@ -0,0 +1,83 @@
+import os
+import zipfile
+
+from report_archive import ReportArchive
+
+SHARED_MEDIA = bytes(range(256)) * 64
+
+
+def _make_report(path, sheet_text):
+    """模拟报告包：共用的样式和图片，各自不同的工作表；图片不压缩存放，XML 压缩"""
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('xl/styles.xml', '<styleSheet/>' * 50, compress_type=zipfile.ZIP_DEFLATED)
+        zf.writestr('xl/media/image1.png', SHARED_MEDIA, compress_type=zipfile.ZIP_STORED)
+        zf.writestr('xl/worksheets/sheet1.xml', sheet_text, compress_type=zipfile.ZIP_DEFLATED)
+    return path
+
+
+def _blob(archive, report_id, name):
+    return archive.conn.execute("SELECT blob FROM parts WHERE report_id=? AND name=?",
+                                (report_id, name)).fetchone()[0]
+
+
+def _refs(archive, blob):
+    row = archive.conn.execute("SELECT refs FROM blobs WHERE hash=?", (blob,)).fetchone()
+    return row[0] if row else 0
+
+
+def _object_files(archive):
+    return sorted(name for _, _, files in os.walk(archive.objects_dir) for name in files)
+
+
+def test_rebuild_is_byte_identical(tmp_path):
+    archive = ReportArchive(str(tmp_path / "archive"))
+    report = _make_report(str(tmp_path / "a.xlsx"), '<worksheet>A</worksheet>')
+    report_id = archive.add(report, {'po_number': '4500', 'sku': 'P61718/M50', 'report_no': 'R1'})
+    out = str(tmp_path / "restored.xlsx")
+    assert archive.rebuild(report_id, out)
+    with open(report, 'rb') as a, open(out, 'rb') as b:
+        assert a.read() == b.read()
+    assert archive.list_reports(po_number='4500')[0][:5] == (report_id, 'a.xlsx', '4500', 'P61718/M50', 'R1')
+
+
+def test_identical_report_archived_once(tmp_path):
+    archive = ReportArchive(str(tmp_path / "archive"))
+    report = _make_report(str(tmp_path / "a.xlsx"), '<worksheet>A</worksheet>')
+    assert archive.add(report) == archive.add(report)
+    assert archive.stats()['reports'] == 1
+
+
+def test_shared_parts_are_refcounted(tmp_path):
+    archive = ReportArchive(str(tmp_path / "archive"))
+    first = archive.add(_make_report(str(tmp_path / "a.xlsx"), '<worksheet>A</worksheet>'))
+    second_path = _make_report(str(tmp_path / "b.xlsx"), '<worksheet>B</worksheet>')
+    second = archive.add(second_path)
+
+    media = _blob(archive, first, 'xl/media/image1.png')
+    assert media == _blob(archive, second, 'xl/media/image1.png')
+    assert _refs(archive, media) == 2
+    assert _refs(archive, _blob(archive, first, 'xl/styles.xml')) == 2
+    # 共用的样式和图片各存一份，两份工作表各一份
+    assert len(_object_files(archive)) == 4
+
+    only_first = _blob(archive, first, 'xl/worksheets/sheet1.xml')
+    assert archive.remove(first)
+    assert _refs(archive, media) == 1
+    assert _refs(archive, only_first) == 0
+    assert not os.path.exists(archive._object_path(only_first))
+    assert os.path.exists(archive._object_path(media))
+
+    out = str(tmp_path / "restored.xlsx")
+    assert archive.rebuild(second, out)
+    with open(second_path, 'rb') as a, open(out, 'rb') as b:
+        assert a.read() == b.read()
+
+    assert archive.remove(second)
+    assert _object_files(archive) == []
+    assert archive.stats() == {'reports': 0, 'logical_bytes': 0, 'stored_bytes': 0, 'objects': 0}
+    assert not archive.remove(second)
+
+
+def test_rebuild_unknown_id_fails(tmp_path):
+    archive = ReportArchive(str(tmp_path / "archive"))
+    assert not archive.rebuild(42, str(tmp_path / "out.xlsx"))
@@ -0,0 +1,57 @@
+import zipfile
+from io import BytesIO
+
+import openpyxl
+from openpyxl.drawing.image import Image as ExcelImage
+from PIL import Image
+
+from xlsx_package import dedupe_media, save_workbook_parallel
+
+PHOTO = b'\x89PNG same photo'
+OTHER = b'\x89PNG other photo'
+
+
+def _rels(*targets):
+    body = ''.join(f'<Relationship Id="rId{i}" Type="image" Target="{t}"/>' for i, t in enumerate(targets, 1))
+    return f'<Relationships>{body}</Relationships>'.encode('utf-8')
+
+
+def test_dedupe_media_retargets_rels_across_drawings():
+    parts = {
+        'xl/media/image1.png': PHOTO,
+        'xl/media/image2.png': PHOTO,
+        'xl/media/image3.png': PHOTO,
+        'xl/media/image4.png': OTHER,
+        'xl/drawings/_rels/drawing1.xml.rels': _rels('../media/image1.png', '../media/image2.png'),
+        'xl/drawings/_rels/drawing2.xml.rels': _rels('/xl/media/image3.png', '../media/image4.png'),
+        'xl/worksheets/_rels/sheet1.xml.rels': _rels('../drawings/drawing1.xml'),
+    }
+    assert dedupe_media(parts) == 2
+    assert sorted(n for n in parts if n.startswith('xl/media/')) == ['xl/media/image1.png', 'xl/media/image4.png']
+    assert parts['xl/drawings/_rels/drawing1.xml.rels'] == _rels('../media/image1.png', '../media/image1.png')
+    assert parts['xl/drawings/_rels/drawing2.xml.rels'] == _rels('/xl/media/image1.png', '../media/image4.png')
+    assert parts['xl/worksheets/_rels/sheet1.xml.rels'] == _rels('../drawings/drawing1.xml')
+
+
+def test_dedupe_media_keeps_different_extensions():
+    parts = {'xl/media/image1.png': PHOTO, 'xl/media/image2.jpeg': PHOTO}
+    assert dedupe_media(parts) == 0
+    assert len(parts) == 2
+
+
+def test_parallel_save_stores_shared_photo_once(tmp_path):
+    photo = BytesIO()
+    Image.new('RGB', (40, 30), 'red').save(photo, format='PNG')
+    wb = openpyxl.Workbook()
+    sheets = [wb.active, wb.create_sheet('PO2')]
+    for ws in sheets:
+        for anchor in ('B2', 'F2'):
+            ws.add_image(ExcelImage(BytesIO(photo.getvalue())), anchor)
+    path = str(tmp_path / "report.xlsx")
+    save_workbook_parallel(wb, path, level=6, workers=2)
+
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        assert [n for n in zf.namelist() if n.startswith('xl/media/')] == ['xl/media/image1.png']
+    reopened = openpyxl.load_workbook(path)
+    assert [len(ws._images) for ws in reopened.worksheets] == [2, 2]
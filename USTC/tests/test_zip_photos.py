@@ -0,0 +1,85 @@
+import zipfile
+
+import pytest
+
+import zip_photos
+
+STORED = b'\xff\xd8 stored jpeg' * 40
+DEFLATED = b'deflated member ' * 200
+
+
+def _make_archive(path):
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('step1/a.jpg', STORED, compress_type=zipfile.ZIP_STORED)
+        zf.writestr('step1/b.jpg', DEFLATED, compress_type=zipfile.ZIP_DEFLATED)
+    return path
+
+
+def _make_legacy_archive(path, name, encoding, data=STORED):
+    """模拟 Windows 自带压缩工具：文件名按本地编码保存，不设 UTF-8 标记"""
+    raw = name.encode(encoding)
+    placeholder = b'Q' * len(raw)
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr(placeholder.decode('ascii'), data, compress_type=zipfile.ZIP_STORED)
+    with open(path, 'rb') as f:
+        payload = f.read()
+    assert payload.count(placeholder) == 2  # 本地文件头和中央目录各一处
+    with open(path, 'wb') as f:
+        f.write(payload.replace(placeholder, raw))
+    return path
+
+
+def test_read_stored_and_deflated_members(tmp_path):
+    archive = _make_archive(str(tmp_path / "photos.zip"))
+    assert zip_photos.read_bytes(zip_photos.member_ref(archive, 'step1/a.jpg')) == STORED
+    assert zip_photos.read_bytes(zip_photos.member_ref(archive, 'step1/b.jpg')) == DEFLATED
+    assert zip_photos.open_file(zip_photos.member_ref(archive, 'step1/b.jpg')).read() == DEFLATED
+    assert zip_photos.list_images(archive, ('.jpg',)) == ['step1/a.jpg', 'step1/b.jpg']
+
+
+def test_missing_member(tmp_path):
+    archive = _make_archive(str(tmp_path / "photos.zip"))
+    ref = zip_photos.member_ref(archive, 'step1/c.jpg')
+    assert not zip_photos.exists(ref)
+    with pytest.raises(FileNotFoundError):
+        zip_photos.read_bytes(ref)
+
+
+def test_corrupt_member_is_rejected(tmp_path):
+    archive = _make_archive(str(tmp_path / "photos.zip"))
+    with open(archive, 'rb') as f:
+        payload = f.read()
+    with open(archive, 'wb') as f:
+        f.write(payload.replace(b'stored jpeg', b'STORED JPEG', 1))
+    with pytest.raises(zipfile.BadZipFile):
+        zip_photos.read_bytes(zip_photos.member_ref(archive, 'step1/a.jpg'))
+
+
+def test_gbk_name_without_utf8_flag(tmp_path):
+    name = '步骤1/(缺陷)划痕.jpg'
+    archive = _make_legacy_archive(str(tmp_path / "gbk.zip"), name, 'gbk')
+    with zipfile.ZipFile(archive) as zf:
+        info = zf.infolist()[0]
+    assert not info.flag_bits & 0x800
+    assert zip_photos._display_name(info) == name
+    assert zip_photos.list_images(archive, ('.jpg',)) == [name]
+    ref = zip_photos.member_ref(archive, name)
+    assert zip_photos.exists(ref)
+    assert zip_photos.read_bytes(ref) == STORED
+    assert zip_photos.location(ref) == (archive, name)
+
+
+def test_utf8_name_without_flag(tmp_path):
+    name = '照片/出货.jpg'
+    archive = _make_legacy_archive(str(tmp_path / "utf8.zip"), name, 'utf-8')
+    with zipfile.ZipFile(archive) as zf:
+        assert zip_photos._display_name(zf.infolist()[0]) == name
+
+
+def test_plain_paths_pass_through(tmp_path):
+    path = tmp_path / "a.jpg"
+    path.write_bytes(STORED)
+    assert not zip_photos.is_member(str(path))
+    assert zip_photos.read_bytes(str(path)) == STORED
+    assert zip_photos.open_file(str(path)) == str(path)
+    assert zip_photos.location(str(path)) == (str(tmp_path), "a.jpg")
@@ -0,0 +1,367 @@
+"""
+报告文件（.xlsx）保存后优化
+- 合并重复的 cellXfs / fonts / fills / borders，并删除未使用的样式
+- 删除已用区域之外、仅为携带样式而存在的空单元格
+- 合并内容相同的图片（同一张照片插入多处时只保留一份）
+- 按指定压缩级别重新压缩各部件（jpeg/png 等已压缩的图片直接存储）
+- 输出优化前后的文件大小和 Excel 打开耗时估算
+
+命令行用法：python xlsx_optimizer.py 报告.xlsx [更多报告.xlsx ...] [-o 输出.xlsx] [--level 9]
+"""
+
+import argparse
+import os
+import re
+import tempfile
+import zipfile
+import zlib
+import xml.etree.ElementTree as ET
+
+import config
+from xlsx_package import STORED_EXTENSIONS, XML_NAMESPACES, dedupe_media, xml_bytes
+
+
+NS_MAIN = XML_NAMESPACES['']
+
+_CELL_RE = re.compile(rb'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+_ROW_RE = re.compile(rb'<row\b([^>]*?)(?:/>|>(.*?)</row>)', re.S)
+_ATTR_RE = re.compile(rb'(\w+)="([^"]*)"')
+_MERGE_RE = re.compile(rb'<mergeCell ref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"')
+_COL_STYLE_RE = re.compile(rb'(<col\b[^>]*?\bstyle=")(\d+)(")')
+_ROW_STYLE_RE = re.compile(rb'(<row\b[^>]*?\bs=")(\d+)(")')
+_CELL_STYLE_RE = re.compile(rb'(<c\b[^>]*?\bs=")(\d+)(")')
+_REF_RE = re.compile(rb'([A-Z]+)(\d+)')
+_ANCHOR_RE = re.compile(rb'<(?:\w+:)?(?:oneCellAnchor|twoCellAnchor|absoluteAnchor)\b')
+
+
+def _q(tag):
+    return f'{{{NS_MAIN}}}{tag}'
+
+
+def _col_index(letters):
+    n = 0
+    for ch in letters:
+        n = n * 26 + ch - 64
+    return n
+
+
+def _canonical(elem):
+    return ET.tostring(elem)
+
+
+def _is_worksheet(name):
+    return name.startswith('xl/worksheets/') and name.endswith('.xml') and '/_rels/' not in name
+
+
+def _restore_ignorable_ns(original, serialized):
+    """ElementTree 会丢弃未直接使用的命名空间声明，mc:Ignorable 引用的前缀需补回"""
+    m = re.search(rb'Ignorable="([^"]*)"', original)
+    if not m:
+        return serialized
+    for prefix in m.group(1).split():
+        decl = re.search(rb'xmlns:' + re.escape(prefix) + rb'="[^"]*"', original)
+        if decl and decl.group(0) not in serialized:
+            serialized = re.sub(rb'(<\w+(?::\w+)?\b)', lambda x: x.group(1) + b' ' + decl.group(0), serialized, count=1)
+    return serialized
+
+
+# ---------------- 样式表 ----------------
+
+def _dedupe_children(parent, keep_first=1):
+    """合并重复子元素，返回 旧索引 -> 新索引 的映射（前 keep_first 个保持原位）"""
+    seen, mapping, kept = {}, [], []
+    for i, child in enumerate(list(parent)):
+        key = _canonical(child)
+        if key in seen and i >= keep_first:
+            mapping.append(seen[key])
+        else:
+            seen.setdefault(key, len(kept))
+            mapping.append(len(kept))
+            kept.append(child)
+    for child in list(parent):
+        parent.remove(child)
+    parent.extend(kept)
+    if 'count' in parent.attrib:
+        parent.set('count', str(len(kept)))
+    return mapping
+
+
+def _compact_children(parent, used, keep_first=1):
+    """删除未被引用的子元素，返回 旧索引 -> 新索引 的映射"""
+    mapping, kept = {}, []
+    for i, child in enumerate(list(parent)):
+        if i < keep_first or i in used:
+            mapping[i] = len(kept)
+            kept.append(child)
+    for child in list(parent):
+        parent.remove(child)
+    parent.extend(kept)
+    if 'count' in parent.attrib:
+        parent.set('count', str(len(kept)))
+    return mapping
+
+
+def _remap_xf_attrs(xf_parent, attr, mapping):
+    if xf_parent is None:
+        return
+    for xf in xf_parent:
+        if attr in xf.attrib:
+            xf.set(attr, str(mapping[int(xf.get(attr))]))
+
+
+def _optimize_styles(styles_xml, used_xfs):
+    """
+    合并重复样式并删除未使用样式
+    used_xfs: 各工作表实际引用的 cellXfs 索引集合
+    返回 (新的styles.xml, 旧xf索引->新xf索引, 统计)
+    """
+    root = ET.fromstring(styles_xml)
+    cell_xfs = root.find(_q('cellXfs'))
+    style_xfs = root.find(_q('cellStyleXfs'))
+    stats = {'xfs_before': len(cell_xfs) if cell_xfs is not None else 0}
+
+    # 1. 合并重复的 fonts / fills / borders，并修正 xf 中的引用
+    for tag, attr, keep in (('fonts', 'fontId', 1), ('fills', 'fillId', 2), ('borders', 'borderId', 1)):
+        parent = root.find(_q(tag))
+        if parent is None:
+            continue
+        stats[f'{tag}_before'] = len(parent)
+        mapping = _dedupe_children(parent, keep)
+        _remap_xf_attrs(cell_xfs, attr, mapping)
+        _remap_xf_attrs(style_xfs, attr, mapping)
+
+    if cell_xfs is None:
+        return styles_xml, {}, stats
+
+    # 2. 合并重复的 cellXfs，并删除未被任何单元格/行/列引用的 xf
+    dedupe = _dedupe_children(cell_xfs, 1)
+    used = {dedupe[i] for i in used_xfs if i < len(dedupe)}
+    compact = _compact_children(cell_xfs, used, 1)
+    xf_map = {old: compact[new] for old, new in enumerate(dedupe) if new in compact}
+    stats['xfs_after'] = len(cell_xfs)
+
+    # 3. 删除未被任何 xf 引用的 fonts / fills / borders
+    for tag, attr, keep in (('fonts', 'fontId', 1), ('fills', 'fillId', 2), ('borders', 'borderId', 1)):
+        parent = root.find(_q(tag))
+        if parent is None:
+            continue
+        used_ids = {int(xf.get(attr)) for xfs in (cell_xfs, style_xfs) if xfs is not None
+                    for xf in xfs if attr in xf.attrib}
+        mapping = _compact_children(parent, used_ids, keep)
+        _remap_xf_attrs(cell_xfs, attr, mapping)
+        _remap_xf_attrs(style_xfs, attr, mapping)
+        stats[f'{tag}_after'] = len(parent)
+
+    out = xml_bytes(root)
+    return _restore_ignorable_ns(styles_xml, out), xf_map, stats
+
+
+def _visible_xfs(styles_xml):
+    """空单元格上仍然可见的样式（有边框或填充）"""
+    root = ET.fromstring(styles_xml)
+    cell_xfs = root.find(_q('cellXfs'))
+    visible = set()
+    if cell_xfs is None:
+        return visible
+    for i, xf in enumerate(cell_xfs):
+        if int(xf.get('borderId', 0)) > 0 or int(xf.get('fillId', 0)) > 0:
+            visible.add(i)
+    return visible
+
+
+# ---------------- 工作表 ----------------
+
+def _used_xfs(sheet_xml):
+    used = set()
+    for regex in (_CELL_STYLE_RE, _ROW_STYLE_RE, _COL_STYLE_RE):
+        used.update(int(m.group(2)) for m in regex.finditer(sheet_xml))
+    return used
+
+
+def _drop_empty_styled_cells(sheet_xml, visible_xfs):
+    """
+    删除已用区域之外的空样式单元格
+    已用区域 = 有值单元格、合并区域、带边框/填充单元格的外接矩形
+    """
+    min_r = min_c = None
+    max_r = max_c = 0
+
+    def extend(r, c):
+        nonlocal min_r, min_c, max_r, max_c
+        min_r = r if min_r is None else min(min_r, r)
+        min_c = c if min_c is None else min(min_c, c)
+        max_r, max_c = max(max_r, r), max(max_c, c)
+
+    cells = []
+    for m in _CELL_RE.finditer(sheet_xml):
+        attrs = dict(_ATTR_RE.findall(m.group(1)))
+        ref = _REF_RE.match(attrs.get(b'r', b''))
+        if not ref:
+            continue
+        r, c = int(ref.group(2)), _col_index(ref.group(1))
+        inner = m.group(2) or b''
+        has_value = b'<v' in inner or b'<f' in inner or b'<is' in inner
+        style = int(attrs.get(b's', 0))
+        if has_value or style in visible_xfs:
+            extend(r, c)
+        cells.append((m.start(), m.end(), r, c, has_value, b's' in attrs))
+    for m in _MERGE_RE.finditer(sheet_xml):
+        extend(int(m.group(2)), _col_index(m.group(1)))
+        if m.group(3):
+            extend(int(m.group(4)), _col_index(m.group(3)))
+
+    if min_r is None:
+        return sheet_xml, 0
+
+    out, pos, dropped = [], 0, 0
+    for start, end, r, c, has_value, styled in cells:
+        outside = r < min_r or r > max_r or c < min_c or c > max_c
+        if styled and not has_value and outside:
+            out.append(sheet_xml[pos:start])
+            pos = end
+            dropped += 1
+    out.append(sheet_xml[pos:])
+    result = b''.join(out)
+
+    # 删除因此变空、且没有自定义行属性的行
+    def drop_row(m):
+        if m.group(2) is not None and m.group(2).strip():
+            return m.group(0)
+        attrs = dict(_ATTR_RE.findall(m.group(1)))
+        if any(k in attrs for k in (b'ht', b'customHeight', b'hidden', b's', b'outlineLevel')):
+            return m.group(0)
+        return b''
+    result = _ROW_RE.sub(drop_row, result)
+    return result, dropped
+
+
+def _remap_sheet_styles(sheet_xml, xf_map):
+    def sub(m):
+        return m.group(1) + str(xf_map.get(int(m.group(2)), 0)).encode() + m.group(3)
+    for regex in (_CELL_STYLE_RE, _ROW_STYLE_RE, _COL_STYLE_RE):
+        sheet_xml = regex.sub(sub, sheet_xml)
+    return sheet_xml
+
+
+# ---------------- 打开耗时估算 ----------------
+
+def estimate_open_seconds(parts):
+    """
+    粗略估算 Excel 打开耗时（秒），仅用于比较优化前后：
+    与单元格数、样式数、图片锚点数、解压后数据量近似线性相关
+    """
+    cells = xfs = anchors = 0
+    raw = 0
+    for name, data in parts.items():
+        raw += len(data)
+        if _is_worksheet(name):
+            cells += data.count(b'<c ')
+        elif name == 'xl/styles.xml':
+            m = re.search(rb'<cellXfs[^>]*count="(\d+)"', data)
+            xfs = int(m.group(1)) if m else 0
+        elif name.startswith('xl/drawings/') and name.endswith('.xml'):
+            anchors += len(_ANCHOR_RE.findall(data))
+    return 0.3 + cells * 2e-6 + xfs * 5e-5 + anchors * 4e-3 + raw / (1024 * 1024) * 0.02
+
+
+# ---------------- 入口 ----------------
+
+def _deflate_helps(data, level, sample=256 * 1024):
+    """抽样判断 deflate 能否明显减小体积（真实照片通常不能，纯色截图等可以）"""
+    head = data[:sample]
+    return len(zlib.compress(head, level)) < len(head) * 0.95
+
+
+def _write_package(infos, parts, path, level):
+    with zipfile.ZipFile(path, 'w', allowZip64=True) as zf:
+        for info in infos:
+            data = parts[info.filename]
+            new_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+            new_info.external_attr = info.external_attr
+            if info.filename.lower().endswith(STORED_EXTENSIONS) and not _deflate_helps(data, level):
+                new_info.compress_type = zipfile.ZIP_STORED
+                zf.writestr(new_info, data)
+            else:
+                new_info.compress_type = zipfile.ZIP_DEFLATED
+                zf.writestr(new_info, data, compress_type=zipfile.ZIP_DEFLATED, compresslevel=level)
+
+
+def optimize_package(src_path, dst_path=None, level=None):
+    """
+    优化 .xlsx 文件；dst_path 为空时原地覆盖
+    返回统计信息 dict
+    """
+    level = config.OPTIMIZER_CONFIG["deflate_level"] if level is None else level
+    dst_path = dst_path or src_path
+    size_before = os.path.getsize(src_path)
+
+    with zipfile.ZipFile(src_path) as zf:
+        infos = zf.infolist()
+        parts = {info.filename: zf.read(info) for info in infos}
+    est_before = estimate_open_seconds(parts)
+    stats = {'size_before': size_before, 'cells_dropped': 0}
+
+    stats['media_dropped'] = dedupe_media(parts)
+    infos = [info for info in infos if info.filename in parts]
+
+    styles_name = 'xl/styles.xml'
+    sheets = [name for name in parts if _is_worksheet(name)]
+    if styles_name in parts:
+        visible = _visible_xfs(parts[styles_name])
+        for name in sheets:
+            parts[name], dropped = _drop_empty_styled_cells(parts[name], visible)
+            stats['cells_dropped'] += dropped
+
+        used = {0}
+        for name in sheets:
+            used |= _used_xfs(parts[name])
+        parts[styles_name], xf_map, style_stats = _optimize_styles(parts[styles_name], used)
+        stats.update(style_stats)
+        for name in sheets:
+            parts[name] = _remap_sheet_styles(parts[name], xf_map)
+
+    # 先写入临时文件，成功后再替换，避免中途失败损坏报告
+    fd, tmp_path = tempfile.mkstemp(suffix='.xlsx', dir=os.path.dirname(os.path.abspath(dst_path)))
+    os.close(fd)
+    try:
+        _write_package(infos, parts, tmp_path, level)
+        os.replace(tmp_path, dst_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    stats['size_after'] = os.path.getsize(dst_path)
+    stats['open_seconds_before'] = round(est_before, 2)
+    stats['open_seconds_after'] = round(estimate_open_seconds(parts), 2)
+    return stats
+
+
+def format_stats(stats):
+    return (f"大小 {stats['size_before'] / 1024:.0f}KB → {stats['size_after'] / 1024:.0f}KB，"
+            f"样式 {stats.get('xfs_before', '-')} → {stats.get('xfs_after', '-')}，"
+            f"删除空单元格 {stats['cells_dropped']} 个，"
+            f"合并重复图片 {stats.get('media_dropped', 0)} 张，"
+            f"预计打开耗时 {stats['open_seconds_before']}s → {stats['open_seconds_after']}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="优化已生成的报告文件")
+    parser.add_argument('files', nargs='+', help="要优化的 .xlsx 文件")
+    parser.add_argument('-o', '--output', help="输出文件（仅处理单个文件时可用，默认原地覆盖）")
+    parser.add_argument('--level', type=int, default=config.OPTIMIZER_CONFIG["deflate_level"],
+                        help="deflate 压缩级别 0-9")
+    args = parser.parse_args()
+    if args.output and len(args.files) > 1:
+        parser.error("多个文件时不能指定 -o")
+
+    for path in args.files:
+        try:
+            stats = optimize_package(path, args.output, args.level)
+            print(f"✓ {os.path.basename(path)}: {format_stats(stats)}")
+        except Exception as e:
+            print(f"✗ 优化失败 {path}: {e}")
+
+
+if __name__ == "__main__":
+    main()
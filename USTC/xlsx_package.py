@@ -0,0 +1,256 @@
+"""
+xlsx 包（zip）底层读写
+- 按原始压缩数据读取部件，未修改的部件可原样写回（不解压、不重新压缩）
+- 由已压缩好的部件组装 zip 包
+- 多线程压缩保存工作簿（zlib 压缩时释放 GIL，各部件可并行压缩）
+- 合并内容相同的图片部件（多处插入同一张照片时包内只保存一份）
+- 修改后的部件 XML 按原命名空间前缀序列化
+
+生成的包为标准 zip 格式（不支持超过 4GB 的 zip64 包，报告远小于此）
+"""
+
+import datetime
+import hashlib
+import os
+import posixpath
+import re
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from openpyxl.writer.excel import ExcelWriter
+
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END_RECORD = struct.Struct('<IHHHHIIH')
+_LIMIT = 0xFFFFFFFF
+
+# 部件中常见的命名空间前缀。mc:Ignorable 等属性按前缀名引用命名空间，序列化时前缀不能改成 ns0
+XML_NAMESPACES = {
+    '': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+    'mc': 'http://schemas.openxmlformats.org/markup-compatibility/2006',
+    'x14ac': 'http://schemas.microsoft.com/office/spreadsheetml/2009/9/ac',
+    'x16r2': 'http://schemas.microsoft.com/office/spreadsheetml/2015/02/main',
+    'xr': 'http://schemas.microsoft.com/office/spreadsheetml/2014/revision',
+}
+_namespaces_registered = False
+
+
+class PackagePart:
+    """
+    包内的一个部件
+    raw 为压缩后的数据（method=ZIP_STORED 时即原始数据），crc/size 为原始数据的校验和与长度
+    """
+
+    __slots__ = ('name', 'method', 'raw', 'crc', 'size', 'date_time', 'external_attr')
+
+    def __init__(self, name, method, raw, crc, size, date_time=None, external_attr=0):
+        self.name = name
+        self.method = method
+        self.raw = raw
+        self.crc = crc
+        self.size = size
+        self.date_time = date_time or time.localtime()[:6]
+        self.external_attr = external_attr
+
+    @classmethod
+    def from_data(cls, name, data, level=6, store=False, date_time=None):
+        """由原始数据创建部件（store=True 时不压缩）"""
+        crc = zlib.crc32(data)
+        if store:
+            return cls(name, zipfile.ZIP_STORED, data, crc, len(data), date_time)
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        raw = compressor.compress(data) + compressor.flush()
+        return cls(name, zipfile.ZIP_DEFLATED, raw, crc, len(data), date_time)
+
+    def data(self):
+        """解压得到原始数据"""
+        if self.method == zipfile.ZIP_STORED:
+            return self.raw
+        return zlib.decompress(self.raw, -15)
+
+
+def xml_bytes(root):
+    """
+    序列化修改后的部件 XML（带 UTF-8 声明），沿用 XML_NAMESPACES 中的前缀
+    前缀在第一次序列化时向 ElementTree 注册一次，导入本模块不改变 ElementTree 的全局状态
+    """
+    global _namespaces_registered
+    if not _namespaces_registered:
+        for prefix, uri in XML_NAMESPACES.items():
+            ET.register_namespace(prefix, uri)
+        _namespaces_registered = True
+    return ET.tostring(root, xml_declaration=True, encoding='UTF-8')
+
+
+def read_parts(path):
+    """按原始压缩数据读取包内所有部件（保持原顺序）；path 也可以是已打开的二进制文件对象"""
+    if hasattr(path, 'read'):
+        return _read_parts(path, path)
+    with open(path, 'rb') as f:
+        return _read_parts(path, f)
+
+
+def _read_parts(path, f):
+    parts = []
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                raise ValueError(f"不支持的压缩方式: {info.filename}")
+            f.seek(info.header_offset)
+            header = f.read(_LOCAL_HEADER.size)
+            name_len, extra_len = struct.unpack('<HH', header[26:30])
+            f.seek(info.header_offset + _LOCAL_HEADER.size + name_len + extra_len)
+            raw = f.read(info.compress_size)
+            parts.append(PackagePart(info.filename, info.compress_type, raw, info.CRC,
+                                     info.file_size, info.date_time, info.external_attr))
+    return parts
+
+
+def _dos_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    year = max(year, 1980)
+    return ((hour << 11) | (minute << 5) | (second // 2),
+            ((year - 1980) << 9) | (month << 5) | day)
+
+
+def write_parts(path_or_file, parts):
+    """把部件按给定顺序组装成 zip 包"""
+    own = isinstance(path_or_file, (str, bytes)) or hasattr(path_or_file, '__fspath__')
+    f = open(path_or_file, 'wb') if own else path_or_file
+    try:
+        central = []
+        offset = 0
+        for part in parts:
+            name = part.name.encode('utf-8')
+            flags = 0x800 if not part.name.isascii() else 0
+            dos_time, dos_date = _dos_time(part.date_time)
+            if offset > _LIMIT or len(part.raw) > _LIMIT or part.size > _LIMIT:
+                raise ValueError("包大小超过 4GB，不支持")
+            header = _LOCAL_HEADER.pack(0x04034b50, 20, flags, part.method, dos_time, dos_date,
+                                        part.crc, len(part.raw), part.size, len(name), 0)
+            f.write(header)
+            f.write(name)
+            f.write(part.raw)
+            central.append(_CENTRAL_HEADER.pack(
+                0x02014b50, 20, 20, flags, part.method, dos_time, dos_date,
+                part.crc, len(part.raw), part.size, len(name), 0, 0, 0, 0,
+                part.external_attr, offset) + name)
+            offset += len(header) + len(name) + len(part.raw)
+
+        cd_size = sum(len(c) for c in central)
+        if offset > _LIMIT or len(parts) > 0xFFFF:
+            raise ValueError("包大小超过 4GB，不支持")
+        for entry in central:
+            f.write(entry)
+        f.write(_END_RECORD.pack(0x06054b50, 0, 0, len(parts), len(parts), cd_size, offset, 0))
+    finally:
+        if own:
+            f.close()
+
+
+_TARGET_RE = re.compile(rb'(Target=")([^"]+)(")')
+
+
+def _resolve_target(rels_name, target):
+    """关系文件中的 Target 解析为包内部件名"""
+    if target.startswith('/'):
+        return target[1:]
+    # xl/drawings/_rels/drawing1.xml.rels 中的相对路径以 xl/drawings 为基准
+    base = posixpath.dirname(posixpath.dirname(rels_name))
+    return posixpath.normpath(posixpath.join(base, target))
+
+
+def dedupe_media(parts):
+    """
+    合并内容相同的 xl/media 部件：关系文件改为指向第一份，删除其余副本
+    parts 为 {部件名: 原始数据}（按包内顺序），原地修改，返回删除的部件数
+    """
+    first = {}
+    alias = {}
+    for name, data in parts.items():
+        if not name.startswith('xl/media/'):
+            continue
+        key = (posixpath.splitext(name)[1].lower(), len(data), hashlib.sha256(data).digest())
+        if key in first:
+            alias[name] = first[key]
+        else:
+            first[key] = name
+    if not alias:
+        return 0
+
+    for name, data in parts.items():
+        if not name.endswith('.rels') or b'media/' not in data:
+            continue
+
+        def retarget(m, rels_name=name):
+            target = m.group(2).decode('utf-8')
+            canonical = alias.get(_resolve_target(rels_name, target))
+            if canonical is None:
+                return m.group(0)
+            new_target = posixpath.join(posixpath.dirname(target), posixpath.basename(canonical))
+            return m.group(1) + new_target.encode('utf-8') + m.group(3)
+
+        parts[name] = _TARGET_RE.sub(retarget, data)
+    for name in alias:
+        del parts[name]
+    return len(alias)
+
+
+# 本身已压缩的媒体格式，再做 deflate 几乎不变小，直接存储
+STORED_EXTENSIONS = ('.jpeg', '.jpg', '.png', '.gif', '.emf', '.wmf')
+
+
+def save_workbook_parallel(wb, path, level=6, workers=4, dedupe=True):
+    """
+    多线程压缩保存工作簿
+    先由 openpyxl 按原有逻辑生成不压缩的包，再把各部件并行压缩（已压缩的媒体直接存储），
+    最后按原顺序组装；写临时文件后替换，保存失败不会留下半个文件
+    dedupe=True 时同一张照片插入多处只保存一份
+    """
+    if wb.read_only:
+        raise TypeError("只读工作簿不能保存")
+    if wb.write_only and not wb.worksheets:
+        wb.create_sheet()
+
+    buf = BytesIO()
+    archive = zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED, allowZip64=True)
+    wb.properties.modified = datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+    ExcelWriter(wb, archive).save()
+
+    stored = read_parts(buf)
+    if dedupe:
+        contents = {part.name: part.raw for part in stored}  # 未压缩包中 raw 即原始数据
+        if dedupe_media(contents):
+            stored = [part for part in stored if part.name in contents]
+            for part in stored:
+                part.raw = contents[part.name]
+
+    def compress(part):
+        data = part.raw  # 未压缩包中 raw 即原始数据
+        store = part.name.lower().endswith(STORED_EXTENSIONS)
+        return PackagePart.from_data(part.name, data, level, store=store, date_time=part.date_time)
+
+    # 大部件先提交，减少最后只剩一个线程在压缩的时间
+    order = sorted(range(len(stored)), key=lambda i: -stored[i].size)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        done = dict(zip(order, pool.map(compress, (stored[i] for i in order))))
+    parts = [done[i] for i in range(len(stored))]
+
+    fd, tmp = tempfile.mkstemp(suffix='.xlsx', dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+        write_parts(tmp, parts)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return True
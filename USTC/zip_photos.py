@@ -0,0 +1,181 @@
+"""
+压缩包图片源
+检验平板和照片上传工具交来的 .zip 不必先解压：压缩包内的图片用 "压缩包路径!/成员名" 表示，
+扫描只读压缩包的中央目录；缩略图、预检、插入报告时按成员直接从压缩包读入内存（不落盘），
+只读取实际用到的成员；JPEG/PNG 成员原样嵌入报告，不重新编码
+成员名按解码后的显示名引用：Windows 中文系统自带压缩工具按 GBK 保存文件名且不设 UTF-8 标记，
+zipfile 会按 cp437 解出乱码，这里还原为正确的中文名（读取时仍按 ZipInfo 中的原始名称定位）
+普通文件路径原样处理，调用方不必区分两种来源
+"""
+
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from collections import OrderedDict
+from io import BytesIO
+
+
+SEP = "!/"
+_REF_RE = re.compile(r'^(.+?\.zip)!/(.+)$', re.IGNORECASE)
+_LOCAL_HEADER = struct.Struct('<4s5H3L2H')  # 成员本地文件头（30 字节）
+_LOCAL_SIGNATURE = b'PK\x03\x04'
+_UTF8_FLAG = 0x800  # 通用标志位：文件名为 UTF-8
+_MAX_INDEXES = 8
+
+_lock = threading.Lock()
+_indexes = OrderedDict()  # (压缩包绝对路径, 修改时间, 大小) -> {显示名: ZipInfo}
+
+
+def is_archive(path):
+    return path.lower().endswith('.zip') and os.path.isfile(path)
+
+
+def is_member(path):
+    return isinstance(path, str) and _REF_RE.match(path) is not None
+
+
+def member_ref(archive, name):
+    return f"{archive}{SEP}{name}"
+
+
+def split_ref(path):
+    """'a.zip!/x/1.jpg' -> ('a.zip', 'x/1.jpg')"""
+    m = _REF_RE.match(path)
+    return m.group(1), m.group(2)
+
+
+def location(path):
+    """(所在文件夹或压缩包, 文件名或成员名)，用于按来源记录图片标记"""
+    if is_member(path):
+        return split_ref(path)
+    return os.path.dirname(path), os.path.basename(path)
+
+
+def _display_name(info):
+    """未设 UTF-8 标记的成员名按原始字节重新解码（UTF-8 优先，其次 GBK），都不成立时保持原样"""
+    if info.flag_bits & _UTF8_FLAG:
+        return info.filename
+    try:
+        raw = info.filename.encode('cp437')
+    except UnicodeEncodeError:
+        return info.filename
+    for encoding in ('utf-8', 'gbk'):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return info.filename
+
+
+def _index(archive):
+    """压缩包的成员目录（按压缩包版本缓存，同一压缩包的中央目录只解析一次）"""
+    st = os.stat(archive)
+    key = (os.path.abspath(archive), st.st_mtime_ns, st.st_size)
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    with zipfile.ZipFile(archive) as zf:
+        index = {}
+        for info in zf.infolist():
+            if not info.is_dir():
+                index.setdefault(_display_name(info), info)
+    with _lock:
+        _indexes[key] = index
+        while len(_indexes) > _MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def _info(path):
+    archive, name = split_ref(path)
+    info = _index(archive).get(name)
+    if info is None:
+        raise FileNotFoundError(f"压缩包中没有 {name}: {archive}")
+    return archive, info
+
+
+def list_images(archive, extensions):
+    """压缩包内的图片成员显示名（只读中央目录，不读取图片数据；跳过 macOS 附带的 __MACOSX 目录）"""
+    return [name for name in _index(archive)
+            if os.path.splitext(name)[1].lower() in extensions and not name.startswith('__MACOSX/')]
+
+
+def exists(path):
+    if not is_member(path):
+        return os.path.isfile(path)
+    try:
+        _info(path)
+        return True
+    except (OSError, zipfile.BadZipFile):
+        return False
+
+
+def read_bytes(path):
+    """
+    读取图片字节；压缩包成员按中央目录记录的位置直接读取（不再逐个打开压缩包解析目录），
+    未压缩存放的成员原样返回，deflate 成员解压后返回，均校验 CRC
+    """
+    if not is_member(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    archive, info = _info(path)
+    if info.flag_bits & 0x1 or info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        # 加密或其他压缩算法交给 zipfile 处理
+        with zipfile.ZipFile(archive) as zf:
+            return zf.read(info)
+    with open(archive, 'rb') as f:
+        f.seek(info.header_offset)
+        header = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+        if header[0] != _LOCAL_SIGNATURE:
+            raise zipfile.BadZipFile(f"压缩包成员头无效: {path}")
+        f.seek(header[-2] + header[-1], os.SEEK_CUR)  # 跳过文件名和扩展字段
+        data = f.read(info.compress_size)
+    if info.compress_type == zipfile.ZIP_DEFLATED:
+        data = zlib.decompress(data, -15)
+    if len(data) != info.file_size or zlib.crc32(data) != info.CRC:
+        raise zipfile.BadZipFile(f"压缩包成员损坏: {path}")
+    return data
+
+
+def open_file(path):
+    """可交给 Image.open / ExcelImage 的来源：普通文件返回路径，压缩包成员返回内存文件"""
+    if is_member(path):
+        return BytesIO(read_bytes(path))
+    return path
+
+
+def file_key(path):
+    """(路径, 修改时间, 大小) 形式的版本标识，压缩包成员附加成员名"""
+    if is_member(path):
+        archive, name = split_ref(path)
+        st = os.stat(archive)
+        return os.path.abspath(archive), st.st_mtime_ns, st.st_size, name
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_mtime_ns, st.st_size
+
+
+def size_mtime(path):
+    """(大小, 修改时间秒)；压缩包成员取压缩包内记录的原始大小和时间"""
+    if is_member(path):
+        _, info = _info(path)
+        return info.file_size, time.mktime(info.date_time + (0, 0, -1))
+    st = os.stat(path)
+    return st.st_size, st.st_mtime
+
+
+def copy(path, target):
+    """复制图片到 target 并保留修改时间（压缩包成员只读出这一个成员）"""
+    if not is_member(path):
+        shutil.copy2(path, target)
+        return
+    _, mtime = size_mtime(path)
+    with open(target, 'wb') as f:
+        f.write(read_bytes(path))
+    os.utime(target, (mtime, mtime))